@@ -0,0 +1,85 @@
+"""
+Benchmarks of the main kernels of the thunderfish pipeline.
+
+The kernels are run on simulated recordings of three fish of different
+durations, sampled at 44.1kHz.
+"""
+
+import numpy as np
+from thunderfish.eoddetection import configuration, detect_eods
+from thunderfish.bestwindow import find_best_window
+from thunderfish.powerspectrum import multi_psd, multi_psd_args
+from thunderfish.harmonics import harmonic_groups, harmonic_groups_args
+from thunderfish.harmonics import psd_peak_detection_args
+from thunderfish.pulses import extract_pulsefish
+from thunderfish.eodanalysis import eod_waveform, analyze_wave, analyze_pulse
+from thunderfish.eodanalysis import eod_waveform_args, analyze_wave_args, analyze_pulse_args
+from .common import synthetic_recording
+
+
+class Kernels:
+    """ Main kernels of the pipeline on recordings of varying duration.
+    """
+
+    params = [2.0, 8.0, 32.0]
+    param_names = ['duration']
+    timeout = 600
+
+    def setup(self, duration):
+        self.samplerate = 44100.0
+        self.data = synthetic_recording(duration, self.samplerate, 3)
+        self.cfg = configuration('', False, '')
+        self.cfg.set('bestWindowSize', 0.5*duration)
+        self.psd_data = multi_psd(self.data, self.samplerate,
+                                  **multi_psd_args(self.cfg))
+        self.h_kwargs = psd_peak_detection_args(self.cfg)
+        self.h_kwargs.update(harmonic_groups_args(self.cfg))
+        groups = harmonic_groups(self.psd_data[0][:,0], self.psd_data[0][:,1],
+                                 **self.h_kwargs)[0]
+        self.wave_fish = groups[0]
+        self.wave_times = np.arange(0.0, duration, 1.0/self.wave_fish[0,0])
+        # pulse times of the first pulse fish (see synthetic_recording()):
+        self.pulse_times = np.arange(0.1, duration - 0.1, 1.0/30.0)
+        self.wave_eod, _ = eod_waveform(self.data, self.samplerate, self.wave_times,
+                                        win_fac=3.0, min_win=0.0,
+                                        **eod_waveform_args(self.cfg))
+        self.pulse_eod, self.pulse_times0 = \
+            eod_waveform(self.data, self.samplerate, self.pulse_times,
+                         win_fac=0.8, min_win=self.cfg.value('eodMinPulseSnippet'),
+                         **eod_waveform_args(self.cfg))
+
+    def time_find_best_window(self, duration):
+        find_best_window(self.data, self.samplerate, self.cfg)
+
+    def time_multi_psd(self, duration):
+        multi_psd(self.data, self.samplerate, **multi_psd_args(self.cfg))
+
+    def time_harmonic_groups(self, duration):
+        harmonic_groups(self.psd_data[0][:,0], self.psd_data[0][:,1],
+                        **self.h_kwargs)
+
+    def time_extract_pulsefish(self, duration):
+        extract_pulsefish(self.data, self.samplerate, 'synthetic')
+
+    def peakmem_extract_pulsefish(self, duration):
+        extract_pulsefish(self.data, self.samplerate, 'synthetic')
+
+    def time_eod_waveform(self, duration):
+        eod_waveform(self.data, self.samplerate, self.wave_times,
+                     win_fac=3.0, min_win=0.0, **eod_waveform_args(self.cfg))
+
+    def time_analyze_wave(self, duration):
+        analyze_wave(self.wave_eod, self.wave_fish, **analyze_wave_args(self.cfg))
+
+    def time_analyze_pulse(self, duration):
+        analyze_pulse(self.pulse_eod, self.pulse_times0,
+                      freq_resolution=self.cfg.value('frequencyResolution'),
+                      **analyze_pulse_args(self.cfg))
+
+    def time_detect_eods(self, duration):
+        detect_eods(self.data, self.samplerate, 0.0, -1.0, 1.0, 'synthetic',
+                    0, 0, self.cfg)
+
+    def peakmem_detect_eods(self, duration):
+        detect_eods(self.data, self.samplerate, 0.0, -1.0, 1.0, 'synthetic',
+                    0, 0, self.cfg)
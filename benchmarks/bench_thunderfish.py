@@ -0,0 +1,98 @@
+"""
+Benchmarks of the full thunderfish pipeline.
+
+Each benchmark analyzes a recording with `thunderfish()` and saves the
+results to files, without plotting. The recordings are either the ones
+bundled in the data/ directory or simulated recordings scaled in
+duration, sampling rate, and number of fish.
+"""
+
+import os
+import shutil
+import tempfile
+from audioio import write_audio
+from thunderfish.eoddetection import configuration
+from thunderfish.thunderfish import thunderfish
+from .common import data_path, data_files, synthetic_recording
+
+
+class DataRecordings:
+    """ Analysis of the recordings in the data/ directory.
+    """
+
+    params = data_files()
+    param_names = ['recording']
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, recording):
+        self.file_path = os.path.join(data_path, recording)
+        self.cfg = configuration('', False, self.file_path)
+        self.output_folder = tempfile.mkdtemp()
+
+    def teardown(self, recording):
+        shutil.rmtree(self.output_folder)
+
+    def time_thunderfish(self, recording):
+        thunderfish(self.file_path, self.cfg, save_data=True,
+                    output_folder=self.output_folder)
+
+    def peakmem_thunderfish(self, recording):
+        thunderfish(self.file_path, self.cfg, save_data=True,
+                    output_folder=self.output_folder)
+
+
+class SyntheticRecording:
+    """ Analysis of a simulated recording as a whole.
+
+    Each subclass varies one of duration, sampling rate and number
+    of fish, the others are kept at 8s, 44.1kHz and 3 fish.
+    """
+
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup_recording(self, duration=8.0, samplerate=44100.0, nfish=3):
+        self.output_folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.output_folder, 'synthetic.wav')
+        data = synthetic_recording(duration, samplerate, nfish)
+        write_audio(self.file_path, data, samplerate)
+        self.cfg = configuration('', False, self.file_path)
+        self.cfg.set('bestWindowSize', 0.0)
+
+    def teardown(self, *params):
+        shutil.rmtree(self.output_folder)
+
+    def time_thunderfish(self, *params):
+        thunderfish(self.file_path, self.cfg, save_data=True,
+                    output_folder=self.output_folder)
+
+    def peakmem_thunderfish(self, *params):
+        thunderfish(self.file_path, self.cfg, save_data=True,
+                    output_folder=self.output_folder)
+
+
+class SyntheticDuration(SyntheticRecording):
+    params = [2.0, 8.0, 32.0]
+    param_names = ['duration']
+
+    def setup(self, duration):
+        self.setup_recording(duration=duration)
+
+
+class SyntheticSamplerate(SyntheticRecording):
+    params = [20000.0, 44100.0, 96000.0]
+    param_names = ['samplerate']
+
+    def setup(self, samplerate):
+        self.setup_recording(samplerate=samplerate)
+
+
+class SyntheticFishCount(SyntheticRecording):
+    params = [1, 3, 6]
+    param_names = ['nfish']
+
+    def setup(self, nfish):
+        self.setup_recording(nfish=nfish)
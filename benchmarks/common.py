@@ -0,0 +1,74 @@
+"""
+Recordings used by the benchmarks.
+
+## Functions
+- `data_files()`: the recordings bundled in the data/ directory.
+- `synthetic_recording()`: simulate a recording of wave and pulse fish.
+"""
+
+import os
+import glob
+import numpy as np
+from thunderfish.fakefish import wavefish_eods, pulsefish_eods
+
+
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'data')
+
+wave_species = ['Alepto', 'Eigenmannia', 'Sternarchella', 'Arostratus']
+pulse_species = ['Biphasic', 'Monophasic', 'Triphasic']
+
+
+def data_files():
+    """ The recordings bundled in the data/ directory.
+
+    Returns
+    -------
+    files: list of strings
+        Base names of the wav files in the data/ directory.
+    """
+    return sorted(os.path.basename(f) for f in
+                  glob.glob(os.path.join(data_path, '*.wav')))
+
+
+def synthetic_recording(duration=8.0, samplerate=44100.0, nfish=3, seed=1):
+    """ Simulate a recording of wave and pulse fish.
+
+    Every even fish is a wave fish with EOD frequency increasing from
+    400Hz in steps of 173Hz, every odd fish is a pulse fish with pulse
+    rate increasing from 30Hz in steps of 13Hz. Pulse fish are five
+    times larger than wave fish and amplitudes decrease with the index
+    of the fish.
+
+    Parameters
+    ----------
+    duration: float
+        Duration of the recording in seconds.
+    samplerate: float
+        Sampling rate of the recording in Hertz.
+    nfish: int
+        Number of fish in the recording.
+    seed: int
+        Seed for the random number generator, making the recording reproducible.
+
+    Returns
+    -------
+    data: 1-D array
+        The simulated recording.
+    """
+    np.random.seed(seed)
+    n = len(np.arange(0, duration, 1.0/samplerate))
+    data = 0.2*np.random.randn(n)
+    for k in range(nfish):
+        i = k//2
+        if k % 2 == 0:
+            fish = wavefish_eods(wave_species[i % len(wave_species)],
+                                 400.0 + 173.0*i, samplerate, duration,
+                                 phase0=2.0*np.pi*np.random.rand(), noise_std=0.0)
+        else:
+            fish = 5.0*pulsefish_eods(pulse_species[i % len(pulse_species)],
+                                      30.0 + 13.0*i, samplerate, duration,
+                                      noise_std=0.0, jitter_cv=0.1)
+        data[:len(fish)] += fish[:n]/(1.0 + 0.5*k)
+    return 0.05*data
+
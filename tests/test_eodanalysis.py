@@ -4,6 +4,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from thunderfish.fakefish import wavefish_eods, pulsefish_eods
 from thunderfish.eventdetection import detect_peaks
+from thunderfish.powerspectrum import psd
 import thunderfish.eodanalysis as ea
 
 
@@ -19,6 +20,12 @@ def test_pulsefish():
     fig.savefig('pulse.png')
     assert_true(os.path.exists('pulse.png'), 'plotting failed')
     os.remove('pulse.png')
+    # power of pulse train:
+    freqs, _ = psd(data, samplerate, 1.0, window='hann')
+    power = ea.pulse_train_spectrum(mean_eod[:,1], samplerate, props['period'],
+                                    0.0, freqs, window='hann')
+    assert_almost_equal(np.sum(power)*(freqs[1]-freqs[0])/np.var(data), 1.0, 1,
+                        'total power of pulse train differs from variance')
 
 def test_wavefish():
     samplerate = 44100.0
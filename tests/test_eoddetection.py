@@ -0,0 +1,70 @@
+from nose.tools import assert_equal, assert_true, assert_raises
+import os
+import numpy as np
+from audioio import write_audio
+from thunderfish.fakefish import pulsefish_eods, wavefish_eods
+import thunderfish.eoddetection as ed
+
+
+def pulse_window(toffs, eodf, eod, times):
+    """ Window with a single pulse fish as needed by merge_eods(). """
+    props = {'type': 'pulse', 'EODf': eodf, 'p-p-amplitude': np.ptp(eod[:,1]),
+             'times': times, 'peaktimes': times}
+    eods = (None, [], [], [props], [eod], [np.zeros((0, 2))],
+            [np.zeros((0, 3))], None, [], [])
+    return (toffs, toffs, toffs + 10.0, eods)
+
+
+def test_merge_eods():
+    t = np.arange(-0.002, 0.002, 1.0/44100.0)
+    biphasic = np.column_stack((t, np.exp(-0.5*((t-0.0002)/0.0002)**2) -
+                                np.exp(-0.5*((t+0.0002)/0.0002)**2)))
+    monophasic = np.column_stack((t, np.exp(-0.5*(t/0.0003)**2)))
+    times = np.arange(0.0, 10.0, 0.05)
+    # same waveform and similar EODf:
+    merged = ed.merge_eods([pulse_window(0.0, 20.0, biphasic, times),
+                            pulse_window(10.0, 20.5, biphasic, times)])
+    assert_equal(len(merged[2]), 1, 'same pulse fish should be merged')
+    assert_equal(merged[2][0]['n'], 2*len(times), 'EOD times should be merged')
+    # different waveforms and similar EODf:
+    merged = ed.merge_eods([pulse_window(0.0, 20.0, biphasic, times),
+                            pulse_window(10.0, 20.5, monophasic, times)])
+    assert_equal(len(merged[2]), 2, 'pulse fish with different waveforms should not be merged')
+
+
+def test_detect_eods_stream():
+    samplerate = 44100.0
+    cfg = ed.configuration('', False)
+    cfg.set('streamWindowSize', 4.0)
+    cfg.set('streamWindowOverlap', 1.0)
+    filename = 'test_stream.wav'
+    np.random.seed(0)
+    data = pulsefish_eods('Biphasic', 40.0, samplerate, 10.0, noise_std=0.01)
+    write_audio(filename, 0.5*data, samplerate)
+    results = ed.detect_eods_stream(filename, 0, cfg)
+    n = max([p['n'] for p in results[10] if p['type'] == 'pulse'])
+    assert_true(n > 0.7*40.0*10.0, 'EODs of all windows should be merged into one fish')
+    write_audio(filename, np.zeros(1), samplerate)
+    assert_raises(ValueError, ed.detect_eods_stream, filename, 0, cfg)
+    os.remove(filename)
+
+
+def test_detect_eods_threads():
+    samplerate = 44100.0
+    np.random.seed(1)
+    data = 0.2*wavefish_eods('Eigenmannia', 523.0, samplerate, 8.0, noise_std=0.01)
+    data += 0.3*wavefish_eods('Eigenmannia', 730.0, samplerate, 8.0)
+    data += 0.5*pulsefish_eods('Biphasic', 30.0, samplerate, 8.0)
+    results = []
+    for threads in [1, 3]:
+        cfg = ed.configuration('', False)
+        cfg.set('analysisThreads', threads)
+        results.append(ed.detect_eods(data, samplerate, 0.0, -1.0, 1.0,
+                                      'test', 0, 0, cfg))
+    props1, props3 = results[0][3], results[1][3]
+    assert_equal(len(props1), len(props3), 'threads should detect the same fish')
+    assert_true(len(props1) > 1, 'fish should be detected')
+    for p1, p3 in zip(props1, props3):
+        assert_equal(p1['type'], p3['type'], 'threads should detect the same fish')
+        assert_equal(p1['EODf'], p3['EODf'], 'threads should detect the same fish')
+    assert_equal(list(results[0][2]), list(results[1][2]), 'threads should keep the same wave fish')
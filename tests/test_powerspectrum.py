@@ -20,6 +20,13 @@ def test_powerspectrum():
                  'peak in PSD is not the fundamental frequency given.')
     assert_equal(round(psd_data[1][np.argmax(psd_data[1][:,1]),0]), fundamental,
                  'peak in PSD is not the fundamental frequency given.')
+
+    # run multi_psd on threads:
+    psd_data_threads = ps.multi_psd(data, samplerate, freq_resolution=[0.5, 1],
+                                    workers=2)
+    for psd, psd_threads in zip(psd_data, psd_data_threads):
+        assert_true(np.all(psd == psd_threads),
+                    'PSDs computed on threads differ')
     # run multi_psd with 1 fresolutions (float)
     psd_data = ps.multi_psd(data, samplerate, freq_resolution=0.5)
 
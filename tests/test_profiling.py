@@ -0,0 +1,74 @@
+from nose.tools import assert_equal, assert_true
+import thunderfish.profiling as pf
+import numpy as np
+import os
+import threading
+import tracemalloc
+
+
+def test_profiling():
+    # disabled profiling does not record anything:
+    pf.clear_profile()
+    with pf.stage('a'):
+        pass
+    assert_equal(pf.profile_table().rows(), 0, 'disabled profiling should not record stages')
+
+    # nested stages:
+    pf.enable_profiling()
+    assert_true(pf.profiling_enabled(), 'profiling should be enabled')
+    for k in range(2):
+        with pf.stage('a'):
+            x = np.zeros(100000)
+            with pf.stage('b'):
+                y = np.ones(1000)
+    pf.disable_profiling()
+    td = pf.profile_table()
+    assert_equal(list(td[:,'stage']), ['a', 'a/b'], 'stages should be nested')
+    assert_equal(list(td[:,'calls']), [2, 2], 'stages should be counted')
+    assert_true(td[0,'wall'] >= td[1,'wall'], 'enclosing stage should take longer')
+
+    fp = pf.save_profile('test', table_format='csv')
+    assert_true(os.path.exists(fp), 'profile table should be written')
+    os.remove(fp)
+    pf.clear_profile()
+
+
+def test_profiling_context():
+    # each run records into its own profile:
+    with pf.profiling() as profile1:
+        with pf.stage('a'):
+            pass
+    assert_true(not pf.profiling_enabled(), 'profiling should be disabled after run')
+    try:
+        with pf.profiling() as profile2:
+            with pf.stage('b'):
+                raise ValueError()
+    except ValueError:
+        pass
+    assert_true(not pf.profiling_enabled(), 'profiling should be disabled after exception')
+    assert_equal(list(profile1.table()[:,'stage']), ['a'], 'stages of first run')
+    assert_equal(list(profile2.table()[:,'stage']), ['b'], 'stages should not accumulate over runs')
+    with pf.profiling(False) as profile3:
+        assert_true(profile3 is None, 'no profile if not enabled')
+        assert_true(not pf.profiling_enabled(), 'profiling should not be enabled')
+
+
+def test_profiling_threads():
+    def worker():
+        with pf.stage('w'):
+            y = np.ones(1000000)
+    with pf.profiling() as profile:
+        with pf.stage('a'):
+            threads = [threading.Thread(target=worker) for k in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+    td = profile.table()
+    assert_equal(list(td[:,'stage']), ['a', 'w'], 'stages of worker threads')
+    assert_equal(list(td[:,'calls']), [1, 2], 'stages of both workers should be counted')
+    assert_true(np.isnan(td[1,'memory']), 'no peak memory for stages of worker threads')
+    if hasattr(tracemalloc, 'reset_peak'):
+        assert_true(td[0,'memory'] >= 7.5, 'peak memory of main thread should include worker threads')
+    else:
+        assert_true(np.isnan(td[0,'memory']), 'no peak memory without tracemalloc.reset_peak()')
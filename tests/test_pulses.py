@@ -0,0 +1,377 @@
+from nose.tools import assert_equal, assert_true, assert_raises
+import numpy as np
+import os
+import shutil
+from scipy.interpolate import interp1d
+from thunderfish.fakefish import pulsefish_eods
+from thunderfish.dataloader import load_data
+from thunderfish.eventdetection import detect_peaks
+import thunderfish.pulses as pp
+
+
+def test_interpolated_data():
+    data = np.random.randn(1000)
+    interp_f = 11
+    idata = pp.InterpolatedData(data, interp_f)
+    f = interp1d(range(len(data)), data, kind='quadratic')
+    fdata = f(np.arange(0, len(data)-1, 1/interp_f))
+    assert_equal(len(idata), len(fdata), 'length of interpolated data differs')
+    assert_true(np.allclose(idata[:], fdata), 'interpolated data differ')
+    assert_true(np.allclose(idata[100:250], fdata[100:250]), 'slice of interpolated data differs')
+    assert_true(np.allclose(idata[-20:], fdata[-20:]), 'negative slice of interpolated data differs')
+    idx = np.array([[0, 5, 17], [3000, 4000, len(fdata)-1]])
+    assert_true(np.allclose(idata[idx], fdata[idx]), 'indexed interpolated data differ')
+    assert_true(np.allclose(idata[123], fdata[123]), 'single interpolated value differs')
+    assert_raises(IndexError, idata.__getitem__, len(fdata))
+    # cached blocks:
+    idata = pp.InterpolatedData(data, interp_f, block_size=100, max_blocks=3)
+    assert_true(np.allclose(idata[150:380], fdata[150:380]), 'interpolated data from cached blocks differ')
+    assert_equal(len(idata.blocks), 3, 'number of cached blocks differs')
+    assert_true(np.allclose(idata[idx], fdata[idx]), 'interpolated data bypassing the cache differ')
+    assert_true(np.allclose(idata[140:160], fdata[140:160]), 'interpolated data from cached blocks differ')
+
+
+def test_interpolated_peaks():
+    # peaks and troughs of a bundled recording are the same as the
+    # ones detected on the fully interpolated data:
+    filename = os.path.join(os.path.dirname(__file__), '..', 'data',
+                            'Brachyhypopomus-Fishfinder-Panama-RioCanita-2014-05-17-L19.wav')
+    data, samplerate, _ = load_data(filename, 0)
+    data = data[:int(5*samplerate)]
+    threshold = pp.detect_threshold(data, samplerate)
+    interp_f = int(500000/samplerate)
+    fdata = interp1d(range(len(data)), data, kind='quadratic')(np.arange(0, len(data)-1, 1/interp_f))
+    peaks, troughs = detect_peaks(fdata, threshold)
+    idata = pp.InterpolatedData(data, interp_f, block_size=10000)
+    x, y = idata.extrema()
+    ipeaks, itroughs = detect_peaks(y, threshold)
+    assert_equal(list(x[ipeaks]), list(peaks), 'peaks of interpolated data differ')
+    assert_equal(list(x[itroughs]), list(troughs), 'troughs of interpolated data differ')
+    # EODs as extracted from the fully interpolated data:
+    dpeaks, dtroughs, hights, widths = pp.detect_eod_peaks(peaks, troughs, fdata, 0.01*500000, 2*interp_f)[:4]
+    dpeaks, dtroughs, hights, widths = pp.discard_connecting_eods(dpeaks, dtroughs, hights, widths)
+    w = np.max(widths)*3
+    cut = (dpeaks + w < len(fdata)) & (dtroughs + w < len(fdata)) & (dpeaks - w > 0) & (dtroughs - w > 0)
+    x_peak, x_trough, x_hights, x_widths = pp.extract_eod_times(data, samplerate, 3)[:4]
+    assert_equal(list(x_peak), list(dpeaks[cut]), 'EOD peaks differ from fully interpolated data')
+    assert_equal(list(x_trough), list(dtroughs[cut]), 'EOD troughs differ from fully interpolated data')
+    assert_equal(list(x_widths), list(widths[cut]), 'EOD widths differ from fully interpolated data')
+
+
+def test_extract_eod_times():
+    samplerate = 44100.0
+    data = pulsefish_eods('Biphasic', 80.0, samplerate, 2.0, noise_std=0.01)
+    x_peak, _, _, _, _, _, interp_f, _ = pp.extract_eod_times(data, samplerate, 3)
+    ax_peak, _, _, _, _, _, ainterp_f, _ = pp.extract_eod_times(data, samplerate, 3, eod_samples=10)
+    assert_true(ainterp_f < interp_f, 'adaptive interpolation factor should be smaller')
+    assert_true(len(ax_peak) >= 0.95*80.0*2.0, 'adaptive interpolation should detect all EODs')
+    assert_true(len(ax_peak) <= len(x_peak) + 2, 'adaptive interpolation should not detect more EODs')
+    # by default peak widths are limited relative to interp_freq:
+    time = np.arange(0.0, 1.0, 1.0/samplerate)
+    data = np.sin(2.0*np.pi*49.5*time) + 0.001*np.random.randn(len(time))
+    _, _, _, widths, _, _, interp_f, _ = pp.extract_eod_times(data, samplerate, 0.1)
+    assert_true(np.max(widths) > 0.01*samplerate*interp_f, 'maximum peak width should be relative to interp_freq')
+    assert_true(np.max(widths) <= 0.01*500000, 'maximum peak width should be relative to interp_freq')
+
+
+def test_detect_threshold():
+    samplerate = 44100.0
+    data = np.random.randn(100000)
+    win_size_indices = int(0.0005*samplerate)
+    step = len(data)//1000
+    stds = [np.std(data[i:i+win_size_indices])
+            for i in range(0, len(data)-win_size_indices, step)]
+    threshold = np.median(stds)*6.0
+    assert_true(np.isclose(pp.detect_threshold(data, samplerate), threshold), 'threshold differs')
+    assert_true(np.isclose(pp.detect_threshold_stream(data, samplerate, block_size=0.1), threshold),
+                'threshold computed from blocks differs')
+
+
+def test_discard_connecting_eods():
+    x_peak = np.array([10, 20, 30, 40, 50])
+    x_trough = np.array([15, 15, 35, 45, 45])
+    hights = np.array([1.0, 2.0, 1.0, 1.0, 1.1])
+    widths = np.array([5, 5, 5, 5, 5])
+    xp, xt, h, w = pp.discard_connecting_eods(x_peak, x_trough, hights, widths)
+    assert_equal(list(xp), [20, 30, 50], 'EODs with smaller slope or hight at shared troughs should be discarded')
+    assert_equal(list(xt), [15, 35, 45], 'troughs of remaining EODs differ')
+
+
+def test_extract_snippets():
+    data = np.random.randn(5000)
+    eod_x = np.array([100, 1000, 2345, 4000])
+    for width in [10, 12.5]:
+        snippets = np.vstack([data[int(x-width):int(x+width)] for x in eod_x])
+        assert_true(np.array_equal(pp.extract_snippets(data, eod_x, width), snippets), 'snippets differ')
+        idata = pp.InterpolatedData(data, 3)
+        isnippets = np.vstack([idata[int(x-width):int(x+width)] for x in 3*eod_x])
+        assert_true(np.allclose(pp.extract_snippets(idata, 3*eod_x, width, block_size=50), isnippets),
+                    'interpolated snippets differ')
+    cache = {}
+    snippets = pp.extract_snippets(data, eod_x, 10, cache)
+    assert_true(pp.extract_snippets(data, eod_x, 10, cache) is snippets, 'snippets should be cached')
+
+
+def test_label_sums():
+    x = np.random.randn(500, 20)
+    labels = np.random.randint(-1, 5, len(x)).astype(float)
+    unique_labels, counts, sums = pp.label_sums(x, labels)
+    groups = pp.label_groups(labels)
+    assert_true(np.array_equal(unique_labels, np.unique(labels[labels>=0])), 'negative labels should be ignored')
+    assert_true(np.array_equal(groups[0], unique_labels), 'label_groups() should return the same labels')
+    for label, n, s, idx in zip(unique_labels, counts, sums, groups[1]):
+        assert_equal(n, np.sum(labels==label), 'wrong number of rows')
+        assert_true(np.allclose(s, np.sum(x[labels==label], axis=0)), 'wrong sums')
+        assert_true(np.array_equal(idx, np.nonzero(labels==label)[0]), 'wrong indices')
+
+
+def test_bgm_1d():
+    from sklearn.mixture import BayesianGaussianMixture
+    x = np.concatenate([0.3*np.random.randn(300) + 4.0, 0.5*np.random.randn(500) + 2.0,
+                        np.random.randn(200)])
+    bgm = BayesianGaussianMixture(n_components=5, max_iter=200, n_init=5, random_state=2)
+    labels = bgm.fit_predict(x.reshape(-1, 1))
+    blabels, gaussians, converged = pp.bgm_1d(x, 5, random_state=2)
+    assert_true(np.array_equal(blabels, labels), 'labels differ from sklearn')
+    assert_true(np.allclose(gaussians[:,1], bgm.means_[:,0]), 'means differ from sklearn')
+    assert_true(np.allclose(gaussians[:,2], bgm.covariances_[:,0,0]), 'variances differ from sklearn')
+    xi = np.random.randint(0, 20, 2000)
+    labels1, _ = pp.BGM(xi, 0.1, 3)
+    labels2, _ = pp.BGM(xi, 0.1, 3)
+    assert_true(np.array_equal(labels1, labels2), 'BGM should be deterministic')
+    # heavy outliers leave less than n_gaus filled histogram bins:
+    xo = np.concatenate([0.3*np.random.randn(1500) + 4.0, np.random.randn(1500), [1e6, -1e6]])
+    labels, _ = pp.BGM(xo, 0.1, 5, max_bins=1000)
+    assert_equal(len(labels), len(xo), 'BGM should label all samples despite outliers')
+    assert_equal(len(np.unique(labels)), 3, 'BGM should separate outliers from the data')
+
+
+def test_cluster_workers():
+    samplerate = 44100.0
+    data = pulsefish_eods('Biphasic', 80.0, samplerate, 2.0, noise_std=0.01)
+    data += 0.5*pulsefish_eods('Triphasic', 47.0, samplerate, 2.0, noise_std=0.0)
+    _, eod_times1, _, _, _ = pp.extract_pulsefish(data, samplerate, 'test', workers=1)
+    _, eod_times2, _, _, _ = pp.extract_pulsefish(data, samplerate, 'test', workers=3)
+    assert_equal(len(eod_times1), len(eod_times2), 'number of detected fish should not depend on workers')
+    for t1, t2 in zip(eod_times1, eod_times2):
+        assert_true(np.array_equal(t1, t2), 'EOD times should not depend on workers')
+
+
+def test_cluster_on_shape():
+    from sklearn.metrics import pairwise_distances
+    from sklearn.cluster import DBSCAN
+    rng = np.random.RandomState(3)
+    centers = 0.02*rng.randn(3, 5)
+    features = np.vstack([c + 0.002*rng.randn(40, 5) for c in centers] +
+                         [0.05*rng.randn(10, 5)])
+    # tied distances from duplicate rows:
+    features = np.vstack((features, features[:15], features[50:52], features[50:52]))
+    # epsilon from the neighbor distances, and limited by max_epsilon for the scaled features:
+    for scale, ratio, minp in [(1, 0.0, 10), (1, 1.0, 5), (1, 0.0, 3), (2, 0.0, 10)]:
+        x = scale*features
+        bg_ratio = np.zeros(len(x)) + ratio
+        minpc = max(minp, int(len(x)*0.01))
+        knn = np.sort(pairwise_distances(x, x), axis=0)[minpc]
+        eps = min(max(1, 4*np.median(bg_ratio))*0.01, np.percentile(knn, 80))
+        labels = DBSCAN(eps=eps, min_samples=minpc).fit(x).labels_
+        assert_true(np.array_equal(pp.cluster_on_shape(x, bg_ratio, minp), labels),
+                    'labels should equal DBSCAN on brute-force epsilon')
+        assert_true(len(np.unique(labels[labels>=0])) >= 3, 'clusters should be found')
+
+def delete_moving_fish_loop(clusters, eod_t, T, eod_hights, eod_widths, samplerate,
+                            min_dt=0.25, stepsize=0.05, sliding_window_factor=2000):
+    """ Clusters kept by delete_moving_fish() checking all EODs in each window. """
+    width_classes = pp.merge_gaussians(eod_widths, np.copy(clusters), 0.75)
+    all_keep_clusters = []
+    all_windows = []
+    all_dts = []
+    for w in np.unique(width_classes[clusters>=0]):
+        min_clusters = 100
+        average_hight = 0
+        sparse_clusters = 100
+        keep_clusters = []
+        dt = max(min_dt, np.median(eod_widths[width_classes==w])*sliding_window_factor)
+        window_end = dt
+        wclusters = clusters[width_classes==w]
+        weod_t = eod_t[width_classes==w]
+        weod_hights = eod_hights[width_classes==w]
+        all_dts.append(dt)
+        x = np.arange(0, T-dt+stepsize, stepsize)
+        ignore_steps = np.zeros(len(x))
+        for i, t in enumerate(x):
+            if len(np.unique(wclusters[(weod_t>=t)&(weod_t<t+dt)&(wclusters!=-1)])) == 0:
+                ignore_steps[i-int(dt/stepsize):i+int(dt/stepsize)] = 1
+        for t, ignore_step in zip(x, ignore_steps):
+            current_clusters = np.unique(wclusters[(weod_t>=t)&(weod_t<t+dt)&(wclusters!=-1)])
+            if len(current_clusters) <= min_clusters and ignore_step == 0 and len(current_clusters) > 0:
+                current_hight = np.mean(weod_hights[np.isin(wclusters, current_clusters)])
+                sel = np.isin(clusters, current_clusters)
+                after = np.unique(pp.remove_sparse_detections(np.copy(clusters[sel]), samplerate*eod_widths[sel], samplerate, T))
+                current_sparse_clusters = len(current_clusters) - len(after[after!=-1])
+                if current_sparse_clusters <= sparse_clusters and (current_sparse_clusters < sparse_clusters or current_hight > average_hight or len(current_clusters) < min_clusters):
+                    keep_clusters = current_clusters
+                    min_clusters = len(current_clusters)
+                    average_hight = current_hight
+                    window_end = t + dt
+                    sparse_clusters = current_sparse_clusters
+        all_keep_clusters.append(keep_clusters)
+        all_windows.append(window_end)
+    clusters[np.invert(np.isin(clusters, np.concatenate(all_keep_clusters)))] = -1
+    return clusters, [np.max(all_windows)-np.max(all_dts), np.max(all_windows)]
+
+
+def test_delete_moving_fish():
+    samplerate = 44100.0
+    T = 10.0
+    rng = np.random.RandomState(5)
+    # label, rate, start, end, height, width:
+    fish = [(0, 50.0, 0.0, 5.5, 1.0, 0.0005), (1, 30.0, 2.0, 5.0, 0.5, 0.0005),
+            (2, 40.0, 7.0, 10.0, 0.8, 0.0005), (3, 20.0, 0.0, 10.0, 0.3, 0.002),
+            (-1, 20.0, 0.0, 10.0, 0.1, 0.0005)]
+    eod_t = []
+    clusters = []
+    hights = []
+    widths = []
+    for label, rate, t0, t1, hight, width in fish:
+        t = np.arange(t0, t1, 1.0/rate) + 0.001*rng.rand()
+        eod_t.append(t)
+        clusters.append(np.zeros(len(t)) + label)
+        hights.append(hight*(1.0 + 0.05*rng.randn(len(t))))
+        widths.append(width*(1.0 + 0.05*rng.randn(len(t))))
+    eod_t, clusters, hights, widths = [np.concatenate(a) for a in (eod_t, clusters, hights, widths)]
+    for labels in [clusters, np.where(clusters == 1, -1, clusters)]:
+        kept, window, _ = pp.delete_moving_fish(np.copy(labels), eod_t, T, hights, widths, samplerate)
+        ref_kept, ref_window = delete_moving_fish_loop(np.copy(labels), eod_t, T, hights, widths, samplerate)
+        assert_true(np.array_equal(kept, ref_kept), 'kept clusters should equal direct computation')
+        assert_true(np.allclose(window, ref_window), 'window should equal direct computation')
+        assert_true(np.any(kept == 3) and np.any(kept < 0), 'clusters should be kept and deleted')
+    kept, window, _ = pp.delete_moving_fish(-np.ones(len(eod_t)), eod_t, T, hights, widths, samplerate)
+    assert_true(np.all(kept == -1), 'no clusters without labels')
+    assert_equal(window, [0, 1], 'default window without clusters')
+
+def test_pulse_model():
+    samplerate = 44100.0
+    data = pulsefish_eods('Biphasic', 80.0, samplerate, 2.0, noise_std=0.01)
+    _, eod_times, _, _, model = pp.classify_pulsefish(data, samplerate, 'test')
+    assert_equal(len(model['labels']), len(eod_times), 'model should contain all detected fish')
+    fp = pp.save_pulse_model('test_pulse_model', model)
+    model = pp.load_pulse_model(fp)
+    os.remove(fp)
+    _, times, _, _, quality = pp.predict_pulsefish(data, samplerate, model)
+    assert_true(quality > 0.9, 'model should fit the recording it was fitted on')
+    assert_equal(len(times), len(eod_times), 'model should classify the same fish')
+    assert_true(np.mean(np.isin(np.concatenate(eod_times), np.concatenate(times))) > 0.95,
+                'model should classify the same EODs')
+    _, _, _, _, quality = pp.predict_pulsefish(0.01*np.random.randn(len(data)), samplerate, model)
+    assert_true(quality < 0.5, 'model should not fit a recording without fish')
+    # model of adaptively interpolated data:
+    data = pulsefish_eods('Triphasic', 80.0, samplerate, 2.0, noise_std=0.01)
+    _, eod_times, _, _, model = pp.classify_pulsefish(data, samplerate, 'test', eod_samples=10)
+    refits = []
+    extract_pulsefish = pp.extract_pulsefish
+    def extract_pulsefish_refit(*args, **kwargs):
+        refits.append(args[2])
+        return extract_pulsefish(*args, **kwargs)
+    pp.extract_pulsefish = extract_pulsefish_refit
+    try:
+        _, times, _, _, model_refit = pp.classify_pulsefish(data, samplerate, 'test', model, eod_samples=10)
+    finally:
+        pp.extract_pulsefish = extract_pulsefish
+    assert_equal(len(refits), 0, 'model should not be refitted on the recording it was fitted on')
+    assert_true(model_refit is model, 'model should be kept')
+    assert_equal(len(times), len(eod_times), 'model should classify the same fish')
+    assert_true(np.mean(np.isin(np.concatenate(eod_times), np.concatenate(times))) > 0.95,
+                'EOD times should be taken from the same peaks or troughs')
+
+
+def test_extract_pulsefish_stream():
+    samplerate = 44100.0
+    data = pulsefish_eods('Biphasic', 80.0, samplerate, 6.0, noise_std=0.01)
+    mean_eods, eod_times, _, _ = pp.extract_pulsefish_stream(data, samplerate, 'test',
+                                                             block_size=2.0, overlap=0.5)
+    assert_equal(len(mean_eods), 1, 'fish should be matched across blocks')
+    assert_true(np.all(np.diff(eod_times[0]) > 0.5/80.0), 'EODs in overlaps should not be duplicated')
+    assert_true(len(eod_times[0]) > 0.9*80.0*6.0, 'EODs of all blocks should be detected')
+
+
+
+def test_stream_blocks():
+    samplerate = 1000.0
+    for n in [500, 6000, 6321]:
+        blocks = pp.stream_blocks(n, samplerate, 2.0, 0.5)
+        assert_equal(blocks[0][0], 0, 'first block should start at the beginning')
+        assert_equal(blocks[-1][1], n, 'last block should end at the end of the data')
+        assert_equal(blocks[0][2], 0.0, 'assigned parts should start at zero')
+        assert_equal(blocks[-1][3], n/samplerate, 'assigned parts should end at the end of the data')
+        for (i0, i1, t0, t1), (j0, j1, s0, s1) in zip(blocks[:-1], blocks[1:]):
+            assert_equal(t1, s0, 'assigned parts should not have gaps')
+            assert_true(j0 < i1, 'blocks should overlap')
+        for i0, i1, t0, t1 in blocks:
+            assert_true(i0/samplerate <= t0 < t1 <= i1/samplerate, 'assigned part should be within its block')
+
+
+def test_disk_log_sink():
+    samplerate = 44100.0
+    data = pulsefish_eods('Biphasic', 80.0, samplerate, 2.0, noise_std=0.01)
+    return_data = ['peak_detection', 'snippet_clusters', 'all_eod_times', 'moving_fish']
+    log_dict = pp.extract_pulsefish(data, samplerate, 'test', return_data=return_data)[-1]
+    path = 'test_pulse_log'
+    sink_dict = pp.extract_pulsefish(data, samplerate, 'test', return_data=return_data,
+                                     log_sink=pp.DiskLogSink(path))[-1]
+    assert_true(isinstance(sink_dict['data'], np.memmap), 'interpolated data should be written to disk')
+    assert_true(np.array_equal(sink_dict['data'], log_dict['data']), 'interpolated data should be logged')
+    assert_equal(sorted(sink_dict.keys()), sorted(log_dict.keys()), 'same data should be logged')
+    for key in log_dict:
+        if key.startswith('snippet_clusters'):
+            for k in log_dict[key]:
+                assert_true(np.array_equal(sink_dict[key][k], log_dict[key][k]), 'snippet clusters should be logged')
+    shutil.rmtree(path)
+
+
+def test_single_precision():
+    file_path = os.path.join(os.path.dirname(__file__), '..', 'data',
+                             'Brachyhypopomus-Fishfinder-Panama-RioCanita-2014-05-17-L19.wav')
+    data, samplerate, _ = load_data(file_path)
+    mean_eods, eod_times, _, _, _ = pp.extract_pulsefish(data[:,0], samplerate, file_path)
+    mean_eods32, eod_times32, _, _, _ = pp.extract_pulsefish(data[:,0], samplerate, file_path, dtype=np.float32)
+    assert_equal(len(eod_times32), len(eod_times), 'single precision should detect the same fish')
+    for times, times32, mean_eod, mean_eod32 in zip(eod_times, eod_times32, mean_eods, mean_eods32):
+        assert_equal(len(times32), len(times), 'single precision should detect the same EODs')
+        assert_true(np.allclose(times32, times, atol=1.0/samplerate), 'single precision EOD times should match')
+        assert_true(np.allclose(mean_eod32, mean_eod, atol=1e-4*np.ptp(mean_eod[1])), 'single precision mean EODs should match')
+
+
+def test_lazy_map():
+    from concurrent.futures import ThreadPoolExecutor
+    submitted = []
+    def square(x):
+        submitted.append(x)
+        return x*x
+    assert_equal(list(pp.lazy_map(square, range(10))), [x*x for x in range(10)],
+                 'lazy map should return all results')
+    with ThreadPoolExecutor(2) as executor:
+        submitted = []
+        results = pp.lazy_map(square, range(100), executor, 2)
+        assert_equal(list(results), [x*x for x in range(100)],
+                     'lazy map on executor should return results in order')
+        submitted = []
+        results = pp.lazy_map(square, range(100), executor, 2)
+        for k, r in enumerate(results):
+            if k == 4:
+                break
+        results.close()
+    assert_true(len(submitted) <= 7, 'lazy map should only submit items ahead')
+
+
+def test_submit_task():
+    from concurrent.futures import ThreadPoolExecutor
+    def outer(executor, n):
+        tasks = [pp.submit_task(executor, lambda x: x*x, k) for k in range(n)]
+        return [task() for task in tasks]
+    assert_equal(pp.submit_task(None, outer, None, 5)(), [0, 1, 4, 9, 16],
+                 'tasks without executor should return results')
+    with ThreadPoolExecutor(1) as executor:
+        # the only worker waits for the subtasks it submitted:
+        future = executor.submit(outer, executor, 5)
+        assert_equal(future.result(timeout=10), [0, 1, 4, 9, 16],
+                     'subtasks should be evaluated by the waiting task')
@@ -0,0 +1,72 @@
+from nose.tools import assert_equal, assert_true
+import numpy as np
+import thunderfish.pulsetracker as pt
+
+
+def cut_snippets_loop(data, event_locations, cut_width, int_met, int_fact=10):
+    """ Snippets interpolated and aligned one by one with crosscorrelation(). """
+    width = 2*cut_width
+    alignwidth = 50
+    ipoled_snips = []
+    for pos in event_locations.astype('int'):
+        snip = data[pos-cut_width:pos+cut_width]
+        if len(snip) < width:
+            snip = np.zeros(width)
+        interpoled_snip = pt.interpolated_array(snip, int_met, int_fact)
+        intsnipheight = np.max(interpoled_snip) - np.min(interpoled_snip)
+        if intsnipheight == 0:
+            intsnipheight = 1
+        ipoled_snips.append((interpoled_snip - np.max(interpoled_snip))/intsnipheight)
+    ipoled_snips = np.array(ipoled_snips).reshape(-1, (width-1)*int_fact)
+    mean = np.mean(ipoled_snips, axis=0)
+    aligned_snips = np.empty((len(ipoled_snips), ipoled_snips.shape[1]-2*alignwidth))
+    heights = np.zeros(len(ipoled_snips))
+    for i, interpoled_snip in enumerate(ipoled_snips):
+        cc = pt.crosscorrelation(interpoled_snip[alignwidth:-alignwidth], mean)
+        offset = -alignwidth + np.argmax(cc)
+        if offset != -alignwidth:
+            aligned_snips[i] = interpoled_snip[alignwidth-offset:-alignwidth-offset]
+        else:
+            aligned_snips[i] = interpoled_snip[2*alignwidth:]
+        heights[i] = np.max(aligned_snips[i]) - np.min(aligned_snips[i])
+    return aligned_snips, heights
+
+
+def test_crosscorrelations():
+    sigs = np.random.randn(5, 30)
+    data = np.random.randn(100)
+    cc = pt.crosscorrelations(sigs, data)
+    assert_equal(cc.shape, (5, 71), 'wrong shape of crosscorrelations')
+    for sig, c in zip(sigs, cc):
+        assert_true(np.allclose(c, pt.crosscorrelation(sig, data)), 'crosscorrelations differ')
+
+
+def test_interpolation_matrix():
+    data = np.random.randn(20)
+    for kind in ['linear', 'cubic']:
+        m = pt.interpolation_matrix(len(data), kind, 10)
+        assert_true(np.allclose(np.dot(data, m), pt.interpolated_array(data, kind, 10)),
+                    'interpolation matrix differs from interpolated_array()')
+        assert_true(pt.interpolation_matrix(len(data), kind, 10) is m, 'interpolation matrix should be cached')
+        assert_true(not m.flags.writeable, 'cached interpolation matrix should be read-only')
+
+
+def test_cut_snippets():
+    rate = 44100.0
+    t = np.arange(0.0, 0.5, 1.0/rate)
+    data = 0.01*np.random.randn(len(t))
+    locations = np.arange(10, len(t), 400) + np.random.randint(-3, 4, len(t[10::400]))
+    locations[0] = 10
+    locations[-1] = len(t) - 5
+    for pos in locations:
+        data[pos-3:pos+3] += np.random.rand()*np.array([0.2, 0.6, 1.0, -0.5, -0.3, -0.1])
+    for kind in ['cubic', 'linear']:
+        snips, heights = pt.cut_snippets(data, locations, 30, int_met=kind, int_fact=10)
+        ref_snips, ref_heights = cut_snippets_loop(data, locations, 30, kind, 10)
+        assert_equal(snips.shape, ref_snips.shape, 'wrong shape of snippets')
+        assert_true(np.allclose(snips, ref_snips, rtol=0.0, atol=1e-12), 'snippets differ')
+        assert_true(np.allclose(heights, ref_heights, rtol=0.0, atol=1e-12), 'heights differ')
+        assert_true(np.all(snips[0] == 0) and np.all(snips[-1] == 0), 'snippets at the edges should be zero')
+    snips, heights = pt.cut_snippets(data, np.zeros(0, dtype=int), 30, int_met='cubic', int_fact=10)
+    assert_equal(snips.shape, (0, 59*10-100), 'wrong shape of empty snippets')
+    assert_equal(len(heights), 0, 'no heights expected')
@@ -0,0 +1,71 @@
+from nose.tools import assert_equal, assert_not_equal, assert_true
+import thunderfish.resultcache as rc
+from thunderfish.eoddetection import configuration, analysis_args
+import numpy as np
+import shutil
+import os
+import time
+
+
+def test_result_cache():
+    cachedir = 'test_cache'
+    datafile = 'test_cache_data.dat'
+    with open(datafile, 'w') as df:
+        df.write('1 2 3\n')
+    cache = rc.ResultCache(cachedir, max_size=0.01)
+
+    # keys depend on recording, channel, and configuration:
+    key = cache.key(datafile, 0, {'a': 1.0})
+    assert_equal(key, cache.key(datafile, 0, {'a': 1.0}), 'keys should be the same')
+    assert_not_equal(key, cache.key(datafile, 1, {'a': 1.0}), 'keys should differ in channel')
+    assert_not_equal(key, cache.key(datafile, 0, {'a': 2.0}), 'keys should differ in configuration')
+    dcache = rc.ResultCache(cachedir, digest=True)
+    dkey = dcache.key(datafile, 0, {'a': 1.0})
+    with open(datafile, 'a') as df:
+        df.write('4 5 6\n')
+    assert_not_equal(dkey, dcache.key(datafile, 0, {'a': 1.0}), 'keys should differ in content')
+    vcache = rc.ResultCache(cachedir, version='0.0')
+    assert_not_equal(key, vcache.key(datafile, 0, {'a': 1.0}), 'keys should differ in code version')
+
+    # store and load:
+    assert_equal(cache.load(key), None, 'empty cache should not return results')
+    data = np.arange(100.0)
+    cache.store(key, (data, 'mV'))
+    results = cache.load(key)
+    assert_true(np.all(results[0] == data), 'cached data should be the same')
+    assert_equal(results[1], 'mV', 'cached unit should be the same')
+
+    # eviction of least recently used entries:
+    cache.max_size = 4*cache.size()
+    for k in range(3):
+        cache.store('k%d' % k, (np.arange(100.0), 'mV'))
+        time.sleep(0.01)
+    cache.load(key)
+    cache.store('k3', (np.arange(100.0), 'mV'))
+    assert_true(cache.size() <= cache.max_size, 'cache should not exceed size limit')
+    assert_true(cache.load(key) is not None, 'recently used entry should be kept')
+    assert_equal(cache.load('k0'), None, 'least recently used entry should be evicted')
+
+    shutil.rmtree(cachedir)
+    os.remove(datafile)
+
+
+def test_analysis_key():
+    cachedir = 'test_cache'
+    datafile = 'test_cache_data.dat'
+    with open(datafile, 'w') as df:
+        df.write('1 2 3\n')
+    cache = rc.ResultCache(cachedir)
+    cfg = configuration('', False)
+    cache.store(cache.key(datafile, 0, analysis_args(cfg)), (np.arange(10.0), 'mV'))
+    assert_true(cache.load(cache.key(datafile, 0, analysis_args(cfg))) is not None,
+                'same configuration should hit the cache')
+    cfg.set('pulseSinglePrecision', True)
+    assert_equal(cache.load(cache.key(datafile, 0, analysis_args(cfg))), None,
+                 'changed data type of pulse analysis should miss the cache')
+    cfg.set('pulseSinglePrecision', False)
+    cfg.set('pulseEODSamples', 10)
+    assert_equal(cache.load(cache.key(datafile, 0, analysis_args(cfg))), None,
+                 'changed interpolation of pulse analysis should miss the cache')
+    shutil.rmtree(cachedir)
+    os.remove(datafile)
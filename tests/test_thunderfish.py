@@ -0,0 +1,91 @@
+from nose.tools import assert_equal, assert_true
+import thunderfish.thunderfish as tf
+from thunderfish.eoddetection import configuration
+import numpy as np
+import time
+import os
+
+
+analyzed_log = 'test_thunderfish_analyzed.log'
+
+
+def analyze_stub(filename, cfg, multi_pdf=None, **kwargs):
+    with open(analyzed_log, 'a') as lf:
+        lf.write('%s %d\n' % (filename, os.getpid()))
+    if 'slow' in filename:
+        time.sleep(10.0)
+    if multi_pdf is not None:
+        import matplotlib.pyplot as plt
+        for k in range(2):
+            fig = plt.figure()
+            fig.suptitle('%s %d' % (filename, k))
+            multi_pdf.savefig(fig)
+    return None
+
+
+class PageCollector(object):
+    def __init__(self):
+        self.titles = []
+
+    def savefig(self, fig):
+        self.titles.append(fig._suptitle.get_text())
+
+
+def test_run_pool():
+    cfg = configuration('', False)
+    args = dict(cfg=cfg, verbose=-1)
+
+    # a missing file is reported as failed, not as success:
+    failed = tf.run_pool(['test_missing.wav'], 1, args, progress=False)
+    assert_equal(failed, ['test_missing.wav'], 'missing file should fail')
+
+    # largest file first, timeout, and fresh worker for each file:
+    files = ['test_small.dat', 'test_slow.dat', 'test_large.dat']
+    for f, n in zip(files, [10, 100, 1000]):
+        with open(f, 'wb') as df:
+            df.write(b'0'*n)
+    if os.path.exists(analyzed_log):
+        os.remove(analyzed_log)
+    thunderfish = tf.thunderfish
+    tf.thunderfish = analyze_stub
+    try:
+        failed = tf.run_pool(files, 1, args, timeout=0.5, max_tasks=1,
+                             progress=False)
+    finally:
+        tf.thunderfish = thunderfish
+    with open(analyzed_log) as lf:
+        analyzed = [l.split() for l in lf]
+    for f in files:
+        os.remove(f)
+    os.remove(analyzed_log)
+    assert_equal(failed, ['test_slow.dat'], 'analysis of slow file should time out')
+    assert_equal([a[0] for a in analyzed], files[::-1],
+                 'files should be analyzed largest first')
+    assert_equal(len(set(a[1] for a in analyzed)), len(files),
+                 'each file should be analyzed by a new worker')
+
+
+def test_figure_pages():
+    import matplotlib
+    matplotlib.use('Agg')
+    cfg = configuration('', False)
+    # files are analyzed largest first, but pages come in input order:
+    files = ['test_page_a.dat', 'test_page_b.dat', 'test_page_c.dat']
+    for f, n in zip(files, [10, 1000, 100]):
+        with open(f, 'wb') as df:
+            df.write(b'0'*n)
+    pages = PageCollector()
+    args = dict(cfg=cfg, multi_pdf=tf.FigurePages(), verbose=-1)
+    thunderfish = tf.thunderfish
+    tf.thunderfish = analyze_stub
+    try:
+        failed = tf.run_pool(files, 2, args, progress=False, multi_pdf=pages)
+    finally:
+        tf.thunderfish = thunderfish
+    for f in files:
+        os.remove(f)
+    if os.path.exists(analyzed_log):
+        os.remove(analyzed_log)
+    assert_equal(failed, [], 'no analysis should fail')
+    assert_equal(pages.titles, ['%s %d' % (f, k) for f in files for k in range(2)],
+                 'pages should be in the order of the input files')
@@ -23,11 +23,6 @@ Select the best region within a recording with the most stable signal of largest
 import numpy as np
 from .eventdetection import percentile_threshold, detect_peaks, trim_to_peak
 from audioio import unwrap
-try:
-    import matplotlib.pyplot as plt
-    import matplotlib.ticker as ticker
-except ImportError:
-    pass
 
 
 def clip_amplitudes(data, win_indices, min_fac=2.0, nbins=20,
@@ -113,6 +108,7 @@ def plot_clipping(data, winx0, winx1, bins,
     """Visualize the data histograms and the detected clipping amplitudes.
     Pass this function as the `plot_hist_func` argument to `clip_amplitudes()`.
     """
+    import matplotlib.pyplot as plt
     plt.subplot(2, 1, 1)
     plt.plot(data[winx0:winx1], 'b')
     plt.axhline(min_clip, color='r')
@@ -535,6 +531,7 @@ def plot_best_data(ax, data, samplerate, unit, idx0, idx1, clipped,
     window_color:
         Color used for plotting the selected best window.
     """
+    import matplotlib.ticker as ticker
     time = np.arange(len(data)) / samplerate
     ax.plot(time[:idx0], data[:idx0], color=data_color)
     ax.plot(time[idx1:], data[idx1:], color=data_color)
@@ -665,6 +662,7 @@ def find_best_window(raw_data, samplerate, cfg, show_bestwindow=False):
         best_window_size = (len(raw_data)-1)/samplerate
     # show cost function:
     if show_bestwindow:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(5, sharex=True, figsize=(14., 10.))
         try:
             idx0, idx1, clipped = best_window_indices(raw_data, samplerate,
@@ -693,6 +691,7 @@ def find_best_window(raw_data, samplerate, cfg, show_bestwindow=False):
 if __name__ == "__main__":
     print("Checking bestwindow module ...")
     import sys
+    import matplotlib.pyplot as plt
 
     title = "bestwindow"
     if len(sys.argv) < 2:
@@ -7,6 +7,7 @@ Analysis of EOD waveforms.
 - `analyze_wave()`: analyze the EOD waveform of a wave fish.
 - `analyze_pulse()`: analyze the EOD waveform of a pulse fish.
 - `adjust_eodf()`: adjust EOD frequencies to a standard temperature.
+- `pulse_train_spectrum()`: power spectral density of a train of pulse EODs.
 
 ## Quality assessment
 
@@ -56,8 +57,7 @@ Analysis of EOD waveforms.
 
 import numpy as np
 from scipy.optimize import curve_fit
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
+from scipy.signal import get_window
 from .eventdetection import percentile_threshold, detect_peaks, snippets, peak_width
 from .eventdetection import threshold_crossings, threshold_crossing_times, merge_events
 from .powerspectrum import next_power_of_two, nfft, decibel
@@ -888,6 +888,80 @@ def adjust_eodf(eodf, temp, temp_adjust=25.0, q10=1.62):
     return eodf * q10 ** ((temp_adjust - temp) / 10.0)
 
 
+def pulse_train_spectrum(eod, samplerate, period, period_std, freqs,
+                         window='hann', oversample=2):
+    """ Power spectral density of a train of pulse EODs.
+
+    The pulse train is modeled as a renewal process of identical pulses
+    with inter-pulse intervals drawn from a normal distribution.
+    The resulting power spectrum has peaks at multiples of the pulse rate
+    that broaden with frequency. This analytic spectrum is then smeared
+    by the spectral window of a power spectrum estimated via Welch's
+    method with the frequency resolution of `freqs`, i.e. it approximates
+    the power spectrum as computed by `psd()` of a recording of the pulse
+    train, without actually generating such a recording.
+
+    Parameters
+    ----------
+    eod: 1-D array
+        The waveform of a single pulse EOD.
+    samplerate: float
+        Sampling rate of the pulse EOD in Hertz.
+    period: float
+        Mean inter-pulse interval in seconds.
+    period_std: float
+        Standard deviation of the inter-pulse intervals in seconds.
+        Limited to at least 0.1% of `period`.
+    freqs: 1-D array
+        Equally spaced frequencies, starting at zero Hertz, as returned by
+        `psd()` for which the power spectral density is computed.
+    window: string
+        Window function used by `psd()` for windowing data segments.
+        Needs to be the one of the power spectrum `freqs` are taken from.
+    oversample: int
+        The spectrum is computed on a frequency grid that is this many times
+        finer than `freqs` before it is smeared by the spectral window.
+
+    Returns
+    -------
+    power: 1-D array
+        Power spectral density of the pulse train in [eod]^2/Hz
+        for each frequency in `freqs`.
+    """
+    df = freqs[1] - freqs[0]
+    n = int(np.round(samplerate/df))
+    n_fine = n*oversample
+    f = np.arange(n_fine//2 + 1)*samplerate/n_fine
+    # the spectrum of a single pulse is smooth and can be interpolated:
+    n_eod = next_power_of_two(8*len(eod))
+    eod_power = np.abs(np.fft.rfft(eod, n_eod)/samplerate)**2
+    eod_power = np.interp(f, np.arange(len(eod_power))*samplerate/n_eod, eod_power)
+    # the spectrum of the renewal process is the spectrum of a single
+    # pulse times a Poisson kernel (1-r^2)/(1-2r cos(theta)+r^2) with
+    # theta = 2 pi f period. The Poisson kernel is averaged over each
+    # frequency bin of the fine grid, because its peaks can be much
+    # narrower than a bin:
+    period_std = max(period_std, 0.001*period)
+    r = np.exp(-2.0*(np.pi*f*period_std)**2)
+    theta0 = 2.0*np.pi*(f - 0.5*samplerate/n_fine)*period
+    theta1 = 2.0*np.pi*(f + 0.5*samplerate/n_fine)*period
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = (1.0 + r)/(1.0 - r)
+        kernel_int = lambda theta: 2.0*np.arctan(c*np.tan(0.5*theta)) + \
+            2.0*np.pi*np.floor((theta + np.pi)/(2.0*np.pi))
+        power = 2.0*eod_power/period*(kernel_int(theta1) - kernel_int(theta0))/(theta1 - theta0)
+    power[0] = 0.0   # removed by detrending
+    # spectral window of the Welch segments, its shape in units of
+    # frequency bins is independent of the segment length:
+    w = get_window(window, min(n, 1024))
+    kernel = np.abs(np.fft.fft(w, len(w)*oversample))**2
+    nk = 4*oversample
+    kernel = np.concatenate((kernel[-nk:], kernel[:nk+1]))
+    kernel /= np.sum(kernel)
+    power = np.convolve(power, kernel, mode='same')
+    return power[::oversample][:len(freqs)]
+
+
 def wave_clipped_fraction(data, samplerate, eod_times, mean_eod,
                           min_clip=-np.inf, max_clip=np.inf):
     """Compute fraction of clipped wave fish waveform snippets.
@@ -1373,6 +1447,7 @@ def plot_eod_waveform(ax, eod_waveform, props, peaks=None, unit=None,
     zkwargs: dict
         Arguments passed on to the plot command for the zero line.
     """
+    import matplotlib.pyplot as plt
     ax.autoscale(True)
     time = 1000.0 * eod_waveform[:,0]
     # plot zero line:
@@ -1498,6 +1573,7 @@ def plot_wave_spectrum(axa, axp, spec, props, unit=None, color='b', lw=2, marker
     markersize: float
         Size of points on spectrum.
     """
+    import matplotlib.pyplot as plt
     n = 9 if len(spec) > 9 else len(spec)
     # amplitudes:
     markers, stemlines, baseline = axa.stem(spec[:n,0], spec[:n,2])
@@ -1551,6 +1627,7 @@ def plot_pulse_spectrum(ax, power, props, min_freq=1.0, max_freq=10000.0,
     markersize: float
         Size of points on spectrum.
     """
+    import matplotlib.patches as mpatches
     box = mpatches.Rectangle((1,-60), 49, 60, linewidth=0, facecolor='#DDDDDD',
                              zorder=1)
     ax.add_patch(box)
@@ -0,0 +1,723 @@
+"""
+Headless detection and analysis of EODs of all fish in a recording.
+
+This module provides the analysis part of `thunderfish` without
+any dependency on matplotlib or audio output. It imports quickly and
+is well suited for batch processing and worker processes.
+Plotting is provided by the `thunderfish.thunderfish` module.
+
+## Configuration
+- `configuration()`: assemble, save, and load configuration parameter for thunderfish.
+- `analysis_args()`: configuration values the detected EODs depend on.
+
+## EOD detection
+- `detect_eods()`: detect EODs of all fish present in the data.
+- `merge_eods()`: merge EODs detected in consecutive windows of a recording.
+- `detect_eods_stream()`: detect EODs of all fish in consecutive windows of a recording.
+
+## Output
+- `remove_eod_files()`: remove all files from previous analysis runs.
+- `save_eods()`: save analysis results to files.
+"""
+
+import os
+import glob
+import numpy as np
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
+from audioio import unwrap
+from .configfile import ConfigFile
+from .dataloader import open_data
+from .bestwindow import add_clip_config, add_best_window_config, clip_amplitudes
+from .bestwindow import clip_args, best_window_args
+from .checkpulse import add_check_pulse_config
+from .pulses import extract_pulsefish, match_pulse_waveforms, lazy_map, stream_blocks
+from .powerspectrum import decibel, multi_psd
+from .powerspectrum import add_multi_psd_config, multi_psd_args
+from .harmonics import add_psd_peak_detection_config, add_harmonic_groups_config
+from .harmonics import harmonic_groups, harmonic_groups_args, psd_peak_detection_args
+from .consistentfishes import consistent_fishes
+from .eodanalysis import eod_waveform, analyze_wave, analyze_pulse
+from .eodanalysis import wave_clipped_fraction, pulse_clipped_fraction
+from .eodanalysis import pulse_train_spectrum
+from .eodanalysis import add_eod_analysis_config, eod_waveform_args
+from .eodanalysis import analyze_wave_args, analyze_pulse_args
+from .eodanalysis import wave_quality, wave_quality_args, add_eod_quality_config
+from .eodanalysis import pulse_quality, pulse_quality_args
+from .eodanalysis import save_eod_waveform, save_wave_eodfs, save_wave_fish, save_pulse_fish
+from .eodanalysis import save_wave_spectrum, save_pulse_spectrum, save_pulse_peaks
+from .fakefish import normalize_wavefish, export_wavefish
+from .tabledata import TableData, add_write_table_config, write_table_args
+from .profiling import stage
+
+
+def configuration(config_file, save_config=False, file_name='', verbose=0):
+    """
+    Assemble, save, and load configuration parameter for thunderfish.
+
+    Parameters
+    ----------
+    config_file: string
+        Name of the configuration file to be loaded.
+    save_config: boolean
+        If True write the configuration file to the current working directory
+        after loading existing configuration files.
+    file_name: string
+        Data file to be analyzed. Config files will be loaded from this path
+        and up to three levels up.
+    verbose: int
+        Print out information about loaded configuration files
+        if greater than zero.
+
+    Returns
+    -------
+    cfg: ConfigFile
+        Configuration parameters.
+    """
+    cfg = ConfigFile()
+    add_multi_psd_config(cfg)
+    cfg.add('frequencyThreshold', 1.0, 'Hz',
+            'The fundamental frequency of each fish needs to be detected in each power spectrum within this threshold.')
+    # TODO: make this threshold dependent on frequency resolution!
+    cfg.add('minPSDAverages', 3, '', 'Minimum number of fft averages for estimating the power spectrum.')  # needed by fishfinder
+    add_psd_peak_detection_config(cfg)
+    add_harmonic_groups_config(cfg)
+    add_clip_config(cfg)
+    cfg.add('unwrapData', False, '', 'Unwrap clipped voltage traces.')
+    add_best_window_config(cfg, win_size=8.0, w_cv_ampl=10.0)
+    cfg.add('streamWindowSize', 0.0, 's',
+            'Analyze the whole recording in consecutive windows of this size that are read in one after the other, instead of loading the full recording and analyzing its best window only. If zero, streaming is disabled.')
+    cfg.add('streamWindowOverlap', 2.0, 's', 'Overlap of consecutive windows in streaming mode.')
+    add_check_pulse_config(cfg)
+    cfg.add('pulseEODSamples', 0, '',
+            'If larger than zero, interpolate pulse data such that the narrowest EODs are sampled with this number of samples between peak and trough. If zero, always interpolate to 500kHz.')
+    cfg.add('pulseSinglePrecision', False, '',
+            'Cluster pulse EODs on single precision data, which halves the memory needed.')
+    add_eod_analysis_config(cfg, min_pulse_win=0.004)
+    del cfg['eodSnippetFac']
+    del cfg['eodMinSnippet']
+    del cfg['eodMinSem']
+    add_eod_quality_config(cfg)
+    cfg.add('analysisThreads', 1, '',
+            'Number of threads used for concurrently computing power spectra, detecting harmonic groups, clustering pulse EODs, and analyzing the EOD waveforms of all detected fish. If zero, use as many threads as there are CPU cores.')
+    add_write_table_config(cfg, table_format='csv', unit_style='row',
+                           align_columns=True, shrink_width=False)
+    
+    # load configuration from working directory and data directories:
+    cfg.load_files(config_file, file_name, 3, verbose)
+
+    # save configuration:
+    if save_config:
+        ext = os.path.splitext(config_file)[1]
+        if ext != os.extsep + 'cfg':
+            print('configuration file name must have .cfg as extension!')
+        else:
+            print('write configuration to %s ...' % config_file)
+            del cfg['fileColumnNumbers']
+            del cfg['fileShrinkColumnWidth']
+            del cfg['fileMissing']
+            del cfg['fileLaTeXLabelCommand']
+            del cfg['fileLaTeXMergeStd']
+            cfg.dump(config_file)
+    return cfg
+
+
+def detect_eods(data, samplerate, clipped, min_clip, max_clip, name, verbose, plot_level, cfg):
+    """ Detect EODs of all fish present in the data.
+
+    Parameters
+    ----------
+    data: array of floats
+        The recording in which to detect EODs.
+    samplerate: float
+        Sampling rate of the dataset.
+    clipped: float
+        Fraction of clipped amplitudes.
+    min_clip: float
+        Minimum amplitude that is not clipped.
+    max_clip: float
+        Maximum amplitude that is not clipped.
+    name: string
+        Name of the recording (e.g. its filename).
+    verbose: int
+        Print out information about EOD detection if greater than zero.
+    plot_level : int
+        Similar to verbosity levels, but with plots. 
+    cfg: ConfigFile
+        Configuration parameters.
+
+    Returns
+    -------
+    psd_data: list of 2D arrays
+        List of power spectra (frequencies and power) of the analysed data
+        for different frequency resolutions.
+    wave_eodfs: list of 2D arrays
+        Frequency and power of fundamental frequency/harmonics of all wave fish.
+    wave_indices: array of int
+        Indices of wave fish mapping from wave_eodfs to eod_props.
+        If negative, then that EOD frequency has no waveform described in eod_props.
+    eod_props: list of dict
+        Lists of EOD properties as returned by analyze_pulse() and analyze_wave()
+        for each waveform in mean_eods.
+    mean_eods: list of 2-D arrays with time, mean, sem, and fit.
+        Averaged EOD waveforms of pulse and wave fish.
+    spec_data: list of 2_D arrays
+        For each pulsefish a power spectrum of the single pulse and for
+        each wavefish the relative amplitudes and phases of the harmonics.
+    peak_data: list of 2_D arrays
+        For each pulse fish a list of peak properties
+        (index, time, and amplitude), empty array for wave fish.
+    power_thresh:  2 D array or None
+        Frequency (first column) and power (second column) of threshold
+        derived from single pulse spectra to discard false wave fish.
+        None if no pulse fish was detected.
+    skip_reason: list of string
+        Reasons, why an EOD was discarded.
+    """            
+    # power spectra, harmonic groups, and the waveforms of all fish
+    # are analyzed in parallel, but in the sequential case
+    # only as long as they are needed:
+    threads = cfg.value('analysisThreads')
+    if threads <= 0:
+        threads = cpu_count()
+    # the executor does not start threads with threads=1:
+    with ThreadPoolExecutor(max(threads, 1)) as pool:
+        executor = pool if threads > 1 else None
+        par_map = executor.map if executor is not None else map
+
+        # detect wave fish:
+        psd_args = multi_psd_args(cfg)
+        with stage('multi_psd'):
+            psd_data = multi_psd(data, samplerate, workers=threads, **psd_args)
+        h_kwargs = psd_peak_detection_args(cfg)
+        h_kwargs.update(harmonic_groups_args(cfg))
+        def psd_harmonics(psd):
+            with stage('harmonic_groups'):
+                return harmonic_groups(psd[:,0], psd[:,1], verbose-1, **h_kwargs)[0]
+        wave_eodfs_list = []
+        for i, wave_eodfs in enumerate(par_map(psd_harmonics, psd_data)):
+            if verbose > 0 and len(psd_data) > 1:
+                numpsdresolutions = cfg.value('numberPSDResolutions')
+                print('fundamental frequencies detected in power spectrum of window %d at resolution %d:'
+                      % (i//numpsdresolutions, i%numpsdresolutions))
+                if len(wave_eodfs) > 0:
+                    print('  ' + ' '.join(['%.1f' % freq[0, 0] for freq in wave_eodfs]))
+                else:
+                    print('  none')
+            wave_eodfs_list.append(wave_eodfs)
+        wave_eodfs = consistent_fishes(wave_eodfs_list,
+                                       df_th=cfg.value('frequencyThreshold'))
+        if verbose > 0:
+            if len(wave_eodfs) > 0:
+                print('found %2d EOD frequencies consistent in all power spectra:' % len(wave_eodfs))
+                print('  ' + ' '.join(['%.1f' % freq[0, 0] for freq in wave_eodfs]))
+            else:
+                print('no fundamental frequencies are consistent in all power spectra')
+
+        # detect pulse fish:
+        with stage('extract_pulsefish'):
+            _, eod_times, eod_peaktimes, zoom_window, _ = extract_pulsefish(data, samplerate, name, eod_samples=cfg.value('pulseEODSamples'),
+                                                                            workers=threads, verbose=verbose, plot_level=plot_level,
+                                                                            dtype=np.float32 if cfg.value('pulseSinglePrecision') else float)
+
+        #eod_times = []
+        #eod_peaktimes = []
+        #zoom_window = []
+        if verbose > 0:
+            if len(eod_times) > 0:
+                print('found %2d pulsefish EODs' % len(eod_times))
+            else:
+                print('no pulsefish EODs found')
+            
+        # analysis results:
+        eod_props = []
+        mean_eods = []
+        spec_data = []
+        peak_data = []
+        power_thresh = None
+        skip_reason = []
+    
+        # analyse eod waveform of pulse-fish:
+        min_freq_res = cfg.value('frequencyResolution')
+        def pulse_analysis(eod_ts):
+            with stage('eod_waveform'):
+                mean_eod, eod_times0 = \
+                    eod_waveform(data, samplerate, eod_ts, win_fac=0.8,
+                                 min_win=cfg.value('eodMinPulseSnippet'),
+                                 min_sem=False, **eod_waveform_args(cfg))
+            with stage('analyze_pulse'):
+                mean_eod, props, peaks, power = analyze_pulse(mean_eod, eod_times0,
+                                                              freq_resolution=min_freq_res,
+                                                              **analyze_pulse_args(cfg))
+            clipped_frac = 0.0
+            if len(peaks) > 0:
+                clipped_frac = pulse_clipped_fraction(data, samplerate, eod_times0, mean_eod,
+                                                      min_clip, max_clip)
+            return mean_eod, props, peaks, power, clipped_frac
+
+        max_pulse_amplitude = 0.0
+        pulse_results = par_map(pulse_analysis, eod_times)
+        for k, (eod_pts, (mean_eod, props, peaks, power, clipped_frac)) in \
+            enumerate(zip(eod_peaktimes, pulse_results)):
+            if len(peaks) == 0:
+                print('error: no peaks in pulse EOD detected')
+                continue
+            props['peaktimes'] = eod_pts      # XXX that should go into analyze pulse
+            props['index'] = len(eod_props)
+            props['clipped'] = clipped_frac
+
+            # add good waveforms only:
+            skips, msg, skipped_clipped = pulse_quality(props, **pulse_quality_args(cfg))
+
+            if len(skips) == 0:
+                eod_props.append(props)
+                mean_eods.append(mean_eod)
+                spec_data.append(power)
+                peak_data.append(peaks)
+                if verbose > 0:
+                    print('take %6.1fHz pulse fish: %s' % (props['EODf'], msg))
+            else:
+                skip_reason += ['%.1fHz pulse fish %s' % (props['EODf'], skips)]
+                if verbose > 0:
+                    print('skip %6.1fHz pulse fish: %s (%s)' %
+                          (props['EODf'], skips, msg))
+
+            # threshold for wave fish peaks based on single pulse spectra:
+            if len(skips) == 0 or skipped_clipped:
+                if max_pulse_amplitude < props['p-p-amplitude']:
+                    max_pulse_amplitude = props['p-p-amplitude']
+                # power spectrum of the pulse train on the grid of psd_data[0]:
+                ipis = np.diff(props['peaktimes'])
+                ipis = ipis[(ipis > 0.5*props['period']) & (ipis < 1.5*props['period'])]
+                period_std = np.std(ipis) if len(ipis) > 1 else 0.0
+                pulse_power = pulse_train_spectrum(mean_eod[:,1], samplerate,
+                                                   props['period'], period_std,
+                                                   psd_data[0][:,0], psd_args['window'])
+                pulse_power *= 5.0
+                if power_thresh is None:
+                    power_thresh = np.column_stack((psd_data[0][:,0], pulse_power))
+                else:
+                    power_thresh[:,1] += pulse_power
+                
+        # remove wavefish below pulse fish power:
+        if power_thresh is not None:
+            n = len(wave_eodfs)
+            maxh = 3  # XXX make parameter
+            df = power_thresh[1,0] - power_thresh[0,0]
+            for k, fish in enumerate(reversed(wave_eodfs)):
+                idx = np.array(fish[:maxh,0]//df, dtype=int)
+                for offs in range(-2, 3):
+                    nbelow = np.sum(fish[:maxh,1] < power_thresh[idx+offs,1])
+                    if nbelow > 0:
+                        wave_eodfs.pop(n-1-k)
+                        if verbose > 0:
+                            print('skip %6.1fHz wave  fish: %2d harmonics are below pulsefish threshold' % (fish[0,0], nbelow))
+                        break
+
+        # analyse EOD waveform of all wavefish:
+        powers = np.array([np.sum(fish[:, 1]**2) for fish in wave_eodfs])
+        power_indices = np.argsort(-powers)
+        wave_indices = np.zeros(len(wave_eodfs), dtype=np.int) - 3
+        def wave_analysis(k_fish):
+            k, fish = k_fish
+            eod_times = np.arange(0.0, len(data)/samplerate, 1.0/fish[0,0])
+            with stage('eod_waveform'):
+                mean_eod, eod_times = \
+                    eod_waveform(data, samplerate, eod_times, win_fac=3.0, min_win=0.0,
+                                 min_sem=(k==0), **eod_waveform_args(cfg))
+            with stage('analyze_wave'):
+                mean_eod, props, sdata, error_str = \
+                    analyze_wave(mean_eod, fish, **analyze_wave_args(cfg))
+            clipped_frac = wave_clipped_fraction(data, samplerate, eod_times, mean_eod,
+                                                 min_clip, max_clip)
+            return eod_times, mean_eod, props, sdata, error_str, clipped_frac
+
+        # wave fish are analyzed only until the first one is too small:
+        wave_results = lazy_map(wave_analysis, [(k, wave_eodfs[idx]) for k, idx in enumerate(power_indices)],
+                                executor, threads)
+        for k, (idx, (eod_times, mean_eod, props, sdata, error_str, clipped_frac)) in \
+            enumerate(zip(power_indices, wave_results)):
+            if error_str:
+                print(name + ': ' + error_str)
+            props['n'] = len(eod_times)
+            props['index'] = len(eod_props)
+            props['clipped'] = clipped_frac
+            # remove wave fish that are smaller than the largest pulse fish:
+            if props['p-p-amplitude'] < 0.01*max_pulse_amplitude:
+                rm_indices = power_indices[k:]
+                if verbose > 0:
+                    print('skip %6.1fHz wave  fish: power=%5.1fdB, p-p amplitude=%5.1fdB smaller than pulse fish=%5.1dB - 20dB' %
+                          (props['EODf'], decibel(powers[idx]),
+                           decibel(props['p-p-amplitude']), decibel(max_pulse_amplitude)))
+                    for idx in rm_indices[1:]:
+                        print('skip %6.1fHz wave  fish: power=%5.1fdB even smaller' %
+                              (wave_eodfs[idx][0,0], decibel(powers[idx])))
+                wave_eodfs = [eodfs for idx, eodfs in enumerate(wave_eodfs)
+                              if idx not in rm_indices]
+                wave_indices = np.array([idcs for idx, idcs in enumerate(wave_indices)
+                                        if idx not in rm_indices], dtype=np.int)
+                break
+            # add good waveforms only:
+            remove, skips, msg = wave_quality(props, sdata[1:,3], **wave_quality_args(cfg))
+            if len(skips) == 0:
+                wave_indices[idx] = props['index']
+                eod_props.append(props)
+                mean_eods.append(mean_eod)
+                spec_data.append(sdata)
+                peak_data.append([])
+                if verbose > 0:
+                    print('take   %6.1fHz wave  fish: %s' % (props['EODf'], msg))
+            else:
+                wave_indices[idx] = -2 if remove else -1
+                skip_reason += ['%.1fHz wave fish %s' % (props['EODf'], skips)]
+                if verbose > 0:
+                    print('%-6s %6.1fHz wave  fish: %s (%s)' %
+                          ('remove' if remove else 'skip', props['EODf'], skips, msg))
+        wave_results.close()
+    wave_eodfs = [eodfs for idx, eodfs in zip(wave_indices, wave_eodfs) if idx > -2]
+    wave_indices = np.array([idx for idx in wave_indices if idx > -2], dtype=np.int)
+    return (psd_data, wave_eodfs, wave_indices, eod_props, mean_eods,
+            spec_data, peak_data, power_thresh, skip_reason, zoom_window)
+
+
+def merge_eods(window_eods, df_th=1.0, pulse_rtol=0.1, pulse_min_corr=0.9):
+    """ Merge EODs detected in consecutive windows of a recording.
+
+    Wave fish with EOD frequencies closer than `df_th` are considered
+    to be the same fish. Pulse fish are considered to be the same fish if
+    their EOD frequencies are closer than `pulse_rtol` relative to their
+    EOD frequency and if their mean EOD waveforms are similar
+    (see `match_pulse_waveforms()`). For each fish
+    the waveform with the largest peak-to-peak amplitude is kept.
+    EOD times of pulse fish are collected from all windows.
+
+    Parameters
+    ----------
+    window_eods: list of tuples
+        For each analysis window the start time of the window
+        in the recording, the start and end time of the part of the window
+        that is not shared with neighboring windows (all in seconds),
+        and the tuple returned by `detect_eods()` for this window.
+    df_th: float
+        Maximum difference of EOD frequencies of wave fish in Hertz.
+    pulse_rtol: float
+        Maximum difference of EOD frequencies of pulse fish relative
+        to their EOD frequency.
+    pulse_min_corr: float
+        Minimum correlation of the mean EOD waveforms of pulse fish.
+
+    Returns
+    -------
+    wave_eodfs: list of 2D arrays
+        Frequency and power of fundamental frequency/harmonics of all wave fish.
+    wave_indices: array of int
+        Indices of wave fish mapping from wave_eodfs to eod_props.
+        If negative, then that EOD frequency has no waveform described in eod_props.
+    eod_props: list of dict
+        Lists of EOD properties of the merged fish.
+        The 'times' and 'peaktimes' of pulse fish are relative to the
+        beginning of the recording.
+    mean_eods: list of 2-D arrays with time, mean, sem, and fit.
+        Averaged EOD waveforms of pulse and wave fish.
+    spec_data: list of 2_D arrays
+        For each pulsefish a power spectrum of the single pulse and for
+        each wavefish the relative amplitudes and phases of the harmonics.
+    peak_data: list of 2_D arrays
+        For each pulse fish a list of peak properties
+        (index, time, and amplitude), empty array for wave fish.
+    power_thresh:  2 D array or None
+        Maximum of the pulse fish power thresholds of all windows.
+        None if no pulse fish was detected.
+    skip_reason: list of string
+        Reasons, why an EOD was discarded.
+    """
+    waves = []
+    pulses = []
+    power_thresh = None
+    skip_reason = []
+    for toffs, t0, t1, eods in window_eods:
+        _, wave_eodfs, wave_indices, eod_props, mean_eods, spec_data, \
+          peak_data, pthresh, skips, _ = eods
+        for eodfs, idx in zip(wave_eodfs, wave_indices):
+            if idx >= 0:
+                waves.append((eodfs, eod_props[idx], mean_eods[idx],
+                              spec_data[idx], peak_data[idx]))
+            else:
+                waves.append((eodfs, None, None, None, None))
+        for props, meod, spec, peaks in zip(eod_props, mean_eods,
+                                            spec_data, peak_data):
+            if props['type'] != 'pulse':
+                continue
+            times = []
+            for key in ['times', 'peaktimes']:
+                t = props[key] + toffs
+                times.append(t[(t >= t0) & (t < t1)])
+            pulses.append((props, meod, spec, peaks, times))
+        if pthresh is not None:
+            if power_thresh is None:
+                power_thresh = np.array(pthresh)
+            elif power_thresh.shape == pthresh.shape:
+                power_thresh[:,1] = np.maximum(power_thresh[:,1], pthresh[:,1])
+        skip_reason.extend(skips)
+
+    def group(fish, freq, tol):
+        groups = []
+        for f in sorted(fish, key=freq):
+            if len(groups) > 0 and freq(f) - freq(groups[-1][0]) < tol(groups[-1][0]):
+                groups[-1].append(f)
+            else:
+                groups.append([f])
+        return groups
+
+    def same_pulse_fish(f, g):
+        if abs(f[0]['EODf'] - g[0]['EODf']) >= pulse_rtol*g[0]['EODf']:
+            return False
+        ref = {'time': g[1][:,0], 'sum': g[1][:,1], 'count': np.ones(len(g[1]))}
+        return match_pulse_waveforms(f[1][:,:2].T, [ref], pulse_min_corr)[0] is not None
+
+    pulse_groups = []
+    for f in sorted(pulses, key=lambda f: f[0]['EODf']):
+        for fish in pulse_groups:
+            if same_pulse_fish(f, fish[0]):
+                fish.append(f)
+                break
+        else:
+            pulse_groups.append([f])
+
+    eod_props = []
+    mean_eods = []
+    spec_data = []
+    peak_data = []
+    # pulse fish:
+    for fish in pulse_groups:
+        props, meod, spec, peaks, _ = max(fish, key=lambda f: f[0]['p-p-amplitude'])
+        props = dict(props)
+        props['times'] = np.sort(np.concatenate([f[4][0] for f in fish]))
+        props['peaktimes'] = np.sort(np.concatenate([f[4][1] for f in fish]))
+        props['n'] = len(props['times'])
+        props['index'] = len(eod_props)
+        eod_props.append(props)
+        mean_eods.append(meod)
+        spec_data.append(spec)
+        peak_data.append(peaks)
+    # wave fish:
+    wave_eodfs = []
+    wave_indices = []
+    for fish in group(waves, lambda f: f[0][0,0], lambda f: df_th):
+        analyzed = [f for f in fish if f[1] is not None]
+        if len(analyzed) > 0:
+            eodfs, props, meod, spec, peaks = max(analyzed, key=lambda f: f[1]['p-p-amplitude'])
+            props = dict(props)
+            props['index'] = len(eod_props)
+            wave_indices.append(props['index'])
+            eod_props.append(props)
+            mean_eods.append(meod)
+            spec_data.append(spec)
+            peak_data.append(peaks)
+        else:
+            eodfs = max(fish, key=lambda f: f[0][0,1])[0]
+            wave_indices.append(-1)
+        wave_eodfs.append(eodfs)
+    return (wave_eodfs, np.array(wave_indices, dtype=np.int), eod_props,
+            mean_eods, spec_data, peak_data, power_thresh, skip_reason)
+
+
+def detect_eods_stream(filename, channel, cfg, verbose=0):
+    """ Detect EODs of all fish in consecutive windows of a recording.
+
+    In contrast to `load_data()` followed by `detect_eods()`, the
+    recording is not loaded into memory as a whole. Instead, windows
+    of `streamWindowSize` seconds overlapping by `streamWindowOverlap`
+    seconds are read in one after the other, EODs are detected in each
+    window by `detect_eods()`, and the fish of all windows are merged
+    by `merge_eods()`. Memory usage is thus bounded by the window size
+    and not by the duration of the recording.
+    No debugging plots are made by `detect_eods()`, since they would
+    be made for every single window.
+
+    Parameters
+    ----------
+    filename: string
+        Path of the data file.
+    channel: int
+        Channel to be analyzed.
+    cfg: ConfigFile
+        Configuration parameters.
+    verbose: int
+        Print out information about EOD detection if greater than zero.
+
+    Returns
+    -------
+    data: 1-D array
+        Data of the window with the most detected fish.
+    samplerate: float
+        Sampling rate of the data in Hertz.
+    unit: string
+        Unit of the data.
+    toffs: float
+        Start time of `data` in the recording in seconds.
+    clipped: float
+        Fraction of clipped amplitudes in `data`.
+    min_clip: float
+        Minimum amplitude that is not clipped in `data`.
+    max_clip: float
+        Maximum amplitude that is not clipped in `data`.
+    psd_data, wave_eodfs, wave_indices, eod_props, mean_eods, spec_data, peak_data, power_thresh, skip_reason, zoom_window:
+        As returned by `detect_eods()` for all fish in the recording
+        (see `merge_eods()`). The power spectra and the zoom window are the
+        ones of the returned data window.
+
+    Raises
+    ------
+    IOError:
+        The data file could not be opened.
+    ValueError:
+        The data file is empty.
+    """
+    win_size = cfg.value('streamWindowSize')
+    overlap = cfg.value('streamWindowOverlap')
+    if overlap >= win_size:
+        overlap = 0.5*win_size
+    window_eods = []
+    best = None
+    with open_data(filename, channel, win_size + overlap, overlap, verbose-1) as sf:
+        samplerate = sf.samplerate
+        unit = sf.unit
+        n = len(sf)
+        if n <= 1:
+            raise ValueError('empty data file')
+        for i0, i1, t0, t1 in stream_blocks(n, samplerate, win_size, overlap):
+            data = np.array(sf[i0:i1])
+            min_clip = cfg.value('minClipAmplitude')
+            max_clip = cfg.value('maxClipAmplitude')
+            if min_clip == 0.0 or max_clip == 0.0:
+                min_clip, max_clip = clip_amplitudes(data, **clip_args(cfg, samplerate))
+            if cfg.value('unwrapData'):
+                data = unwrap(data)
+                min_clip = -2.0
+                max_clip = 2.0
+            clipped = np.mean((data < min_clip) | (data > max_clip))
+            if verbose > 0:
+                print('analyze window %.1fs - %.1fs' % (i0/samplerate, i1/samplerate))
+            eods = detect_eods(data, samplerate, clipped, min_clip, max_clip,
+                               filename, verbose, 0, cfg)
+            if best is None or len(eods[3]) > len(best[-1][3]):
+                best = (data, i0/samplerate, clipped, min_clip, max_clip, eods)
+            # power spectra are only needed for the returned window:
+            window_eods.append((i0/samplerate, t0, t1, (None,) + eods[1:]))
+    data, toffs, clipped, min_clip, max_clip, eods = best
+    merged = merge_eods(window_eods, cfg.value('frequencyThreshold'))
+    return (data, samplerate, unit, toffs, clipped, min_clip, max_clip,
+            eods[0]) + merged + (eods[-1],)
+
+
+def analysis_args(cfg):
+    """ Configuration values the detected EODs depend on.
+
+    These are the parameters consumed by `find_best_window()`,
+    `detect_eods()`, and `detect_eods_stream()`, but not the ones
+    controlling the output, like the file format.
+    Used as part of the key of cached analysis results.
+
+    Parameters
+    ----------
+    cfg: ConfigFile
+        The configuration.
+
+    Returns
+    -------
+    a: dict
+        The respective configuration values, grouped by the functions
+        they are passed to.
+    """
+    a = cfg.map({'minClipAmplitude': 'minClipAmplitude',
+                 'maxClipAmplitude': 'maxClipAmplitude',
+                 'clipWindow': 'clipWindow',
+                 'unwrapData': 'unwrapData',
+                 'numberPSDResolutions': 'numberPSDResolutions',
+                 'frequencyThreshold': 'frequencyThreshold',
+                 'frequencyResolution': 'frequencyResolution',
+                 'eodMinPulseSnippet': 'eodMinPulseSnippet',
+                 'pulseEODSamples': 'pulseEODSamples',
+                 'pulseSinglePrecision': 'pulseSinglePrecision',
+                 'streamWindowSize': 'streamWindowSize',
+                 'streamWindowOverlap': 'streamWindowOverlap'})
+    a['clip_amplitudes'] = clip_args(cfg, 1.0)
+    a['best_window'] = best_window_args(cfg)
+    a['multi_psd'] = multi_psd_args(cfg)
+    a['psd_peak_detection'] = psd_peak_detection_args(cfg)
+    a['harmonic_groups'] = harmonic_groups_args(cfg)
+    a['eod_waveform'] = eod_waveform_args(cfg)
+    a['analyze_wave'] = analyze_wave_args(cfg)
+    a['analyze_pulse'] = analyze_pulse_args(cfg)
+    a['wave_quality'] = wave_quality_args(cfg)
+    a['pulse_quality'] = pulse_quality_args(cfg)
+    return a
+
+
+def remove_eod_files(output_basename, verbose, cfg):
+    """ Remove all files from previous runs of thunderfish
+    """
+    ff = cfg.value('fileFormat')
+    if ff == 'py':
+        fext = 'py'
+    else:
+        fext = TableData.extensions[cfg.value('fileFormat')]
+    # remove all files from previous runs of thunderfish:
+    for fn in glob.glob('%s*.%s' % (output_basename, fext)):
+        os.remove(fn)
+        if verbose > 0:
+            print('removed file %s' % fn)
+
+            
+def save_eods(output_basename, eod_props, mean_eods, spec_data, peak_data,
+              wave_eodfs, wave_indices, unit, verbose, cfg):
+    """ Save analysis results of all EODs to files.
+    """
+    if write_table_args(cfg)['table_format'] == 'py':
+        with open(output_basename+'.py', 'w') as f:
+            name = os.path.basename(output_basename)
+            for k, sdata in enumerate(spec_data):
+                # save wave fish only:
+                if len(sdata)>0 and sdata.shape[1] > 2:
+                    fish = dict(amplitudes=sdata[:,3], phases=sdata[:,5])
+                    fish = normalize_wavefish(fish)
+                    export_wavefish(fish, name+'-%d_harmonics' % k, f)
+    else:
+        # all wave fish in wave_eodfs:
+        if len(wave_eodfs) > 0:
+            fp = save_wave_eodfs(wave_eodfs, wave_indices, output_basename,
+                                 **write_table_args(cfg))
+            if verbose > 0:
+                print('wrote file %s' % fp)
+        # all wave and pulse fish:
+        for i, (mean_eod, sdata, pdata) in enumerate(zip(mean_eods, spec_data, peak_data)):
+            fp = save_eod_waveform(mean_eod, unit, i, output_basename,
+                                   **write_table_args(cfg))
+            if verbose > 0:
+                print('wrote file %s' % fp)
+            # power spectrum:
+            if len(sdata)>0:
+                if sdata.shape[1] == 2:
+                    fp = save_pulse_spectrum(sdata, unit, i, output_basename,
+                                             **write_table_args(cfg))
+                else:
+                    fp = save_wave_spectrum(sdata, unit, i, output_basename,
+                                            **write_table_args(cfg))
+                if verbose > 0:
+                    print('wrote file %s' % fp)
+            # peaks:
+            fp = save_pulse_peaks(pdata, unit, i, output_basename,
+                                  **write_table_args(cfg))
+            if verbose > 0 and fp is not None:
+                print('wrote file %s' % fp)
+        # wave fish properties:
+        fp = save_wave_fish(eod_props, unit, output_basename,
+                            **write_table_args(cfg))
+        if verbose > 0 and fp:
+            print('wrote file %s' % fp)
+        # pulse fish properties:
+        fp = save_pulse_fish(eod_props, unit, output_basename,
+                             **write_table_args(cfg))
+        if verbose > 0 and fp:
+            print('wrote file %s' % fp)
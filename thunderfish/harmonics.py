@@ -59,11 +59,6 @@ import numpy as np
 import scipy.signal as sig
 from .eventdetection import detect_peaks, trim, hist_threshold
 from .powerspectrum import decibel, power, plot_decibel_psd
-try:
-    import matplotlib.cm as cm
-    import matplotlib.colors as mc
-except ImportError:
-    pass
 
 
 def group_candidate(good_freqs, all_freqs, freq, divisor, freq_tol, min_group_size, verbose):
@@ -1362,6 +1357,8 @@ def colors_markers():
     markers: list
         list of markers
     """
+    import matplotlib.cm as cm
+    import matplotlib.colors as mc
     # color and marker range:
     colors = []
     markers = []
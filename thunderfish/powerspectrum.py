@@ -26,6 +26,7 @@
 """
 
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from scipy.signal import get_window
 try:
     from scipy.signal import welch
@@ -34,11 +35,6 @@ except ImportError:
     from matplotlib.mlab import psd as mpsd
     from matplotlib.mlab import detrend_linear, detrend_mean, detrend_none
     psdscipy  = False
-try:
-    from matplotlib.mlab import specgram as mspecgram
-    specgrammlab = True
-except ImportError:
-    specgrammlab = False
 from .eventdetection import detect_peaks
 
 
@@ -151,7 +147,7 @@ def power(decibel, ref_power=1.0):
 
 
 def psd(data, ratetime, freq_resolution, min_nfft=16, max_nfft=None,
-        overlap_frac=0.5, detrend='constant', window='hanning'):
+        overlap_frac=0.5, detrend='constant', window='hann'):
     """Power spectrum density of a given frequency resolution.
 
     NFFT is computed from the requested frequency resolution and the
@@ -188,7 +184,7 @@ def psd(data, ratetime, freq_resolution, min_nfft=16, max_nfft=None,
         If 'none' do not deternd the data.
     window: string
         Function used for windowing data segements.
-        One of hanning, blackman, hamming, bartlett, boxcar, triang, parzen,
+        One of hann, blackman, hamming, bartlett, boxcar, triang, parzen,
         bohman, blackmanharris, nuttall, fattop, barthann
         (see scipy.signal window functions).
 
@@ -226,7 +222,7 @@ def psd(data, ratetime, freq_resolution, min_nfft=16, max_nfft=None,
 def multi_psd(data, ratetime, freq_resolution=0.5,
               num_resolutions=1, num_windows=1,
               min_nfft=16, overlap_frac=0.5,
-              detrend='constant', window='hanning'):
+              detrend='constant', window='hann', workers=1):
     """Power spectra computed for consecutive data windows and
     mutiple frequency resolutions.
 
@@ -260,9 +256,11 @@ def multi_psd(data, ratetime, freq_resolution=0.5,
         If 'none' do not deternd the data.
     window: string
         Function used for windowing data segements.
-        One of hanning, blackman, hamming, bartlett, boxcar, triang, parzen,
+        One of hann, blackman, hamming, bartlett, boxcar, triang, parzen,
         bohman, blackmanharris, nuttall, fattop, barthann
         (see scipy.signal window functions).
+    workers: int
+        Number of threads used for computing the power spectra concurrently.
 
     Returns
     -------
@@ -276,18 +274,23 @@ def multi_psd(data, ratetime, freq_resolution=0.5,
         for i in range(1, num_resolutions):
             freq_resolution.append(2*freq_resolution[-1])
     n_incr = len(data)//(num_windows+1)  # overlap by half a window
-    multi_psd_data = []
-    for k in range(num_windows):
-        for fres in freq_resolution:
-            freq, power = psd(data[k*n_incr:(k+2)*n_incr], samplerate, fres,
-                              min_nfft, 2*n_incr, overlap_frac, detrend, window)
-            multi_psd_data.append(np.column_stack((freq, power)))
+    def window_psd(k_fres):
+        k, fres = k_fres
+        freq, power = psd(data[k*n_incr:(k+2)*n_incr], samplerate, fres,
+                          min_nfft, 2*n_incr, overlap_frac, detrend, window)
+        return np.column_stack((freq, power))
+    tasks = [(k, fres) for k in range(num_windows) for fres in freq_resolution]
+    if workers > 1 and len(tasks) > 1:
+        with ThreadPoolExecutor(min(workers, len(tasks))) as executor:
+            multi_psd_data = list(executor.map(window_psd, tasks))
+    else:
+        multi_psd_data = list(map(window_psd, tasks))
     return multi_psd_data
 
 
 def spectrogram(data, ratetime, freq_resolution=0.5, min_nfft=16,
                 max_nfft=None, overlap_frac=0.5,
-                detrend='constant', window='hanning'):
+                detrend='constant', window='hann'):
     """
     Spectrogram of a given frequency resolution.
 
@@ -321,7 +324,7 @@ def spectrogram(data, ratetime, freq_resolution=0.5, min_nfft=16,
         If 'linear' subtract line fitted to the data.
     window: string
         Function used for windowing data segements.
-        One of hanning, blackman, hamming, bartlett, boxcar, triang, parzen,
+        One of hann, blackman, hamming, bartlett, boxcar, triang, parzen,
         bohman, blackmanharris, nuttall, fattop, barthann
         (see scipy.signal window functions).
 
@@ -337,22 +340,23 @@ def spectrogram(data, ratetime, freq_resolution=0.5, min_nfft=16,
     samplerate = ratetime if np.isscalar(ratetime) else 1.0/(ratetime[1]-ratetime[0])
     n_fft = nfft(samplerate, freq_resolution, min_nfft, max_nfft)
     noverlap = int(n_fft * overlap_frac)
-    if specgrammlab:
-        try:
-            spec, freqs, time = mspecgram(data, NFFT=n_fft, Fs=samplerate,
-                                          noverlap=noverlap, detrend=detrend,
-                                          scale_by_freq=True, scale='linear',
-                                          mode='psd',
-                                          window=get_window(window, n_fft))
-        except TypeError:
-            spec, freqs, time = mspecgram(data, NFFT=n_fft, Fs=samplerate,
-                                          noverlap=noverlap, detrend=detrend,
-                                          scale_by_freq=True,
-                                          window=get_window(window, n_fft))
-        return spec, freqs, time
-    else:
+    try:
+        from matplotlib.mlab import specgram as mspecgram
+    except ImportError:
         # ... some alternative implementation ...
         return None, None, None
+    try:
+        spec, freqs, time = mspecgram(data, NFFT=n_fft, Fs=samplerate,
+                                      noverlap=noverlap, detrend=detrend,
+                                      scale_by_freq=True, scale='linear',
+                                      mode='psd',
+                                      window=get_window(window, n_fft))
+    except TypeError:
+        spec, freqs, time = mspecgram(data, NFFT=n_fft, Fs=samplerate,
+                                      noverlap=noverlap, detrend=detrend,
+                                      scale_by_freq=True,
+                                      window=get_window(window, n_fft))
+    return spec, freqs, time
 
 
 def plot_decibel_psd(ax, freqs, power, ref_power=1.0, min_power=1e-20,
@@ -454,7 +458,7 @@ def peak_freqs(onsets, offsets, data, samplerate, freq_resolution=1.0,
 
 
 def add_multi_psd_config(cfg, freq_resolution=0.5,
-                         num_resolutions=1, num_windows=1):
+                         num_resolutions=1, num_windows=1, window='hann'):
     """ Add all parameters needed for the multi_psd() function as
     a new section to a configuration.
 
@@ -469,6 +473,7 @@ def add_multi_psd_config(cfg, freq_resolution=0.5,
     cfg.add('frequencyResolution', freq_resolution, 'Hz', 'Frequency resolution of the power spectrum.')
     cfg.add('numberPSDWindows', num_resolutions, '', 'Number of windows on which power spectra are computed.')
     cfg.add('numberPSDResolutions', num_windows, '', 'Number of power spectra computed within each window with decreasing resolution.')
+    cfg.add('psdWindow', window, '', 'Function used for windowing data segments (see scipy.signal window functions).')
 
 
 def multi_psd_args(cfg):
@@ -491,7 +496,8 @@ def multi_psd_args(cfg):
     """
     a = cfg.map({'freq_resolution': 'frequencyResolution',
                  'num_resolutions': 'numberPSDWindows',
-                 'num_windows': 'numberPSDResolutions'})
+                 'num_windows': 'numberPSDResolutions',
+                 'window': 'psdWindow'})
     return a
 
 
@@ -508,7 +514,7 @@ if __name__ == '__main__':
 
     # compute power spectra:
     fr = [0.5, 1]
-    psd_data = multi_psd(data, samplerate, freq_resolution=fr, detrend='none', window='hanning')
+    psd_data = multi_psd(data, samplerate, freq_resolution=fr, detrend='none', window='hann')
 
     # plot power spectra:
     fig, ax = plt.subplots()
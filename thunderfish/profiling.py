@@ -0,0 +1,314 @@
+"""
+Timing and memory usage of the stages of the analysis pipeline.
+
+Stages of the analysis are marked by the `stage()` context manager:
+```
+from thunderfish.profiling import stage
+
+with stage('bestwindow'):
+    data, idx0, idx1, clipped, min_clip, max_clip = find_best_window(raw_data, samplerate, cfg)
+```
+As long as profiling is not enabled, `stage()` returns a shared
+context manager that does nothing, so the stages cost nothing.
+After `enable_profiling()`, wall time, CPU time and peak memory of
+each stage are accumulated in a new `Profile`, until profiling is
+disabled again. Wrap a single analysis run into the `profiling()`
+context manager to profile only this run:
+```
+with profiling() as profile:
+    analyze(filename)
+profile.table().write()
+```
+Stages may be nested; they are identified
+by the names of the enclosing stages and their own name joined by '/'.
+Stages entered in a worker thread are named relative to the outermost
+stage of that thread.
+
+CPU time is the time of the whole process, including all its threads.
+Peak memory is the maximum memory allocated by Python via `tracemalloc`
+during a stage on top of the memory allocated at its start.
+It requires Python 3.9 or later and is NaN otherwise.
+`tracemalloc` measures the memory of the whole process, so peak memory
+is recorded only for stages of the main thread and includes the memory
+allocated by its worker threads. It is NaN for stages entered in
+worker threads.
+
+## Classes
+- `Profile`: stages recorded while profiling was enabled.
+
+## Functions
+- `enable_profiling()`: start recording the stages of the analysis in a new profile.
+- `disable_profiling()`: stop recording the stages of the analysis.
+- `profiling()`: context manager recording the stages of the analysis in a new profile.
+- `profiling_enabled()`: whether the stages of the analysis are recorded.
+- `clear_profile()`: remove all stages recorded in the current profile.
+- `stage()`: context manager marking a stage of the analysis.
+- `profile_table()`: table with wall time, CPU time and peak memory of all stages of the current profile.
+- `save_profile()`: write table with wall time, CPU time and peak memory of all stages of the current profile to file.
+"""
+
+import time
+import threading
+import tracemalloc
+import numpy as np
+from contextlib import contextmanager
+from .tabledata import TableData
+
+
+class Profile(object):
+    """
+    Stages recorded while profiling was enabled.
+
+    Returned by `enable_profiling()` and `profiling()`.
+    Each profile keeps its own records, so that consecutive
+    analysis runs do not accumulate their stages.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        """ Remove all recorded stages.
+        """
+        with self.lock:
+            self.records.clear()
+
+    def table(self):
+        """ Table with wall time, CPU time and peak memory of all stages.
+
+        Returns
+        -------
+        table: TableData
+            One row for each stage in the order the stages have been
+            entered first. Columns are the name of the stage, the number
+            of times it was entered, its total wall and CPU times,
+            and its largest peak memory.
+        """
+        with self.lock:
+            records = [(path,) + tuple(r) for path, r in self.records.items()]
+        td = TableData()
+        td.append('stage', '', '%-s', [r[0] for r in records])
+        td.append('calls', '', '%d', [r[1] for r in records])
+        td.append('wall', 's', '%.4f', [r[2] for r in records])
+        td.append('cpu', 's', '%.4f', [r[3] for r in records])
+        td.append('memory', 'MB', '%.2f', [r[4]/1024/1024 for r in records])
+        return td
+
+    def save(self, basename, **kwargs):
+        """ Write table with wall time, CPU time and peak memory of all stages to file.
+
+        Parameters
+        ----------
+        basename: string
+            Path and basename of file.
+            '-profile' and a file extension are appended.
+        kwargs:
+            Arguments passed on to `TableData.write()`.
+
+        Returns
+        -------
+        filename: string
+            The path and full name of the written file.
+        """
+        td = self.table()
+        fp = basename + '-profile'
+        file_name = td.write(fp, **kwargs)
+        return file_name
+
+
+_enabled = False
+_trace_memory = False
+_started_tracing = False
+_profile = Profile()
+_local = threading.local()
+
+
+class _NoStage(object):
+    """ Context manager doing nothing for disabled profiling.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+class _Stage(object):
+    """ Context manager recording a stage of the analysis.
+    """
+
+    __slots__ = ('name', 'profile', 'path', 'trace', 'wall', 'cpu', 'memory', 'peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = _profile
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = []
+            _local.stack = stack
+        self.path = stack[-1].path + '/' + self.name if stack else self.name
+        with self.profile.lock:
+            if self.path not in self.profile.records:
+                self.profile.records[self.path] = [0, 0.0, 0.0, np.nan]
+        # the peak of tracemalloc is process-global, only the main thread may reset it:
+        self.trace = _trace_memory and \
+            threading.current_thread() is threading.main_thread()
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory = current
+            self.peak = current
+        stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stack = _local.stack
+        stack.pop()
+        memory = np.nan
+        if self.trace and _trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            memory = self.peak - self.memory
+        with self.profile.lock:
+            record = self.profile.records.setdefault(self.path, [0, 0.0, 0.0, np.nan])
+            record[0] += 1
+            record[1] += wall
+            record[2] += cpu
+            record[3] = np.fmax(record[3], memory)
+        return False
+
+
+def enable_profiling(memory=True):
+    """ Start recording the stages of the analysis in a new profile.
+
+    Parameters
+    ----------
+    memory: boolean
+        If True and supported by the Python version, also record
+        the peak memory of the stages. This slows down allocation
+        of memory considerably, so call `disable_profiling()`
+        as soon as possible.
+
+    Returns
+    -------
+    profile: Profile
+        The new profile recording the stages.
+    """
+    global _enabled, _trace_memory, _started_tracing, _profile
+    _trace_memory = memory and hasattr(tracemalloc, 'reset_peak')
+    if _trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    _profile = Profile()
+    _enabled = True
+    return _profile
+
+
+def disable_profiling():
+    """ Stop recording the stages of the analysis.
+
+    The stages recorded in the current profile are kept until
+    `clear_profile()` or `enable_profiling()` is called.
+    """
+    global _enabled, _trace_memory, _started_tracing
+    _enabled = False
+    _trace_memory = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+@contextmanager
+def profiling(enabled=True, memory=True):
+    """ Context manager recording the stages of the analysis in a new profile.
+
+    Profiling is disabled when leaving the context, also on exceptions.
+
+    Parameters
+    ----------
+    enabled: boolean
+        If False, nothing is recorded.
+    memory: boolean
+        If True and supported by the Python version, also record
+        the peak memory of the stages.
+
+    Yields
+    ------
+    profile: Profile or None
+        The profile recording the stages. None if not `enabled`.
+    """
+    if not enabled:
+        yield None
+        return
+    profile = enable_profiling(memory)
+    try:
+        yield profile
+    finally:
+        disable_profiling()
+
+
+def profiling_enabled():
+    """ Whether the stages of the analysis are recorded.
+
+    Returns
+    -------
+    enabled: boolean
+        True if `enable_profiling()` has been called.
+    """
+    return _enabled
+
+
+def clear_profile():
+    """ Remove all stages recorded in the current profile.
+    """
+    _profile.clear()
+
+
+def stage(name):
+    """ Context manager marking a stage of the analysis.
+
+    Parameters
+    ----------
+    name: string
+        Name of the stage.
+
+    Returns
+    -------
+    stage: context manager
+        Records wall time, CPU time and peak memory of the stage
+        if profiling is enabled, does nothing otherwise.
+    """
+    if not _enabled:
+        return _no_stage
+    return _Stage(name)
+
+
+def profile_table():
+    """ Table with wall time, CPU time and peak memory of all stages of the current profile.
+
+    See `Profile.table()` for details.
+    """
+    return _profile.table()
+
+
+def save_profile(basename, **kwargs):
+    """ Write table with all stages of the current profile to file.
+
+    See `Profile.save()` for details.
+    """
+    return _profile.save(basename, **kwargs)
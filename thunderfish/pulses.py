@@ -4,12 +4,44 @@ Extract all timepoints where pulsefish EODs are present for each separate pulsef
 
 ## Main function
 - `extract_pulsefish()`: checks for pulse-type fish based on the EOD amplitude and shape.
+- `extract_pulsefish_stream()`: extract pulsefish EODs from a long recording block by block.
+- `stream_blocks()`: layout of overlapping blocks for analyzing a long recording.
+- `match_pulse_waveforms()`: find the fish with the most similar mean EOD waveform.
+
+## Classes
+- `InterpolatedData`: quadratically interpolated data that are evaluated on demand.
+- `DiskLogSink`: store data logged by `extract_pulsefish()` in numpy files.
+
+## Snippets
+- `extract_snippets()`: extract equally sized snippets of data centered on EODs.
+
+## Pulsefish models
+- `pulse_model()`: model of the pulsefish detected in a recording.
+- `predict_pulsefish()`: extract pulsefish EODs from a recording using a pulsefish model.
+- `classify_pulsefish()`: extract pulsefish EODs with a pulsefish model and refit the model only if needed.
+- `save_pulse_model()`: save a pulsefish model to a numpy npz file.
+- `load_pulse_model()`: load a pulsefish model from a numpy npz file.
+
+## Parallel processing
+- `lazy_map()`: map a function on items with a bounded number of tasks submitted ahead.
+- `submit_task()`: submit a task that may be waited for by tasks running on the same executor.
+
+## Grouped reductions
+- `label_groups()`: indices of the elements of each label from a single sort of the labels.
+- `label_sums()`: sums of the rows of an array for each label from a single sort of the labels.
+
+## Clustering
+- `BGM()`: cluster one-dimensional data with a Bayesian Gaussian mixture model.
+- `bgm_1d()`: fit a one-dimensional variational Bayesian Gaussian mixture model.
 
 """
 
 import numpy as np
 from scipy import stats
 import os
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from numba import jit
@@ -21,14 +53,15 @@ except ImportError:
 
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-from sklearn.cluster import DBSCAN
-from sklearn.mixture import BayesianGaussianMixture
-from sklearn.metrics import pairwise_distances
+from sklearn.cluster import DBSCAN, KMeans
+from sklearn.neighbors import NearestNeighbors
 
-from scipy.interpolate import interp1d
+from scipy.interpolate import make_interp_spline
+from scipy.special import digamma, gammaln, betaln
+from scipy.signal import correlate
 
 from .eventdetection import detect_peaks
-from .pulseplots import *
+from .profiling import stage
 import pickle
 import warnings
 def warn(*args,**kwargs):
@@ -71,9 +104,149 @@ def unique_counts(ar):
         idx = np.concatenate(np.nonzero(mask) + ([mask.size],))
         return ar[mask], np.diff(idx)  
 
+
+def lazy_map(func, items, executor=None, ahead=1):
+    """
+    Map a function on items with a bounded number of tasks submitted ahead.
+
+    In contrast to `executor.map()`, items are submitted only as results
+    are consumed. This keeps the number of results held in memory small
+    and allows to stop early without computing all of them.
+    Call `close()` on the returned generator when stopping early,
+    to cancel the tasks submitted ahead.
+
+    Parameters
+    ----------
+    func: function
+        Function called with each item.
+    items: iterable
+        Items on which `func` is mapped.
+    executor: Executor or None
+        Executor on which `func` is evaluated.
+        If None, `func` is evaluated lazily by the builtin `map()`.
+    ahead: int
+        Maximum number of items submitted to the executor and not yet
+        returned, i.e. the number of results held in memory.
+
+    Yields
+    ------
+    result:
+        The results of `func` in the order of the items.
+    """
+    if executor is None:
+        yield from map(func, items)
+        return
+    futures = deque()
+    try:
+        for item in items:
+            futures.append(executor.submit(func, item))
+            if len(futures) >= ahead:
+                yield futures.popleft().result()
+        while len(futures) > 0:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def submit_task(executor, func, *args, **kwargs):
+    """
+    Submit a task that may be waited for by tasks running on the same executor.
+
+    If the task has not been started when its result is requested,
+    it is cancelled and evaluated by the requesting thread instead.
+    Tasks running on an executor can therefore submit subtasks to the
+    same executor and wait for their results without blocking all of
+    its workers.
+
+    Parameters
+    ----------
+    executor: Executor or None
+        Executor on which `func` is evaluated.
+        If None, `func` is evaluated when its result is requested.
+    func: function
+        Function called with `args` and `kwargs`.
+    args, kwargs:
+        Arguments passed on to `func`.
+
+    Returns
+    -------
+    result: function
+        Function without arguments returning the result of `func`.
+    """
+    if executor is None:
+        return lambda: func(*args, **kwargs)
+    future = executor.submit(func, *args, **kwargs)
+    def result():
+        if future.cancel():
+            return func(*args, **kwargs)
+        return future.result()
+    return result
+
+
+def label_groups(labels):
+    """ Indices of the elements of each label from a single sort of the labels.
+
+    Replaces the boolean masks `labels==label` that are otherwise computed
+    over all elements for each label.
+    Negative labels are ignored.
+
+    Parameters
+    ----------
+    labels : 1D numpy array of ints or floats
+        Label of each element.
+
+    Returns
+    -------
+    unique_labels : 1D numpy array
+        The sorted unique non-negative labels.
+    groups : list of 1D numpy arrays of ints
+        For each label the indices of its elements in their original order,
+        i.e. `np.nonzero(labels==label)[0]`.
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    order = order[labels[order]>=0]
+    sorted_labels = labels[order]
+    bounds = np.nonzero(sorted_labels[1:] != sorted_labels[:-1])[0] + 1
+    if len(order) == 0:
+        return sorted_labels, []
+    return sorted_labels[np.concatenate(([0], bounds))], np.split(order, bounds)
+
+
+def label_sums(x, labels):
+    """ Sums of the rows of an array for each label from a single sort of the labels.
+
+    The rows of each label are taken from `label_groups()`.
+    Only the rows of one label are copied at a time.
+    Negative labels are ignored.
+
+    Parameters
+    ----------
+    x : 2D numpy array (N, M)
+        Rows to be summed, e.g. EOD snippets.
+    labels : 1D numpy array of ints or floats (N)
+        Label of each row.
+
+    Returns
+    -------
+    unique_labels : 1D numpy array
+        The sorted unique non-negative labels.
+    counts : 1D numpy array of ints
+        Number of rows of each label.
+    sums : 2D numpy array of floats (len(unique_labels), M)
+        Sum of the rows of each label in double precision.
+    """
+    unique_labels, groups = label_groups(labels)
+    counts = np.array([len(idx) for idx in groups], dtype=int)
+    sums = np.zeros((len(groups), x.shape[1]))
+    for k, idx in enumerate(groups):
+        sums[k] = np.sum(x[idx], axis=0, dtype=float)
+    return unique_labels, counts, sums
+
 ###################################################################################
 
-def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_factor_wave=8, width_factor_display=4, verbose=0, plot_level=0, save_plots=False,  ftype='png', return_data = []):
+def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_factor_wave=8, width_factor_display=4, eod_samples=0, workers=1, verbose=0, plot_level=0, save_plots=False,  ftype='png', return_data = [], log_sink=None, dtype=float):
     """ Extract and cluster pulse-type fish EODs from a recording.
     
     Takes recording data containing an unknown number of pulsefish and extracts the mean 
@@ -99,6 +272,14 @@ def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_facto
     width_factor_display :  int or float (optional)
         Width multiplier used for EOD mean extraction and display.
         Defaults to 4.
+    eod_samples : int (optional)
+        If larger than zero, the data are interpolated just enough to sample
+        the narrowest EODs with this number of samples between peak and trough
+        (see extract_eod_times()).
+        Defaults to 0, i.e. the data are always interpolated to 500 kHz.
+    workers : int (optional)
+        Number of threads used for clustering EOD shapes (see cluster()).
+        Defaults to 1.
     verbose : int (optional)
         Verbosity level.
         Defaults to 0.
@@ -243,6 +424,11 @@ def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_facto
                 The first row defines the artefact masks, the second row defines the unreliable EOD masks, 
                 the third row defines the wavefish masks and the fourth row defines the sidepeak masks.
 
+        - 'pulse_model':
+            - 'pulse_model': dictionary.
+                Model of the detected fish for classifying EODs of later recordings
+                (see pulse_model(), predict_pulsefish(), and classify_pulsefish()).
+
         - 'moving_fish':
             - 'moving_fish': dictionary.
                 - 'w' : list of floats.
@@ -259,6 +445,19 @@ def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_facto
                     Sliding window timepoints and fishcounts for each width cluster.
                 - 'ignore_steps' : list of 1D int arrays.
                     Mask for fishcounts that were ignored (ignored if True) in the moving_fish analysis.
+
+    log_sink : callable or None (optional)
+        Called with the name and the value of the logged data as soon as each
+        analysis step is finished. Its return value is stored in the log dictionary
+        instead of the data. Use a `DiskLogSink` for writing large arrays to disk
+        and keeping only memory-mapped handles.
+        If None, logged data are kept in memory.
+        Defaults to None.
+    dtype : numpy dtype (optional)
+        Data type used for the interpolated data, the EOD snippets and their features.
+        Single precision (`np.float32`) halves the memory needed for these data,
+        but EOD clusters and times may deviate slightly from double precision.
+        Defaults to float.
         
     Returns
     -------
@@ -294,37 +493,54 @@ def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_facto
     log_dict = {}
     
     # extract peaks and interpolated data
-    x_peak, x_trough, eod_hights, eod_widths, i_samplerate, i_data, interp_f, pd_log_dict = extract_eod_times(data, samplerate, np.max([width_factor_shape,width_factor_display,width_factor_wave]), verbose=verbose-1, return_data=return_data, save_path=save_path)
+    with stage('extract_eod_times'):
+        x_peak, x_trough, eod_hights, eod_widths, i_samplerate, i_data, interp_f, pd_log_dict = extract_eod_times(data, samplerate, np.max([width_factor_shape,width_factor_display,width_factor_wave]), eod_samples=eod_samples, verbose=verbose-1, return_data=return_data, save_path=save_path, log_sink=log_sink, dtype=dtype)
     
     if len(x_peak) > 0:
 
+        snippet_cache = {}
+
         # cluster
-        clusters, x_merge, c_log_dict = cluster(x_peak, x_trough, eod_hights, eod_widths, i_data, i_samplerate,
-                                interp_f, width_factor_shape, width_factor_wave, verbose=verbose-1, 
-                                plot_level=plot_level-1, save_plots=save_plots, save_path=save_path, 
-                                ftype=ftype, return_data=return_data) 
+        with stage('cluster'):
+            clusters, x_merge, c_log_dict = cluster(x_peak, x_trough, eod_hights, eod_widths, i_data, i_samplerate,
+                                    interp_f, width_factor_shape, width_factor_wave, workers=workers, verbose=verbose-1, 
+                                    plot_level=plot_level-1, save_plots=save_plots, save_path=save_path, 
+                                    ftype=ftype, return_data=return_data, log_sink=log_sink) 
+            if log_sink is not None:
+                c_log_dict = log_sink('', c_log_dict)
 
         # extract mean eods and times
-        mean_eods, eod_times, eod_peaktimes, eod_troughtimes, cluster_labels = extract_means(i_data, x_merge, x_peak, x_trough, eod_widths,
-                                                              clusters, i_samplerate, width_factor_display, verbose=verbose-1)
+        with stage('extract_means'):
+            mean_eods, eod_times, eod_peaktimes, eod_troughtimes, cluster_labels = extract_means(i_data, x_merge, x_peak, x_trough, eod_widths,
+                                                                  clusters, i_samplerate, width_factor_display, cache=snippet_cache, verbose=verbose-1)
 
 
         # determine clipped clusters (save them, but ignore in other steps)
+        unclipped_clusters = np.copy(clusters)
         clusters, clipped_eods, clipped_times, clipped_peaktimes, clipped_troughtimes = find_clipped_clusters(clusters, mean_eods, eod_times, eod_peaktimes, eod_troughtimes, cluster_labels, width_factor_display, verbose=verbose-1)
+        clipped_clusters = np.where(clusters==-1, unclipped_clusters, -1)
 
 
         # delete the moving fish
-        clusters, zoom_window, mf_log_dict = delete_moving_fish(clusters, x_merge/i_samplerate, len(data)/samplerate,
-                                      eod_hights, eod_widths/i_samplerate, i_samplerate, verbose=verbose-1, plot_level=plot_level-1, save_plot=save_plots, save_path=save_path, ftype=ftype,return_data=return_data)
+        with stage('delete_moving_fish'):
+            clusters, zoom_window, mf_log_dict = delete_moving_fish(clusters, x_merge/i_samplerate, len(data)/samplerate,
+                                          eod_hights, eod_widths/i_samplerate, i_samplerate, verbose=verbose-1, plot_level=plot_level-1, save_plot=save_plots, save_path=save_path, ftype=ftype,return_data=return_data)
         
         if 'moving_fish' in return_data:
-            log_dict['moving_fish'] = mf_log_dict
+            log_dict['moving_fish'] = mf_log_dict if log_sink is None else log_sink('moving_fish', mf_log_dict)
 
         clusters = remove_sparse_detections(clusters,eod_widths,i_samplerate,len(data)/samplerate,verbose=verbose-1)
 
+        if 'pulse_model' in return_data:
+            # clipped fish are part of the model:
+            model_clusters = np.where(clipped_clusters!=-1, clipped_clusters, clusters)
+            log_dict['pulse_model'] = pulse_model(i_data, i_samplerate, len(data)/samplerate, x_peak, eod_hights, eod_widths, model_clusters, width_factor_shape,
+                                                  troughs=x_merge==x_trough, eod_samples=eod_samples)
+
         # extract mean eods
-        mean_eods, eod_times, eod_peaktimes, eod_troughtimes, cluster_labels = extract_means(i_data, x_merge, x_peak, x_trough, eod_widths,
-                                                              clusters, i_samplerate, width_factor_display, verbose=verbose-1)
+        with stage('extract_means'):
+            mean_eods, eod_times, eod_peaktimes, eod_troughtimes, cluster_labels = extract_means(i_data, x_merge, x_peak, x_trough, eod_widths,
+                                                                  clusters, i_samplerate, width_factor_display, cache=snippet_cache, verbose=verbose-1)
 
         mean_eods.extend(clipped_eods)
         eod_times.extend(clipped_times)
@@ -332,26 +548,413 @@ def extract_pulsefish(data, samplerate, fname, width_factor_shape=3, width_facto
         eod_troughtimes.extend(clipped_troughtimes)
 
         if plot_level > 0:
+            from .pulseplots import plot_all, plt
             plot_all(data, eod_peaktimes, eod_troughtimes, samplerate, mean_eods)
             if save_plots:
                 plt.savefig('%sextract_pulsefish_results.%s'%(save_path,ftype))
-        if save_plots:
-            plt.close('all')
+                plt.close('all')
     
         if 'all_eod_times' in return_data:
             log_dict['all_times'] = [x_peak/i_samplerate,x_trough/i_samplerate]
             log_dict['eod_troughtimes'] = eod_troughtimes
+            if log_sink is not None:
+                log_dict['all_times'] = log_sink('all_times', log_dict['all_times'])
         
         log_dict.update(pd_log_dict)
         log_dict.update(c_log_dict)
         log_dict['samplerate'] = i_samplerate
 
-    # reset font family for the main thunderfish plot
-    rcParams['font.family'] = 'sans-serif'
+    if plot_level > 0:
+        # reset font family for the main thunderfish plot
+        from matplotlib import rcParams
+        rcParams['font.family'] = 'sans-serif'
 
     return mean_eods, eod_times, eod_peaktimes, zoom_window, log_dict
 
-def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_peakwidth=0.01, min_peakwidth=None, verbose=0, return_data=[], save_path=''):
+def extract_pulsefish_stream(data, samplerate, fname, block_size=60.0, overlap=1.0,
+                             min_corr=0.9, max_width_ratio=1.5, verbose=0, **kwargs):
+    """ Extract pulsefish EODs from a long recording block by block.
+
+    Blocks of `block_size` seconds overlapping by `overlap` seconds are read
+    one after the other and analysed by extract_pulsefish(). The fish of each
+    block are matched to the fish of the previous blocks by the correlation
+    of their aligned mean EOD waveforms and by the width of their EODs
+    (see match_pulse_waveforms()). Fish that do not match are added as new fish.
+    Several clusters of a block may be assigned to the same fish.
+    Memory usage is bounded by the block size and not by the duration of the recording.
+
+    Parameters
+    ----------
+    data: 1-D array of float or DataLoader
+        The data to be analysed. A `DataLoader` needs to be opened for a single channel.
+    samplerate: float
+        Sampling rate of the data in Hertz.
+    fname: string
+        Path to the analysed recording file.
+
+    block_size: float (optional)
+        Size of the blocks in seconds.
+        Defaults to 60 s.
+    overlap: float (optional)
+        Overlap of consecutive blocks in seconds.
+        EODs in the overlap are taken from the block they are closer to the center of.
+        Defaults to 1 s.
+    min_corr: float (optional)
+        Minimum correlation of the mean EOD waveforms of the same fish.
+        Defaults to 0.9.
+    max_width_ratio: float (optional)
+        Maximum ratio of the widths of the mean EODs of the same fish.
+        Defaults to 1.5.
+    verbose : int (optional)
+        Verbosity level.
+        Defaults to 0.
+    kwargs: dict
+        Further arguments passed on to extract_pulsefish().
+
+    Returns
+    -------
+    mean_eods: list of 2D arrays (3,eod_length)
+        The average EOD for each detected fish over all blocks.
+        First column is time in seconds, second column the mean eod,
+        third column the standard deviation.
+    eod_times: list of 1D arrays
+        For each detected fish the times of EOD peaks or troughs in seconds
+        relative to the beginning of the recording.
+    eod_peaktimes: list of 1D arrays
+        For each detected fish the times of EOD peaks in seconds.
+    zoom_window: tuple of floats
+        Start and endtime of suggested window for plotting EOD timepoints
+        of the first block with pulsefish.
+    """
+    fish = []
+    zoom_window = []
+    for i0, i1, t0, t1 in stream_blocks(len(data), samplerate, block_size, overlap):
+        toffs = i0/samplerate
+        if verbose > 0:
+            print('analyze block %.1fs - %.1fs' % (toffs, i1/samplerate))
+        block = np.asarray(data[i0:i1])
+        mean_eods, eod_times, eod_peaktimes, block_zoom, _ = \
+            extract_pulsefish(block, samplerate, fname, verbose=verbose-1, **kwargs)
+        if len(zoom_window) == 0 and len(eod_times) > 0:
+            zoom_window = [toffs + block_zoom[0], toffs + block_zoom[1]]
+        for mean_eod, times, peaktimes in zip(mean_eods, eod_times, eod_peaktimes):
+            times = times + toffs
+            sel = (times >= t0) & (times < t1)
+            if not np.any(sel):
+                continue
+            n_eods = np.sum(sel)
+            f, shift = match_pulse_waveforms(mean_eod, fish, min_corr, max_width_ratio)
+            if f is None:
+                f = {'time': mean_eod[0], 'sum': np.zeros(mean_eod.shape[1]),
+                     'sqsum': np.zeros(mean_eod.shape[1]), 'count': np.zeros(mean_eod.shape[1]),
+                     'times': [], 'peaktimes': []}
+                fish.append(f)
+                shift = 0.0
+                if verbose > 0:
+                    print('  new pulsefish %d' % len(fish))
+            # accumulate the aligned mean EOD on the time axis of the fish:
+            mean = np.interp(f['time'], mean_eod[0] + shift, mean_eod[1], np.nan, np.nan)
+            std = np.interp(f['time'], mean_eod[0] + shift, mean_eod[2], np.nan, np.nan)
+            valid = np.isfinite(mean)
+            f['sum'][valid] += n_eods*mean[valid]
+            f['sqsum'][valid] += n_eods*(std[valid]**2 + mean[valid]**2)
+            f['count'][valid] += n_eods
+            f['times'].append(times[sel])
+            f['peaktimes'].append(peaktimes[sel] + toffs)
+    mean_eods, eod_times, eod_peaktimes = [], [], []
+    for f in fish:
+        valid = f['count'] > 0
+        mean = f['sum'][valid]/f['count'][valid]
+        std = np.sqrt(np.maximum(f['sqsum'][valid]/f['count'][valid] - mean**2, 0.0))
+        mean_eods.append(np.vstack([f['time'][valid], mean, std]))
+        times = np.concatenate(f['times'])
+        order = np.argsort(times, kind='stable')
+        eod_times.append(times[order])
+        eod_peaktimes.append(np.concatenate(f['peaktimes'])[order])
+    # sort by amplitude like extract_means():
+    order = np.argsort([np.min(m[1]) - np.max(m[1]) for m in mean_eods], kind='stable')
+    return ([mean_eods[i] for i in order], [eod_times[i] for i in order],
+            [eod_peaktimes[i] for i in order], zoom_window)
+
+
+def stream_blocks(n, samplerate, block_size=60.0, overlap=1.0):
+    """ Layout of overlapping blocks for analyzing a long recording.
+
+    The blocks are spaced by `block_size - overlap` seconds. The last
+    block is aligned to the end of the data.
+    Each block is assigned the part of the recording not shared with its
+    neighbors, i.e. everything up to the middle of the overlaps, such that
+    these parts tile the whole recording without gaps.
+
+    Parameters
+    ----------
+    n: int
+        Number of samples of the recording.
+    samplerate: float
+        Sampling rate of the recording in Hertz.
+    block_size: float
+        Size of the blocks in seconds.
+    overlap: float
+        Overlap of successive blocks in seconds. If larger than
+        `block_size`, half of the block size is used.
+
+    Returns
+    -------
+    blocks: list of tuples of (int, int, float, float)
+        For each block the start and end index of the block
+        and the start and end time in seconds of the part
+        of the recording assigned to it.
+    """
+    if overlap >= block_size:
+        overlap = 0.5*block_size
+    n_win = min(int(block_size*samplerate), n)
+    n_step = max(n_win - int(overlap*samplerate), 1)
+    starts = list(range(0, n - n_win + 1, n_step))
+    if starts[-1] + n_win < n:
+        starts.append(n - n_win)
+    blocks = []
+    for k, i0 in enumerate(starts):
+        # part of the block not shared with the neighboring blocks:
+        t0 = 0.0 if k == 0 else 0.5*(i0 + starts[k-1] + n_win)/samplerate
+        t1 = n/samplerate if k == len(starts)-1 else 0.5*(starts[k+1] + i0 + n_win)/samplerate
+        blocks.append((i0, i0 + n_win, t0, t1))
+    return blocks
+
+
+def match_pulse_waveforms(mean_eod, fish, min_corr=0.9, max_width_ratio=1.5):
+    """ Find the fish with the most similar mean EOD waveform.
+
+    The waveforms are aligned by the maximum of their cross-correlation.
+    Only fish with similar widths of their mean EODs are considered.
+
+    Parameters
+    ----------
+    mean_eod: 2D array (3,eod_length)
+        Time, mean and standard deviation of an EOD waveform.
+    fish: list of dict
+        The fish with their accumulated mean EOD waveforms
+        (keys 'time', 'sum', and 'count', see extract_pulsefish_stream()).
+    min_corr: float (optional)
+        Minimum correlation of the aligned mean EOD waveforms.
+        Defaults to 0.9.
+    max_width_ratio: float (optional)
+        Maximum ratio of the widths of the mean EODs.
+        Defaults to 1.5.
+
+    Returns
+    -------
+    best_fish: dict or None
+        The matching fish from `fish` with the largest correlation,
+        None if no fish matches.
+    shift: float
+        Time in seconds to be added to the time of `mean_eod` for aligning it
+        with the waveform of `best_fish`.
+    """
+    best_fish = None
+    best_corr = min_corr
+    best_shift = 0.0
+    width = mean_eod[0,-1] - mean_eod[0,0]
+    for f in fish:
+        ref_width = f['time'][-1] - f['time'][0]
+        if max(width, ref_width) > max_width_ratio*min(width, ref_width):
+            continue
+        ref = np.where(f['count'] > 0, f['sum']/np.maximum(f['count'], 1), 0.0)
+        ref = ref - np.mean(ref)
+        dt = f['time'][1] - f['time'][0]
+        t = np.arange(mean_eod[0,0], mean_eod[0,-1], dt)
+        y = np.interp(t, mean_eod[0], mean_eod[1])
+        y -= np.mean(y)
+        norm = np.linalg.norm(ref)*np.linalg.norm(y)
+        if norm == 0:
+            continue
+        corr = correlate(ref, y)/norm
+        i = np.argmax(corr)
+        if corr[i] > best_corr:
+            best_fish = f
+            best_corr = corr[i]
+            best_shift = f['time'][0] - t[0] + (i - len(y) + 1)*dt
+    return best_fish, best_shift
+
+
+class InterpolatedData(object):
+    """ Quadratically interpolated data that are evaluated on demand.
+
+    Behaves like the array
+    `interp1d(range(len(data)), data, kind='quadratic')(np.arange(0, len(data)-1, 1/interp_f))`
+    for indexing with integers, arrays of integers, and slices,
+    but only the coefficients of the interpolating spline are stored.
+    The interpolated data are computed in blocks of `block_size` samples
+    whenever they are accessed. The most recently used `max_blocks`
+    blocks are kept, so that repeated accesses to nearby data are cheap.
+
+    Parameters
+    ----------
+    data: 1-D array of float
+        The data to be interpolated.
+    interp_f: int
+        Interpolation factor.
+    dtype: numpy dtype (optional)
+        Data type of the interpolated data.
+        Defaults to float.
+    block_size: int (optional)
+        Number of interpolated samples evaluated and cached at once.
+        Defaults to 2**16.
+    max_blocks: int (optional)
+        Maximum number of cached blocks.
+        Defaults to 64.
+    """
+
+    def __init__(self, data, interp_f, dtype=float, block_size=2**16, max_blocks=64):
+        self.interp_f = interp_f
+        self.dtype = np.dtype(dtype)
+        self.dx = 1.0/interp_f
+        self.n = int(np.ceil((len(data)-1)/self.dx))
+        self.spline = make_interp_spline(np.arange(len(data), dtype=float),
+                                         data, k=2, check_finite=False)
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            idx = np.arange(*key.indices(self.n))
+        else:
+            idx = np.asarray(key)
+            idx = np.where(idx < 0, idx + self.n, idx)
+            if np.any((idx < 0) | (idx >= self.n)):
+                raise IndexError('index out of bounds for interpolated data of length %d' % self.n)
+        if idx.size == 0:
+            return np.zeros(idx.shape, dtype=self.dtype)
+        block_idx = idx//self.block_size
+        blocks = np.unique(block_idx)
+        if len(blocks) > self.max_blocks:
+            return np.asarray(self.spline(idx*self.dx), dtype=self.dtype)[()]
+        values = np.concatenate([self.block(b) for b in blocks])
+        pos = np.searchsorted(blocks, block_idx)*self.block_size + idx%self.block_size
+        return values[pos][()]
+
+    def block(self, b):
+        """ Interpolated data of a single block.
+
+        Parameters
+        ----------
+        b: int
+            Index of the block.
+
+        Returns
+        -------
+        values: 1-D array
+            The interpolated data from index `b*block_size`
+            to index `(b+1)*block_size` or the end of the data.
+        """
+        with self.lock:
+            if b in self.blocks:
+                self.blocks.move_to_end(b)
+                return self.blocks[b]
+        idx = np.arange(b*self.block_size, min((b+1)*self.block_size, self.n))
+        values = np.asarray(self.spline(idx*self.dx), dtype=self.dtype)
+        with self.lock:
+            self.blocks[b] = values
+            while len(self.blocks) > self.max_blocks:
+                self.blocks.popitem(last=False)
+        return values
+
+    def extrema(self):
+        """ Local extrema of the interpolated data.
+
+        The interpolated data are traversed block by block. All samples
+        except the ones within strictly rising or falling stretches are
+        returned. Running `detect_peaks()` with a fixed threshold on these
+        samples results in the same peaks and troughs as running it on all
+        of the interpolated data, but needs only a fraction of the memory.
+
+        Returns
+        -------
+        indices: 1-D array of int
+            Indices of the local extrema in the interpolated data.
+        values: 1-D array
+            The interpolated data at `indices`.
+        """
+        indices = [np.arange(min(1, self.n))]
+        values = [self[:min(1, self.n)]]
+        prev = np.zeros(0, dtype=self.dtype)
+        for b in range((self.n + self.block_size - 1)//self.block_size):
+            seq = np.concatenate((prev, self.block(b)))
+            d = np.diff(seq)
+            keep = ~(((d[:-1] > 0) & (d[1:] > 0)) | ((d[:-1] < 0) & (d[1:] < 0)))
+            k = np.nonzero(keep)[0] + 1
+            indices.append(b*self.block_size - len(prev) + k)
+            values.append(seq[k])
+            prev = seq[-2:]
+        if self.n > 1:
+            indices.append(np.array([self.n-1]))
+            values.append(self[self.n-1:])
+        return np.concatenate(indices), np.concatenate(values)
+
+
+class DiskLogSink(object):
+    """ Store data logged by extract_pulsefish() in numpy files.
+
+    A log sink is called with the name and the value of logged data as soon
+    as the analysis step producing them is finished, and returns what is stored
+    in the log dictionary instead of the value.
+    This sink writes numpy arrays and `InterpolatedData` with at least `min_size`
+    elements to npy files and returns read-only memory-mapped arrays of these files.
+    Interpolated data are written block by block, so they are never
+    held in memory as a whole.
+    Dictionaries, lists, and tuples are traversed and all other values
+    are returned unchanged.
+
+    Parameters
+    ----------
+    path: string
+        Directory the npy files are written to. Created if it does not exist.
+        Nested data are written to subdirectories.
+    min_size: int (optional)
+        Arrays with less elements are kept in memory.
+        Defaults to 1024.
+    block_size: int (optional)
+        Number of samples of interpolated data computed at once.
+        Defaults to 2**18.
+    """
+
+    def __init__(self, path, min_size=1024, block_size=2**18):
+        self.path = path
+        self.min_size = min_size
+        self.block_size = block_size
+
+    def __call__(self, name, value):
+        if isinstance(value, dict):
+            return {k: self(os.path.join(name, str(k)), v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)([self(os.path.join(name, str(i)), v) for i, v in enumerate(value)])
+        if isinstance(value, InterpolatedData):
+            file_path = self.file_path(name)
+            out = np.lib.format.open_memmap(file_path, mode='w+', dtype=float, shape=(len(value),))
+            for i in range(0, len(value), self.block_size):
+                out[i:i+self.block_size] = value[i:i+self.block_size]
+            out.flush()
+            del out
+            return np.load(file_path, mmap_mode='r')
+        if isinstance(value, np.ndarray) and not isinstance(value, np.memmap) and \
+           value.size >= self.min_size and not value.dtype.hasobject:
+            file_path = self.file_path(name)
+            np.save(file_path, value)
+            return np.load(file_path, mmap_mode='r')
+        return value
+
+    def file_path(self, name):
+        file_path = os.path.join(self.path, name + '.npy')
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        return file_path
+
+
+def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, eod_samples=0, max_peakwidth=0.01, min_peakwidth=None, verbose=0, return_data=[], save_path='', log_sink=None, dtype=float):
 
     """ Extract peaks from data which are potentially EODs.
 
@@ -367,6 +970,12 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
     interp_freq: int or float (optional)
         Desired resolution in Hz. Data will be interpolated to match this resolution.
         Defaults to 500 kHz
+    eod_samples: int (optional)
+        If larger than zero, choose the interpolation factor for the recording
+        such that the narrowest EODs (10% quantile of peak-trough widths
+        in the original data) are sampled with `eod_samples` samples between peak and trough.
+        The resolution is still limited by `interp_freq`.
+        Defaults to zero, i.e. always interpolate to `interp_freq`.
     max_peakwidth: float (optional)
         Maximum width for peak detection in seconds.
         Defaults to 10 ms.
@@ -386,6 +995,13 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
     save_path : string (optional)
         Path to save data to. Only important if you wish to save data (save_data==True).
         Defaults to ''.
+    log_sink : callable or None (optional)
+        Log sink the logged data are passed to (see extract_pulsefish()).
+        Defaults to None.
+    dtype : numpy dtype (optional)
+        Data type of the interpolated data. Use `np.float32` to halve the memory
+        needed by the interpolated data and all EOD snippets extracted from them.
+        Defaults to float.
 
     Returns
     -------
@@ -399,7 +1015,7 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
         EOD widths for each x_peak (in samples).
     samplerate: int or float
         New samplerate (after interpolation).
-    data: 
+    data: InterpolatedData
         Interpolated data.
     interpolation_factor: 
         Factor used for interpolation.
@@ -410,18 +1026,29 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
     peak_detection_result = {}
     
     # standard deviation of data in small snippets:
-    threshold = detect_threshold(np.array(data),samplerate)
-
-    try:
-        interp_f = int(interp_freq/samplerate)
-        f = interp1d(range(len(data)),data,kind='quadratic')
-        data = f(np.arange(0,len(data)-1,1/interp_f))
-    except MemoryError:
-        interp_f = 1
+    threshold = detect_threshold(data,samplerate)
+
+    interp_f = max(1, int(interp_freq/samplerate))
+    if eod_samples > 0:
+        # resolution needed by the narrowest EODs in the original data:
+        x_peaks, x_troughs = detect_peaks(data, threshold)
+        widths = []
+        if len(x_peaks) > 1 and len(x_troughs) > 1:
+            widths = detect_eod_peaks(x_peaks.astype('int'), x_troughs.astype('int'),
+                                      data, max_peakwidth*samplerate, 2)[3]
+        if len(widths) > 0:
+            interp_f = min(interp_f, max(1, int(np.ceil(eod_samples/np.percentile(widths, 10)))))
+            if verbose>0:
+                print('Interpolation factor:                                   %5i'%interp_f)
+    data = InterpolatedData(data, interp_f, dtype)
 
-    orig_x_peaks, orig_x_troughs = detect_peaks(data, threshold)
-    orig_x_peaks = orig_x_peaks.astype('int')
-    orig_x_troughs = orig_x_troughs.astype('int')
+    # detect peaks and troughs in the interpolated data
+    # on their local extrema only:
+    extrema_x, extrema_y = data.extrema()
+    orig_x_peaks, orig_x_troughs = detect_peaks(extrema_y, threshold)
+    orig_x_peaks = extrema_x[orig_x_peaks]
+    orig_x_troughs = extrema_x[orig_x_troughs]
+    del extrema_x, extrema_y
 
     if verbose>0:
         print('Peaks extracted:                                        %5i'%(len(orig_x_peaks)))
@@ -432,16 +1059,19 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
         return [], [], [], [], samplerate*interp_f,data, interp_f, peak_detection_result
     else:
 
+        # peak widths in samples of the interpolated data,
+        # by default relative to interp_freq as always:
+        peakwidth_freq = samplerate*interp_f if eod_samples > 0 else interp_freq
         if min_peakwidth == None:
             min_peakwidth = interp_f*2
         else:
-            min_peakwidth = min_peakwidth*interp_freq
+            min_peakwidth = min_peakwidth*peakwidth_freq
 
-        peaks, troughs, hights, widths, apeaks, atroughs, ahights, awidths = detect_eod_peaks(orig_x_peaks, orig_x_troughs, data, max_peakwidth*interp_freq, min_peakwidth, verbose=verbose-1)
+        peaks, troughs, hights, widths, apeaks, atroughs, ahights, awidths = detect_eod_peaks(orig_x_peaks, orig_x_troughs, data, max_peakwidth*peakwidth_freq, min_peakwidth, verbose=verbose-1)
         x_peaks, x_troughs, eod_hights, eod_widths = discard_connecting_eods(peaks, troughs, hights, widths, verbose=verbose-1)
         
         if 'peak_detection' in return_data:
-            peak_detection_result = {   "data": data,
+            peak_detection_result = {   "data": data[:] if log_sink is None else data,
                                         "interp_f": interp_f,
                                         "peaks_1": orig_x_peaks,
                                         "troughs_1": orig_x_troughs,
@@ -452,6 +1082,8 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
                                         "peaks_4": x_peaks,
                                         "troughs_4": x_troughs
                                     }
+            if log_sink is not None:
+                peak_detection_result = log_sink('', peak_detection_result)
 
         # only take those where the maximum cutwidth does not casue issues
         # so if the width_factor times the width + x is more than length.
@@ -471,7 +1103,6 @@ def extract_eod_times(data, samplerate, width_factor, interp_freq=500000, max_pe
         return x_peaks[cut_idx], x_troughs[cut_idx], eod_hights[cut_idx], eod_widths[cut_idx], samplerate*interp_f, data, interp_f, peak_detection_result
 
     
-@jit(nopython=True)
 def detect_threshold(data, samplerate, win_size = 0.0005, n_stds = 1000, threshold_factor=6.0):
     """ Determine a suitable threshold for peak detection.
         The threshold is based on the median standard deviation of smaller sections of the recording data. 
@@ -500,16 +1131,112 @@ def detect_threshold(data, samplerate, win_size = 0.0005, n_stds = 1000, thresho
             Suitable peak detection threshold for recording data.
 
     """
+    win_size_indices, step, n_windows = threshold_windows(len(data), samplerate, win_size, n_stds)
+    stds = window_stds(data, win_size_indices, step, n_windows)
+    return np.median(stds)*threshold_factor
+
+
+def detect_threshold_stream(data, samplerate, win_size = 0.0005, n_stds = 1000, threshold_factor=6.0, block_size=60.0):
+    """ Determine a suitable threshold for peak detection by reading the data block by block.
+        Same as detect_threshold(), but the data are read sequentially in blocks,
+        so that the threshold of long recordings can be computed with bounded memory.
+
+        Parameters
+        ----------
+        data: 1-D array of float or DataLoader
+            The data to be analysed. A `DataLoader` needs to be opened for a single channel.
+        samplerate: int or float
+            Sampling rate of the data
+
+        win_size: float (optional)
+            Window size for determining peak detection threshold in seconds.
+            Defaults to 0.5 ms.
+        n_stds: int (optional)
+            Number of standard deviations to make on data for determining peak detection threshold.
+            Defaults to 1000.
+        threshold_factor: float (optional)
+            Multiplication factor for peak detection threshold.
+            Defaults to 6.
+        block_size: float (optional)
+            Maximum size of the blocks read from `data` in seconds.
+            Defaults to 60 s.
+
+        Returns
+        -------
+        threshold: float
+            Suitable peak detection threshold for recording data.
+
+    """
+    win_size_indices, step, n_windows = threshold_windows(len(data), samplerate, win_size, n_stds)
+    stds = np.zeros(n_windows)
+    block_windows = max(1, int(block_size*samplerate)//step)
+    for k0 in range(0, n_windows, block_windows):
+        k1 = min(k0 + block_windows, n_windows)
+        block = np.asarray(data[k0*step:(k1-1)*step + win_size_indices])
+        stds[k0:k1] = window_stds(block, win_size_indices, step, k1 - k0)
+    return np.median(stds)*threshold_factor
+
+
+def threshold_windows(n, samplerate, win_size = 0.0005, n_stds = 1000):
+    """ Windows used by detect_threshold() for computing standard deviations.
+
+        Parameters
+        ----------
+        n: int
+            Number of data samples.
+        samplerate: int or float
+            Sampling rate of the data
+        win_size: float (optional)
+            Window size in seconds, at least 10 samples.
+            Defaults to 0.5 ms.
+        n_stds: int (optional)
+            Approximate number of windows.
+            Defaults to 1000.
+
+        Returns
+        -------
+        win_size_indices: int
+            Window size in samples.
+        step: int
+            Offset between the starts of successive windows in samples.
+        n_windows: int
+            Number of windows.
+    """
     win_size_indices = int(win_size * samplerate)
     if win_size_indices < 10:
         win_size_indices = 10
-    step = len(data)//n_stds
+    step = n//n_stds
     if step < win_size_indices//2:
         step = win_size_indices//2
-    stds = [np.std(data[i:i+win_size_indices])
-            for i in range(0, len(data)-win_size_indices, step)]
+    n_windows = len(range(0, n-win_size_indices, step))
+    return win_size_indices, step, n_windows
+
+
+def window_stds(data, win_size_indices, step, n_windows):
+    """ Standard deviations of equally spaced windows of the data.
+        The windows are a strided view onto the data, the data are not copied.
+
+        Parameters
+        ----------
+        data: 1-D array of float
+            The data.
+        win_size_indices: int
+            Window size in samples.
+        step: int
+            Offset between the starts of successive windows in samples.
+        n_windows: int
+            Number of windows, the first one starting at the first sample.
 
-    return np.median(np.array(stds))*threshold_factor
+        Returns
+        -------
+        stds: 1-D array of float
+            Standard deviation of each window.
+    """
+    data = np.asarray(data)
+    windows = np.lib.stride_tricks.as_strided(data, shape=(n_windows, win_size_indices),
+                                              strides=(step*data.strides[0], data.strides[0]),
+                                              writeable=False)
+    return np.std(windows, axis=1)
 
 def detect_eod_peaks(main_event_positions, side_event_positions, data, max_width=20, min_width=2,verbose=0):
     """
@@ -574,15 +1301,16 @@ def detect_eod_peaks(main_event_positions, side_event_positions, data, max_width
     # determine which trough to assign to the peak by taking either the steepest slope,
     # or, when slopes are similar on both sides (within 25% difference), take the trough 
     # with the maximum hight difference to the peak.
-    trough_idxs = np.argmax(np.vstack((np.abs(y-l_side_y),np.abs(y-r_side_y))),axis=0)
+    #calculated using absolutes in case of for example troughs instead of peaks as main events 
+    l_hights = np.abs(y-l_side_y)
+    r_hights = np.abs(y-r_side_y)
+    right = r_hights > l_hights
     slope_idxs = (np.abs(l_slope-r_slope)/(0.5*l_slope+0.5*r_slope) > 0.25)
-    trough_idxs[slope_idxs] = np.argmax(np.array(np.vstack(np.array([l_slope[slope_idxs],r_slope[slope_idxs]]))),axis=0)
+    right[slope_idxs] = r_slope[slope_idxs] > l_slope[slope_idxs]
 
-    #calculated using absolutes in case of for example troughs instead of peaks as main events 
-    right_or_left = np.vstack([np.abs(trough_idxs-1),trough_idxs])
-    hights = np.sum(np.vstack([np.abs(y-l_side_y),np.abs(y-r_side_y)])*right_or_left,axis=0)
-    widths = np.sum(np.vstack([l_distance,r_distance])*right_or_left,axis=0)
-    x_trough = np.sum((x_peak + np.vstack([-l_distance,r_distance]))*right_or_left,axis=0)
+    hights = np.where(right, r_hights, l_hights)
+    widths = np.where(right, r_distance, l_distance)
+    x_trough = np.where(right, x_peak + r_distance, x_peak - l_distance)
 
     keep_events = ((widths>min_width) & (widths<max_width))
 
@@ -591,7 +1319,6 @@ def detect_eod_peaks(main_event_positions, side_event_positions, data, max_width
 
     return x_peak[keep_events], x_trough[keep_events], hights[keep_events], widths[keep_events], x_peak, x_trough, hights, widths
 
-@jit(nopython=True)
 def discard_connecting_eods(x_peak, x_trough, hights, widths, verbose=0):
     """
     If two detected EODs share the same closest trough, keep only the highest peak
@@ -614,22 +1341,37 @@ def discard_connecting_eods(x_peak, x_trough, hights, widths, verbose=0):
     x_peak, x_trough, hights, widths : lists of ints and floats
         EOD location and features of the non-discarded EODs
     """
-    keep_idxs = np.ones(len(x_peak))
-
-    for tr in np.unique(x_trough):
-        if len(x_trough[x_trough==tr]) > 1:
-            slopes = hights[x_trough==tr]/widths[x_trough==tr]
+    if len(x_peak) == 0:
+        return x_peak, x_trough, hights, widths
 
-            if (np.max(slopes)!=np.min(slopes)) and (np.abs(np.max(slopes)-np.min(slopes))/(0.5*np.max(slopes)+0.5*np.min(slopes)) > 0.25):
-                keep_idxs[np.where(x_trough==tr)[0][np.argmin(hights[x_trough==tr]/widths[x_trough==tr])]] = 0
-            else:
-                keep_idxs[np.where(x_trough==tr)[0][np.argmin(hights[x_trough==tr])]] = 0
-            
-    return x_peak[np.where(keep_idxs==1)[0]], x_trough[np.where(keep_idxs==1)[0]], hights[np.where(keep_idxs==1)[0]], widths[np.where(keep_idxs==1)[0]]
+    # sort EODs by their trough, then by slope or hight, then by index,
+    # so that the first EOD of each trough has the smallest slope or hight:
+    slopes = hights/widths
+    ind = np.arange(len(x_peak))
+    slope_order = np.lexsort((ind, slopes, x_trough))
+    hight_order = np.lexsort((ind, hights, x_trough))
+
+    # EODs sharing a trough:
+    sorted_troughs = x_trough[slope_order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_troughs)) + 1))
+    counts = np.diff(np.append(starts, len(sorted_troughs)))
+
+    # discard the EOD with the smallest slope if slopes differ,
+    # otherwise the one with the smallest hight:
+    max_slopes = np.maximum.reduceat(slopes[slope_order], starts)
+    min_slopes = np.minimum.reduceat(slopes[slope_order], starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        differ = (max_slopes!=min_slopes) & (np.abs(max_slopes-min_slopes)/(0.5*max_slopes+0.5*min_slopes) > 0.25)
+    discard = np.where(differ, slope_order[starts], hight_order[starts])[counts > 1]
+
+    keep_idxs = np.ones(len(x_peak), dtype=bool)
+    keep_idxs[discard] = False
+    return x_peak[keep_idxs], x_trough[keep_idxs], hights[keep_idxs], widths[keep_idxs]
 
 def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f, width_factor_shape, width_factor_wave, fname='',
             n_gaus_hight=10, merge_threshold_hight=0.1, n_gaus_width=3, merge_threshold_width=0.5, minp=10,
-            verbose=0, plot_level=0, save_plots=False, save_path='', ftype='pdf', return_data=[]):
+            workers=1, verbose=0, plot_level=0, save_plots=False, save_path='', ftype='pdf', return_data=[],
+            log_sink=None):
     
     """ Cluster EODs.
 
@@ -675,6 +1417,11 @@ def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f,
     minp : int (optional)
         Minimum number of points for core clusters (DBSCAN).
         Defaults to 10.
+    workers : int (optional)
+        Number of threads used for concurrently extracting snippets and
+        clustering heights and shapes of all width and height clusters.
+        The resulting labels do not depend on the number of threads.
+        Defaults to 1.
    
     verbose : int (optional)
         Verbosity level.
@@ -696,6 +1443,9 @@ def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f,
         Keys that specify data to be logged. Keys that can be used to log data in this function are:
         'all_cluster_steps', 'BGM_width', 'BGM_height', 'snippet_clusters', 'eod_deletion' (see extract_pulsefish()).
         Defaults to [].
+    log_sink : callable or None (optional)
+        Log sink snippet clusters are passed to as soon as they are computed (see extract_pulsefish()).
+        Defaults to None.
 
     Returns
     -------
@@ -741,112 +1491,140 @@ def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f,
 
     w_labels, w_counts = unique_counts(width_labels)
     unique_width_labels = w_labels[w_counts>minp]
+    width_masks = [width_labels==width_label for width_label in unique_width_labels]
+
+    # snippet features, height clusters, and shape clusters of the width
+    # clusters do not depend on each other and are computed concurrently,
+    # cluster labels are then assigned sequentially (no threads for BGM plots).
+    # Only as many width clusters as there are workers are computed ahead,
+    # so that their snippets do not need to be kept all at once.
+    # Within a width cluster, the peak and trough snippets and the shape
+    # clusters of each height cluster are computed as separate tasks:
+    def width_cluster(wi):
+        w_mask = width_masks[wi]
+        # peak and trough centered snippets:
+        p_task = submit_task(executor, extract_snippet_features, data, eod_xp[w_mask], eod_widths[w_mask], eod_hights[w_mask], width_factor_shape)
+        t_task = submit_task(executor, extract_snippet_features, data, eod_xt[w_mask], eod_widths[w_mask], eod_hights[w_mask], width_factor_shape)
+        p_snippet_features = p_task()
+        t_snippet_features = t_task()
+        # height clusters:
+        p_bg_ratio = p_snippet_features[3]
+        t_bg_ratio = t_snippet_features[3]
+        hight_clusters = BGM(eod_hights[w_mask],min(merge_threshold_hight,np.median(np.min(np.vstack([p_bg_ratio,t_bg_ratio]),axis=0))),n_gaus_hight,use_log=True,verbose=verbose-1,plot_level=plot_level-1,xlabel='height [a.u.]',save_plot=save_plots,save_path=save_path,save_name=('height_'+str(wi)),ftype=ftype,return_data=return_data)
+        # shape clusters of peak and trough centered snippets of each height cluster:
+        hight_labels = hight_clusters[0]
+        h_labels, h_counts = unique_counts(hight_labels)
+        shape_tasks = [(submit_task(executor, cluster_on_shape, p_snippet_features[2][hight_labels==hight_label], p_bg_ratio, minp, verbose=0),
+                        submit_task(executor, cluster_on_shape, t_snippet_features[2][hight_labels==hight_label], t_bg_ratio, minp, verbose=0))
+                       for hight_label in h_labels[h_counts>minp]]
+        shape_clusters = [(p_task(), t_task()) for p_task, t_task in shape_tasks]
+        return p_snippet_features, t_snippet_features, hight_clusters, shape_clusters
 
-    for wi, width_label in enumerate(unique_width_labels):
-
-        # select only features in one width cluster at a time
-        w_eod_widths = eod_widths[width_labels==width_label]
-        w_eod_hights = eod_hights[width_labels==width_label]
-        w_eod_xp = eod_xp[width_labels==width_label]
-        w_eod_xt = eod_xt[width_labels==width_label]
-        wp_clusters = np.ones(len(w_eod_xp))*-1
-        wt_clusters = np.ones(len(w_eod_xp))*-1
-        wartefact_mask = np.ones(len(w_eod_xp))
-
-        # determine hight labels
-        raw_p_snippets, p_snippets, p_features, p_bg_ratio = extract_snippet_features(data, w_eod_xp, w_eod_widths, w_eod_hights, width_factor_shape)
-        raw_t_snippets, t_snippets, t_features, t_bg_ratio = extract_snippet_features(data, w_eod_xt, w_eod_widths, w_eod_hights, width_factor_shape)
-
-        hight_labels, bgm_log_dict = BGM(w_eod_hights,min(merge_threshold_hight,np.median(np.min(np.vstack([p_bg_ratio,t_bg_ratio]),axis=0))),n_gaus_hight,use_log=True,verbose=verbose-1,plot_level=plot_level-1,xlabel='height [a.u.]',save_plot=save_plots,save_path=save_path,save_name=('height_'+str(wi)),ftype=ftype,return_data=return_data)
-        saved_data.update(bgm_log_dict)
-
-        if verbose>0:
-            print('Clusters generated based on EOD hight:')
-            [print('N_{} = {:>4}      h_{} = {:.4f}'.format(l,len(hight_labels[hight_labels==l]),l,np.mean(w_eod_hights[hight_labels==l]))) for l in np.unique(hight_labels)]   
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        executor = pool if workers > 1 and plot_level < 2 else None
+        width_results = lazy_map(width_cluster, range(len(width_masks)), executor, workers)
+        try:
+            for wi, width_label in enumerate(unique_width_labels):
 
-        h_labels, h_counts = unique_counts(hight_labels)
-        unique_hight_labels = h_labels[h_counts>minp]
+                p_snippet_features, t_snippet_features, hight_clusters, shape_clusters = next(width_results)
 
-        if plot_level>0 or 'all_cluster_steps' in return_data:
-            all_hightlabels.append(hight_labels)
-            all_heights.append(w_eod_hights)
-            all_unique_hightlabels.append(unique_hight_labels)
-            shape_labels = []
-            cfeatures = []
-            csnippets = []
+                # select only features in one width cluster at a time
+                w_eod_hights = eod_hights[width_labels==width_label]
+                w_eod_xp = eod_xp[width_labels==width_label]
+                wp_clusters = np.ones(len(w_eod_xp))*-1
+                wt_clusters = np.ones(len(w_eod_xp))*-1
 
-        for hi,hight_label in enumerate(unique_hight_labels):
+                raw_p_snippets, p_snippets, p_features, p_bg_ratio = p_snippet_features
+                raw_t_snippets, t_snippets, t_features, t_bg_ratio = t_snippet_features
 
-            h_eod_widths = w_eod_widths[hight_labels==hight_label]
-            h_eod_hights = w_eod_hights[hight_labels==hight_label]
-            h_eod_xp = w_eod_xp[hight_labels==hight_label]
-            h_eod_xt = w_eod_xt[hight_labels==hight_label]
+                # determine hight labels
+                hight_labels, bgm_log_dict = hight_clusters
+                saved_data.update(bgm_log_dict)
 
-            p_clusters = cluster_on_shape(p_features[hight_labels==hight_label],p_bg_ratio,minp,verbose=0)            
-            t_clusters = cluster_on_shape(t_features[hight_labels==hight_label],t_bg_ratio,minp,verbose=0)            
-            
-            if plot_level>1:
-                plot_feature_extraction(raw_p_snippets[hight_labels==hight_label],p_snippets[hight_labels==hight_label],p_features[hight_labels==hight_label],p_clusters,1/samplerate,0)
-                plt.savefig('%sDBSCAN_peak_w%i_h%i.%s'%(save_path,wi,hi,ftype))
-                plot_feature_extraction(raw_t_snippets[hight_labels==hight_label],t_snippets[hight_labels==hight_label],t_features[hight_labels==hight_label],t_clusters,1/samplerate,1)
-                plt.savefig('%sDBSCAN_trough_w%i_h%i.%s'%(save_path,wi,hi,ftype))
-
-            if 'snippet_clusters' in return_data:
-                saved_data['snippet_clusters_%i_%i_peak'%(width_label,hight_label)] = {
-                    'raw_snippets':raw_p_snippets[hight_labels==hight_label],
-                    'snippets':p_snippets[hight_labels==hight_label],
-                    'features':p_features[hight_labels==hight_label],
-                    'clusters':p_clusters,
-                    'samplerate':samplerate}
-                saved_data['snippet_clusters_%i_%i_trough'%(width_label,hight_label)] = {
-                    'raw_snippets':raw_t_snippets[hight_labels==hight_label],
-                    'snippets':t_snippets[hight_labels==hight_label],
-                    'features':t_features[hight_labels==hight_label],
-                    'clusters':t_clusters,
-                    'samplerate':samplerate}
-
-            if plot_level>0 or 'all_cluster_steps' in return_data:
-                shape_labels.append([p_clusters,t_clusters])
-                cfeatures.append([p_features[hight_labels==hight_label],t_features[hight_labels==hight_label]])
-                csnippets.append([p_snippets[hight_labels==hight_label],t_snippets[hight_labels==hight_label]])
-
-            p_clusters[p_clusters==-1] = -max_label_p - 1
-            wp_clusters[hight_labels==hight_label] = p_clusters + max_label_p
-            max_label_p = max(np.max(wp_clusters),np.max(all_p_clusters)) + 1
-
-            t_clusters[t_clusters==-1] = -max_label_t - 1
-            wt_clusters[hight_labels==hight_label] = t_clusters + max_label_t
-            max_label_t = max(np.max(wt_clusters),np.max(all_t_clusters)) + 1
+                if verbose>0:
+                    print('Clusters generated based on EOD hight:')
+                    [print('N_{} = {:>4}      h_{} = {:.4f}'.format(l,len(hight_labels[hight_labels==l]),l,np.mean(w_eod_hights[hight_labels==l]))) for l in np.unique(hight_labels)]
+
+                h_labels, h_counts = unique_counts(hight_labels)
+                unique_hight_labels = h_labels[h_counts>minp]
+
+                if plot_level>0 or 'all_cluster_steps' in return_data:
+                    all_hightlabels.append(hight_labels)
+                    all_heights.append(w_eod_hights)
+                    all_unique_hightlabels.append(unique_hight_labels)
+                    shape_labels = []
+                    cfeatures = []
+                    csnippets = []
+
+                for hi,hight_label in enumerate(unique_hight_labels):
+
+                    p_clusters, t_clusters = shape_clusters[hi]
+
+                    if plot_level>1:
+                        from .pulseplots import plot_feature_extraction, plt
+                        plot_feature_extraction(raw_p_snippets[hight_labels==hight_label],p_snippets[hight_labels==hight_label],p_features[hight_labels==hight_label],p_clusters,1/samplerate,0)
+                        plt.savefig('%sDBSCAN_peak_w%i_h%i.%s'%(save_path,wi,hi,ftype))
+                        plot_feature_extraction(raw_t_snippets[hight_labels==hight_label],t_snippets[hight_labels==hight_label],t_features[hight_labels==hight_label],t_clusters,1/samplerate,1)
+                        plt.savefig('%sDBSCAN_trough_w%i_h%i.%s'%(save_path,wi,hi,ftype))
+
+                    if 'snippet_clusters' in return_data:
+                        saved_data['snippet_clusters_%i_%i_peak'%(width_label,hight_label)] = {
+                            'raw_snippets':raw_p_snippets[hight_labels==hight_label],
+                            'snippets':p_snippets[hight_labels==hight_label],
+                            'features':p_features[hight_labels==hight_label],
+                            'clusters':p_clusters,
+                            'samplerate':samplerate}
+                        saved_data['snippet_clusters_%i_%i_trough'%(width_label,hight_label)] = {
+                            'raw_snippets':raw_t_snippets[hight_labels==hight_label],
+                            'snippets':t_snippets[hight_labels==hight_label],
+                            'features':t_features[hight_labels==hight_label],
+                            'clusters':t_clusters,
+                            'samplerate':samplerate}
+
+                    if plot_level>0 or 'all_cluster_steps' in return_data:
+                        shape_labels.append([p_clusters,t_clusters])
+                        cfeatures.append([p_features[hight_labels==hight_label],t_features[hight_labels==hight_label]])
+                        csnippets.append([p_snippets[hight_labels==hight_label],t_snippets[hight_labels==hight_label]])
+
+                    p_clusters[p_clusters==-1] = -max_label_p - 1
+                    wp_clusters[hight_labels==hight_label] = p_clusters + max_label_p
+                    max_label_p = max(np.max(wp_clusters),np.max(all_p_clusters)) + 1
+
+                    t_clusters[t_clusters==-1] = -max_label_t - 1
+                    wt_clusters[hight_labels==hight_label] = t_clusters + max_label_t
+                    max_label_t = max(np.max(wt_clusters),np.max(all_t_clusters)) + 1
+
+                    if 'snippet_clusters' in return_data and log_sink is not None:
+                        for key in ['snippet_clusters_%i_%i_%s'%(width_label,hight_label,pt) for pt in ['peak','trough']]:
+                            saved_data[key] = log_sink(key, saved_data[key])
+
+                if verbose > 0:
+                    if np.max(wp_clusters) == -1:
+                        print('No EOD peaks in width cluster %i'%width_label)
+                    elif len(np.unique(wp_clusters[wp_clusters!=-1]))>1:
+                        print('%i different EOD peaks in width cluster %i'%(len(np.unique(wp_clusters[wp_clusters!=-1])),width_label))
+
+                    if np.max(wt_clusters) == -1:
+                        print('No EOD troughs in width cluster %i'%width_label)
+                    elif len(np.unique(wt_clusters[wt_clusters!=-1]))>1:
+                        print('%i different EOD troughs in width cluster %i'%(len(np.unique(wt_clusters[wt_clusters!=-1])),width_label))
+
+                if plot_level>0 or 'all_cluster_steps' in return_data:
+                    all_shapelabels.append(shape_labels)
+                    all_snippets.append(csnippets)
+                    all_features.append(cfeatures)
+
+                # remove artefacts here, based on the mean snippets ffts.
+                artefact_masks_p[width_labels==width_label], sdict = remove_artefacts(p_snippets, wp_clusters, interp_f, samplerate, verbose=verbose-1, return_data=return_data)
+                saved_data.update(sdict)
+                artefact_masks_t[width_labels==width_label], _ = remove_artefacts(t_snippets, wt_clusters, interp_f, samplerate, verbose=verbose-1, return_data=[])
+
+                # update maxlab so that no clusters are overwritten
+                all_p_clusters[width_labels==width_label] = wp_clusters
+                all_t_clusters[width_labels==width_label] = wt_clusters
+        finally:
+            width_results.close()
 
-        if verbose > 0:
-            if np.max(wp_clusters) == -1:
-                print('No EOD peaks in width cluster %i'%width_label)
-            elif len(np.unique(wp_clusters[wp_clusters!=-1]))>1:
-                print('%i different EOD peaks in width cluster %i'%(len(np.unique(wp_clusters[wp_clusters!=-1])),width_label))
-        
-            if np.max(wt_clusters) == -1:
-                print('No EOD troughs in width cluster %i'%width_label)
-            elif len(np.unique(wt_clusters[wt_clusters!=-1]))>1:
-                print('%i different EOD troughs in width cluster %i'%(len(np.unique(wt_clusters[wt_clusters!=-1])),width_label))
-        
-        if plot_level>0 or 'all_cluster_steps' in return_data:
-            all_shapelabels.append(shape_labels)
-            all_snippets.append(csnippets)
-            all_features.append(cfeatures)
-
-        # for each cluster, save fft + label
-        # so I end up with features for each label, and the masks.
-        # then I can extract e.g. first artefact or wave etc.
-
-        # remove artefacts here, based on the mean snippets ffts.
-        artefact_masks_p[width_labels==width_label], sdict = remove_artefacts(p_snippets, wp_clusters, interp_f, samplerate, verbose=verbose-1, return_data=return_data)
-        saved_data.update(sdict)
-        artefact_masks_t[width_labels==width_label], _ = remove_artefacts(t_snippets, wt_clusters, interp_f, samplerate, verbose=verbose-1, return_data=return_data)
-
-        # update maxlab so that no clusters are overwritten
-        all_p_clusters[width_labels==width_label] = wp_clusters
-        all_t_clusters[width_labels==width_label] = wt_clusters
-    
     # remove all non-reliable clusters
     unreliable_fish_mask_p, saved_data = delete_unreliable_fish(all_p_clusters,eod_widths,eod_xp,verbose=verbose-1,sdict=saved_data)
     unreliable_fish_mask_t, _ = delete_unreliable_fish(all_t_clusters,eod_widths,eod_xt,verbose=verbose-1)
@@ -891,6 +1669,7 @@ def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f,
             all_mmasks.append(wm_2)
 
         if plot_level>0:
+            from .pulseplots import plot_clustering, plt
             plot_clustering(samplerate, [unique_width_labels,eod_widths,width_labels], [all_unique_hightlabels,all_heights,all_hightlabels], [all_snippets,all_features,all_shapelabels], all_dmasks, all_mmasks)
             if save_plots:
                 plt.savefig('%sclustering.%s'%(save_path,ftype))
@@ -913,9 +1692,130 @@ def cluster(eod_xp, eod_xt, eod_hights, eod_widths, data, samplerate, interp_f,
              
     return all_clusters, x_merge, saved_data
 
-def BGM(x, merge_threshold=0.1, n_gaus=5, max_iter=200, n_init=5, use_log=False, verbose=0, plot_level=0, xlabel='x [a.u.]', save_plot=False, save_path='', save_name='', ftype='pdf', return_data=[]):
+def bgm_1d(x, n_gaus=5, weights=None, max_iter=200, n_init=5, tol=1e-3,
+           reg_var=1e-6, random_state=None):
+    """ Fit a one-dimensional variational Bayesian Gaussian mixture model.
+
+    Same model and updates as sklearn's `BayesianGaussianMixture` with
+    full covariances, a Dirichlet process prior on the weights, default
+    priors and k-means initialization, but specialised to one-dimensional
+    data and with weighted samples. For integer weights the fit equals
+    a fit to the data with each sample repeated by its weight, so a
+    histogram of the data with bin counts as weights can be fitted in
+    a time independent of the number of samples.
+
+    Parameters
+    ----------
+    x : 1D numpy array of floats
+        Samples the mixture model is fitted to.
+    n_gaus : int (optional)
+        Maximum number of gaussians to fit on data.
+        Defaults to 5.
+    weights : 1D numpy array of floats or None (optional)
+        Weight of each sample in `x`. If None, all samples are weighted by one.
+        Defaults to None.
+    max_iter : int (optional)
+        Maximum number of iterations for each initialization.
+        Defaults to 200.
+    n_init : int (optional)
+        Number of initializations. The fit with the largest lower bound is returned.
+        Defaults to 5.
+    tol : float (optional)
+        Fitting stops when the change of the lower bound is smaller than this.
+        Defaults to 1e-3.
+    reg_var : float (optional)
+        Added to the variances of the gaussians for numerical stability.
+        Defaults to 1e-6.
+    random_state : int, numpy RandomState, or None (optional)
+        Seed for the k-means initializations.
+        Defaults to None.
+
+    Returns
+    -------
+    labels : 1D numpy array of ints
+        Index of the most likely gaussian for each sample in `x`.
+    gaussians : 2D numpy array (n_gaus, 3)
+        Weight, mean, and variance of each gaussian.
+    converged : bool
+        True if the best fit converged before `max_iter` iterations.
+    """
+    x = np.asarray(x, dtype=float)
+    w = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=float)
+    n = np.sum(w)
+    eps = 10*np.finfo(float).eps
+    # priors as in sklearn:
+    alpha0 = 1.0/n_gaus
+    mean0 = np.sum(w*x)/n
+    var0 = np.sum(w*(x - mean0)**2)/(n - 1)
+    beta0 = 1.0
+    dof0 = 1.0
+    rs = np.random.RandomState(random_state) if not isinstance(random_state, np.random.RandomState) else random_state
+
+    def m_step(resp):
+        wr = w[:,np.newaxis]*resp
+        nk = np.sum(wr, axis=0) + eps
+        xk = np.dot(x, wr)/nk
+        sk = np.sum(wr*(x[:,np.newaxis] - xk)**2, axis=0)/nk + reg_var
+        wc = (1.0 + nk, alpha0 + np.hstack((np.cumsum(nk[::-1])[-2::-1], 0)))
+        beta = beta0 + nk
+        means = (beta0*mean0 + nk*xk)/beta
+        dof = dof0 + nk
+        variances = (var0 + nk*sk + nk*beta0/beta*(xk - mean0)**2)/dof
+        return wc, beta, means, dof, variances
+
+    def e_step(wc, beta, means, dof, variances):
+        digamma_sum = digamma(wc[0] + wc[1])
+        log_weights = digamma(wc[0]) - digamma_sum + \
+                      np.hstack((0, np.cumsum(digamma(wc[1]) - digamma_sum)[:-1]))
+        log_prec_chol = -0.5*np.log(variances)
+        y = (x[:,np.newaxis] - means)*np.exp(log_prec_chol)
+        log_gauss = -0.5*(np.log(2*np.pi) + y**2) + log_prec_chol - 0.5*np.log(dof)
+        log_lambda = np.log(2.0) + digamma(0.5*dof)
+        log_prob = log_gauss + 0.5*(log_lambda - 1.0/beta) + log_weights
+        log_norm = np.logaddexp.reduce(log_prob, axis=1)
+        return log_prob - log_norm[:,np.newaxis]
+
+    def lower_bound(log_resp, wc, beta, dof, variances):
+        log_det = -0.5*np.log(variances) - 0.5*np.log(dof)
+        log_wishart = -np.sum(dof*log_det + 0.5*dof*np.log(2.0) + gammaln(0.5*dof))
+        return (-np.sum(w[:,np.newaxis]*np.exp(log_resp)*log_resp) - log_wishart +
+                np.sum(betaln(wc[0], wc[1])) - 0.5*np.sum(np.log(beta)))
+
+    best_bound = -np.inf
+    best_params = None
+    converged = False
+    for init in range(n_init):
+        kmeans = KMeans(n_gaus, n_init=1, random_state=rs)
+        init_labels = kmeans.fit(x.reshape(-1, 1), sample_weight=w).labels_
+        resp = np.zeros((len(x), n_gaus))
+        resp[np.arange(len(x)), init_labels] = 1.0
+        params = m_step(resp)
+        bound = -np.inf
+        init_converged = False
+        for k in range(max_iter):
+            prev_bound = bound
+            log_resp = e_step(*params)
+            params = m_step(np.exp(log_resp))
+            bound = lower_bound(log_resp, params[0], params[1], params[3], params[4])
+            if abs(bound - prev_bound) < tol:
+                init_converged = True
+                break
+        if bound > best_bound or best_params is None:
+            best_bound = bound
+            best_params = params
+            converged = init_converged
+    labels = np.argmax(e_step(*best_params), axis=1)
+    wc, _, means, _, variances = best_params
+    gweights = wc[0]/(wc[0] + wc[1])
+    gweights *= np.hstack((1, np.cumprod(wc[1]/(wc[0] + wc[1]))[:-1]))
+    gweights /= np.sum(gweights)
+    return labels, np.column_stack((gweights, means, variances)), converged
+
+def BGM(x, merge_threshold=0.1, n_gaus=5, max_iter=200, n_init=5, max_bins=1000, random_state=0, use_log=False, verbose=0, plot_level=0, xlabel='x [a.u.]', save_plot=False, save_path='', save_name='', ftype='pdf', return_data=[]):
 
     """ Use a Bayesian Gaussian Mixture Model to cluster one-dimensional data. 
+        The model is fitted to the unique values of x or to a histogram of x (see bgm_1d()),
+        so the fit does not get slower with the number of samples.
         Additional steps are used to merge clusters that are closer than `merge_threshold`.
         Broad gaussian fits that cover one or more other gaussian fits are split by their intersections with the other gaussians.
 
@@ -936,6 +1836,14 @@ def BGM(x, merge_threshold=0.1, n_gaus=5, max_iter=200, n_init=5, use_log=False,
         n_init : int (optional)
             Number of initializations for the gaussian fit.
             Defaults to 5.
+        max_bins : int (optional)
+            If x has more unique values than this, the gaussians are fitted
+            to a histogram of x with this number of bins instead of to x,
+            unless less than `n_gaus` bins are filled because of outliers.
+            Defaults to 1000.
+        random_state : int or None (optional)
+            Seed for initializing the gaussian fit.
+            Defaults to 0.
         use_log: boolean (optional)
             Set to True to compute the gaussian fit on the logarithm of x.
             Can improve clustering on features with nonlinear relationships such as peak hight.
@@ -979,16 +1887,29 @@ def BGM(x, merge_threshold=0.1, n_gaus=5, max_iter=200, n_init=5, use_log=False,
     bgm_dict = {}
 
     if len(np.unique(x))>n_gaus:
-        BGM_model = BayesianGaussianMixture(n_gaus, max_iter=max_iter, n_init=n_init)
         if use_log:
-            labels = BGM_model.fit_predict(stats.zscore(np.log(x)).reshape(-1,1))
+            z = stats.zscore(np.log(x))
         else:
-            labels = BGM_model.fit_predict(stats.zscore(x).reshape(-1,1))
+            z = stats.zscore(x)
+        # compress data to unique values or histogram bins:
+        z_values, z_inx, z_counts = np.unique(z, return_inverse=True, return_counts=True)
+        if len(z_values) > max_bins:
+            h_inx = np.minimum(((z - z_values[0])/(z_values[-1] - z_values[0])*max_bins).astype(int), max_bins-1)
+            h_counts = np.bincount(h_inx, minlength=max_bins)
+            # extreme outliers can leave too few bins for the gaussians,
+            # then the unique values are fitted:
+            if np.count_nonzero(h_counts) >= n_gaus:
+                z_values = np.bincount(h_inx, z, minlength=max_bins)[h_counts>0]/h_counts[h_counts>0]
+                z_inx = np.cumsum(h_counts>0)[h_inx] - 1
+                z_counts = h_counts[h_counts>0]
+        z_labels, gaussians, converged = bgm_1d(z_values, n_gaus, z_counts, max_iter, n_init,
+                                                random_state=random_state)
+        labels = z_labels[z_inx]
     else:
         return np.zeros(len(x))
     
     if verbose>0:
-        if not BGM_model.converged_:
+        if not converged:
             print('!!! Gaussian mixture did not converge !!!')
     
     cur_labels = np.unique(labels)
@@ -1015,14 +1936,15 @@ def BGM(x, merge_threshold=0.1, n_gaus=5, max_iter=200, n_init=5, use_log=False,
     if 'BGM_'+save_name.split('_')[0] in return_data or plot_level>0:
 
         #sort model attributes by model_means_
-        means = [m[0] for m in BGM_model.means_]
-        weights = [w for w in BGM_model.weights_]
-        variances = [v[0][0] for v in BGM_model.covariances_]
+        weights = list(gaussians[:,0])
+        means = list(gaussians[:,1])
+        variances = list(gaussians[:,2])
         weights = [w for _,w in sorted(zip(means,weights))]
         variances =  [v for _,v in sorted(zip(means,variances))]
         means =  sorted(means)
         
         if plot_level>0:
+            from .pulseplots import plot_bgm, plt
             plot_bgm(x, means, variances, weights, use_log, labels_before_merge, labels, xlabel)
             if save_plot:
                 plt.savefig('%sBGM_%s.%s'%(save_path,save_name,ftype))
@@ -1073,13 +1995,97 @@ def merge_gaussians(x, labels, merge_threshold=0.1):
 
     return labels
 
+def extract_snippets(data, eod_x, width, cache=None, block_size=2**16):
+    """ Extract equally sized snippets of data centered on EODs.
+
+    Same as `np.vstack([data[int(x-width):int(x+width)] for x in eod_x])`,
+    but the snippets are gathered at once into a single preallocated array.
+    For arrays the snippets are taken from a strided view of the data,
+    for `InterpolatedData` all snippets are interpolated in one go.
+
+    Parameters
+    ----------
+    data : 1D numpy array of floats or InterpolatedData
+        Recording data.
+    eod_x : 1D array of ints
+        Locations of EODs in indices.
+    width : int or float
+        Half width of the snippets in indices.
+    cache : dict or None (optional)
+        If a dictionary is provided, extracted snippets are stored in it
+        and returned again for the same EOD locations and width.
+        Defaults to None.
+    block_size : int (optional)
+        Maximum number of samples that are interpolated at once
+        if `data` is `InterpolatedData`.
+        Defaults to 2**16.
+
+    Returns
+    -------
+    snippets : 2D numpy array (N, snippet_length)
+        The extracted snippets. Do not modify them if a cache is used.
+    """
+    eod_x = np.asarray(eod_x)
+    if cache is not None:
+        key = (width, eod_x.dtype.str, eod_x.tobytes())
+        if key in cache:
+            return cache[key]
+    if len(eod_x) == 0:
+        return np.zeros((0, int(np.floor(width) + np.ceil(width))))
+    starts = (eod_x - width).astype(int)
+    n = int(eod_x[0] + width) - starts[0]
+    if isinstance(data, np.ndarray):
+        windows = np.lib.stride_tricks.as_strided(data, shape=(len(data)-n+1, n),
+                                                  strides=2*data.strides,
+                                                  writeable=False)
+        snippets = np.empty((len(starts), n), dtype=data.dtype)
+        np.take(windows, starts, axis=0, out=snippets)
+    else:
+        # interpolate blocks of snippets to limit temporary memory:
+        snippets = np.empty((len(starts), n), dtype=data.dtype)
+        offsets = np.arange(n)
+        step = max(1, block_size//n)
+        for k in range(0, len(starts), step):
+            snippets[k:k+step] = data[starts[k:k+step,np.newaxis] + offsets]
+    if cache is not None:
+        cache[key] = snippets
+    return snippets
+
+def normalize_snippets(raw_snippets, eod_hights):
+    """ Normalize EOD snippets for clustering on their shape.
+
+    The underlying slope is subtracted from the snippets (see subtract_slope()),
+    then the snippets are z-scored and scaled to an absolute integral of one.
+
+    Parameters
+    ----------
+    raw_snippets : 2D numpy array (N, EOD_width)
+        Raw EOD snippets.
+    eod_hights: 1D array of floats
+        EOD heights.
+
+    Returns
+    -------
+    snippets : 2D numpy array (N, EOD_width)
+        Normalized EOD snippets
+    bg_ratio : 1D numpy array (N)
+        Ratio of the background activity slopes compared to EOD height.
+    """
+    snippets, bg_ratio = subtract_slope(np.copy(raw_snippets),eod_hights)
+    snippets = StandardScaler().fit_transform(snippets.T).T
+
+    # scale so that the absolute integral = 1.
+    snippets = (snippets.T/np.sum(np.abs(snippets),axis=1)).T
+    return snippets, bg_ratio
+
 def extract_snippet_features(data,eod_x,eod_widths,eod_hights,width_factor,n_pc=5):
     """ Extract snippets from recording data, normalize them, and perform PCA.
         
         Parameters
         ----------
-        data : 1D numpy array of floats
-            Recording data.
+        data : 1D numpy array of floats or InterpolatedData
+            Recording data. Snippets and features have the same data type
+            as the data (single or double precision).
         eod_x : 1D array of ints
             Locations of EODs in indices.
         eod_widths : 1D array of ints
@@ -1107,17 +2113,13 @@ def extract_snippet_features(data,eod_x,eod_widths,eod_hights,width_factor,n_pc=
 
     # extract snippets with corresponding width
     width = width_factor*np.median(eod_widths)
-    raw_snippets = np.vstack([data[int(x-width):int(x+width)] for x in eod_x])
+    raw_snippets = extract_snippets(data, eod_x, width)
 
     # subtract the slope and normalize the snippets
-    snippets, bg_ratio = subtract_slope(np.copy(raw_snippets),eod_hights)
-    snippets = StandardScaler().fit_transform(snippets.T).T
-
-    # scale so that the absolute integral = 1.
-    snippets = (snippets.T/np.sum(np.abs(snippets),axis=1)).T
+    snippets, bg_ratio = normalize_snippets(raw_snippets, eod_hights)
 
     # compute features for clustering on waveform
-    features = PCA(n_pc).fit(snippets).transform(snippets)
+    features = PCA(n_pc, random_state=0).fit(snippets).transform(snippets)
 
     return raw_snippets, snippets, features, bg_ratio
 
@@ -1157,16 +2159,19 @@ def cluster_on_shape(features, bg_ratio, minp, percentile=80, max_epsilon=0.01,
     """
 
     # determine clustering threshold from data
+    # from the distances to the minpc-th nearest neighbors (including the point itself):
     minpc = max(minp,int(len(features)*min_cluster_fraction))  
-    knn = np.sort(pairwise_distances(features,features),axis=0)[minpc]
+    nn = NearestNeighbors(n_neighbors=minpc+1).fit(features)
+    knn = nn.kneighbors(features)[0][:,minpc]
     eps = min(max(1,slope_ratio_factor*np.median(bg_ratio))*max_epsilon,np.percentile(knn,percentile))
 
     if verbose>1:
         print('epsilon = %f'%eps)
         print('Slope to EOD ratio = %f'%np.median(bg_ratio))
 
-    # cluster on EOD shape
-    return DBSCAN(eps=eps, min_samples=minpc).fit(features).labels_
+    # cluster on EOD shape, reusing the neighbor search tree:
+    neighbors = nn.radius_neighbors_graph(features, eps, mode='distance')
+    return DBSCAN(eps=eps, min_samples=minpc, metric='precomputed').fit(neighbors).labels_
 
 def subtract_slope(snippets,hights):
     """ Subtract underlying slope from all EOD snippets.
@@ -1235,14 +2240,15 @@ def remove_artefacts(all_snippets, clusters, int_f, samplerate, artefact_thresho
 
     mask = np.zeros(clusters.shape,dtype=bool)
 
-    for cluster in np.sort(np.unique(clusters[clusters>=0])):
+    # mean snippets and their spectra of all clusters at once:
+    unique_clusters, counts, sums = label_sums(all_snippets, clusters)
+    mean_eods = sums/counts[:,np.newaxis]
+    mean_eods = mean_eods - np.mean(mean_eods, axis=1, keepdims=True)
+    spectra = np.abs(np.fft.fft(mean_eods, axis=1))
+    cut_fft = int(all_snippets.shape[1]/2)
+    low_frequency_ratios = np.sum(spectra[:,:int(cut_fft/(2*int_f))], axis=1)/np.sum(spectra[:,:cut_fft], axis=1)
 
-        snippets = all_snippets[clusters==cluster]
-        mean_eod = np.mean(snippets, axis=0)
-        mean_eod = mean_eod - np.mean(mean_eod)
-        cut_fft = int(len(np.fft.fft(mean_eod))/2)
-        low_frequency_ratio = np.sum(np.abs(np.fft.fft(mean_eod))[:int(cut_fft/(2*int_f))])/np.sum(np.abs(np.fft.fft(mean_eod))[:int(cut_fft)])           
-        freqs = np.linspace(0,samplerate,cut_fft)
+    for cluster, mean_eod, spectrum, low_frequency_ratio in zip(unique_clusters, mean_eods, spectra, low_frequency_ratios):
 
         if low_frequency_ratio < artefact_threshold:
             mask[clusters==cluster] = True
@@ -1251,8 +2257,8 @@ def remove_artefacts(all_snippets, clusters, int_f, samplerate, artefact_thresho
                 print('Deleting cluster %i, which has a low frequency ratio of %f'%(cluster,low_frequency_ratio))
 
         if 'eod_deletion' in return_data:
-            adict['vals_'+str(int(cluster))] = [mean_eod,np.abs(np.fft.fft(mean_eod))[:int(cut_fft/int_f)]]
-            adict['mask_'+str(int(cluster))] = [any(mask[clusters==cluster])]
+            adict['vals_'+str(int(cluster))] = [mean_eod,spectrum[:int(cut_fft/int_f)]]
+            adict['mask_'+str(int(cluster))] = [low_frequency_ratio < artefact_threshold]
     
     return mask, adict
 
@@ -1351,7 +2357,7 @@ def delete_wavefish_and_sidepeaks(data, clusters, eod_x, eod_widths, interp_f, w
         current_x = eod_x[(eod_x>cutwidth) & (eod_x<(len(data)-cutwidth))]
         current_clusters = clusters[(eod_x>cutwidth) & (eod_x<(len(data)-cutwidth))]
         
-        snippets = np.vstack([data[int(x-cutwidth):int(x+cutwidth)] for x in current_x[current_clusters==cluster]])
+        snippets = extract_snippets(data, current_x[current_clusters==cluster], cutwidth)
         
         # extract information on main peaks and troughs
         mean_eod = np.mean(snippets, axis=0)
@@ -1488,7 +2494,7 @@ def merge_clusters(clusters_1, clusters_2, x_1, x_2, verbose=0):
 
 
 def extract_means(data, eod_x, eod_peak_x, eod_tr_x, eod_widths, clusters, samplerate,
-                  w_factor, verbose=0):
+                  w_factor, cache=None, verbose=0):
     """ Extract mean EODs and EOD timepoints for each EOD cluster.
 
     Parameters
@@ -1510,6 +2516,11 @@ def extract_means(data, eod_x, eod_peak_x, eod_tr_x, eod_widths, clusters, sampl
     w_factor : float
         Multiplication factor for window used to extract EOD.
     
+    cache : dict or None (optional)
+        Cache for EOD snippets (see extract_snippets()).
+        Pass the same dictionary to repeated calls on the same data,
+        so that snippets of unchanged clusters are extracted only once.
+        Defaults to None.
     verbose : int (optional)
         Verbosity level.
         Defaults to 0.           
@@ -1532,24 +2543,23 @@ def extract_means(data, eod_x, eod_peak_x, eod_tr_x, eod_widths, clusters, sampl
 
     mean_eods, eod_times, eod_peak_times, eod_tr_times, eod_hights, cluster_labels = [], [], [], [], [], []
 
-    for cluster in np.unique(clusters):
-        if cluster!=-1:
-            cutwidth = np.mean(eod_widths[clusters==cluster])*w_factor
-            current_x = eod_x[(eod_x>cutwidth) & (eod_x<(len(data)-cutwidth))]
-            current_clusters = clusters[(eod_x>cutwidth) & (eod_x<(len(data)-cutwidth))]
+    for cluster, idx in zip(*label_groups(clusters)):
+        cutwidth = np.mean(eod_widths[idx])*w_factor
+        current_x = eod_x[idx]
+        current_x = current_x[(current_x>cutwidth) & (current_x<(len(data)-cutwidth))]
 
-            snippets = np.vstack([data[int(x-cutwidth):int(x+cutwidth)] for x in current_x[current_clusters==cluster]])
-            mean_eod = np.mean(snippets, axis=0)
-            eod_time = np.arange(len(mean_eod))/samplerate - cutwidth/samplerate
+        snippets = extract_snippets(data, current_x, cutwidth, cache)
+        mean_eod = np.mean(snippets, axis=0, dtype=float)
+        eod_time = np.arange(len(mean_eod))/samplerate - cutwidth/samplerate
 
-            mean_eod = np.vstack([eod_time, mean_eod, np.std(snippets, axis=0)])
+        mean_eod = np.vstack([eod_time, mean_eod, np.std(snippets, axis=0, dtype=float)])
 
-            mean_eods.append(mean_eod)
-            eod_times.append(eod_x[clusters==cluster]/samplerate)
-            eod_hights.append(np.min(mean_eod)-np.max(mean_eod))
-            eod_peak_times.append(eod_peak_x[clusters==cluster]/samplerate)
-            eod_tr_times.append(eod_tr_x[clusters==cluster]/samplerate)
-            cluster_labels.append(cluster)
+        mean_eods.append(mean_eod)
+        eod_times.append(eod_x[idx]/samplerate)
+        eod_hights.append(np.min(mean_eod)-np.max(mean_eod))
+        eod_peak_times.append(eod_peak_x[idx]/samplerate)
+        eod_tr_times.append(eod_tr_x[idx]/samplerate)
+        cluster_labels.append(cluster)
            
     return [m for _,m in sorted(zip(eod_hights,mean_eods))], [t for _,t in sorted(zip(eod_hights,eod_times))], [pt for _,pt in sorted(zip(eod_hights,eod_peak_times))], [tt for _,tt in sorted(zip(eod_hights,eod_tr_times))], [c for _,c in sorted(zip(eod_hights,cluster_labels))]
 
@@ -1711,46 +2721,45 @@ def delete_moving_fish(clusters, eod_t, T, eod_hights, eod_widths, samplerate, m
         if verbose>0:
             print('sliding window dt = %f'%dt)
 
-        # make W dependent on width??
-        ignore_steps = np.zeros(len(np.arange(0, T-dt+stepsize, stepsize)))
-
-        for i,t in enumerate(np.arange(0, T-dt+stepsize, stepsize)):
-            current_clusters = wclusters[(weod_t>=t)&(weod_t<t+dt)&(wclusters!=-1)]
-            if len(np.unique(current_clusters))==0:
-                ignore_steps[i-int(dt/stepsize):i+int(dt/stepsize)] = 1
-                if verbose>0:
-                    print('No pulsefish in recording at T=%.2f:%.2f'%(t,t+dt))
-
-        
+        # census of clusters in each sliding window from the sorted EOD times of each cluster:
         x = np.arange(0, T-dt+stepsize, stepsize)
-        y = np.ones(len(x))
-
-        running_sum = np.ones(len(np.arange(0, T+stepsize, stepsize)))
         ulabs = np.unique(wclusters[wclusters>=0])
+        present = np.zeros((len(x), len(ulabs)), dtype=bool)
+        for k, l in enumerate(ulabs):
+            lt = np.sort(weod_t[wclusters==l])
+            present[:,k] = np.searchsorted(lt, x+dt) > np.searchsorted(lt, x)
+        y = np.sum(present, axis=1).astype(float)
 
-        # sliding window
-        for j,(t,ignore_step) in enumerate(zip(x, ignore_steps)):
-            current_clusters = wclusters[(weod_t>=t)&(weod_t<t+dt)&(wclusters!=-1)]
-            current_widths = weod_widths[(weod_t>=t)&(weod_t<t+dt)&(wclusters!=-1)]
-
-            y[j] = len(np.unique(current_clusters))
-
-            if (len(np.unique(current_clusters)) <= min_clusters) and (ignore_step==0) and (len(np.unique(current_clusters) !=1)):
-
-                current_labels = np.isin(wclusters, np.unique(current_clusters))
+        # make W dependent on width??
+        ignore_steps = np.zeros(len(x))
+        for i in np.nonzero(y==0)[0]:
+            ignore_steps[i-int(dt/stepsize):i+int(dt/stepsize)] = 1
+            if verbose>0:
+                print('No pulsefish in recording at T=%.2f:%.2f'%(x[i],x[i]+dt))
+
+        # sliding window, hights and sparseness are computed once for each set of clusters
+        window_stats = {}
+        for j in np.nonzero((y>0) & (ignore_steps==0))[0]:
+            if y[j] > min_clusters:
+                continue
+            current_clusters = ulabs[present[j]]
+            if current_clusters.tobytes() not in window_stats:
+                current_labels = np.isin(wclusters, current_clusters)
                 current_hight = np.mean(weod_hights[current_labels])
 
                 # compute nr of clusters that are too sparse
-                clusters_after_deletion = np.unique(remove_sparse_detections(np.copy(clusters[np.isin(clusters,np.unique(current_clusters))]),samplerate*eod_widths[np.isin(clusters,np.unique(current_clusters))],samplerate,T))
-                current_sparse_clusters = len(np.unique(current_clusters)) - len(clusters_after_deletion[clusters_after_deletion!=-1])
-               
-                if current_sparse_clusters <= sparse_clusters and ((current_sparse_clusters<sparse_clusters) or (current_hight > average_hight) or (len(np.unique(current_clusters)) < min_clusters)):
-                    
-                    keep_clusters = np.unique(current_clusters)
-                    min_clusters = len(np.unique(current_clusters))
-                    average_hight = current_hight
-                    window_end = t+dt
-                    sparse_clusters = current_sparse_clusters
+                clusters_after_deletion = np.unique(remove_sparse_detections(np.copy(clusters[np.isin(clusters,current_clusters)]),samplerate*eod_widths[np.isin(clusters,current_clusters)],samplerate,T))
+                current_sparse_clusters = len(current_clusters) - len(clusters_after_deletion[clusters_after_deletion!=-1])
+                window_stats[current_clusters.tobytes()] = (current_hight, current_sparse_clusters)
+            current_hight, current_sparse_clusters = window_stats[current_clusters.tobytes()]
+
+            if current_sparse_clusters <= sparse_clusters and ((current_sparse_clusters<sparse_clusters) or (current_hight > average_hight) or (len(current_clusters) < min_clusters)):
+
+                keep_clusters = current_clusters
+                min_clusters = len(current_clusters)
+                average_hight = current_hight
+                window_end = x[j]+dt
+                sparse_clusters = current_sparse_clusters
 
         all_keep_clusters.append(keep_clusters)
         all_windows.append(window_end)
@@ -1777,6 +2786,7 @@ def delete_moving_fish(clusters, eod_t, T, eod_hights, eod_widths, samplerate, m
         print('Estimated nr of pulsefish in recording: %i'%len(all_keep_clusters))
 
     if plot_level>0:
+        from .pulseplots import plot_moving_fish, plt
         plot_moving_fish(mf_dict['w'], mf_dict['dt'], mf_dict['clusters'],mf_dict['t'], mf_dict['fishcount'], T, mf_dict['ignore_steps'])
         if save_plot:
             plt.savefig('%sdelete_moving_fish.%s'%(save_path,ftype))
@@ -1827,3 +2837,360 @@ def remove_sparse_detections(clusters, eod_widths, samplerate, T,
                     print('cluster %i is too sparse'%c)
                 clusters[clusters==c] = -1
     return clusters
+
+
+def pulse_model(data, samplerate, T, eod_x, eod_hights, eod_widths, clusters, width_factor,
+                n_pc=5, n_exemplars=200, eps_factor=1.5, troughs=None, eod_samples=0):
+    """ Model of the pulsefish detected in a recording for classifying EODs of later recordings.
+
+    For each fish the model stores a gaussian of the logarithms of its EOD widths
+    and of its EOD heights, and a subset of its EODs as exemplars of its EOD shape.
+    EOD shapes are represented by the principal components of the normalized
+    EOD snippets of all fish (see normalize_snippets()).
+    The model is a dictionary of numpy arrays and floats
+    that can be saved with save_pulse_model().
+
+    Parameters
+    ----------
+    data : 1D numpy array of floats or InterpolatedData
+        Interpolated recording data.
+    samplerate : float
+        Samplerate of the interpolated data.
+    T : float
+        Duration of the recording in seconds.
+    eod_x : 1D array of ints
+        Locations of EOD peaks in indices.
+    eod_hights : 1D array of floats
+        EOD heights.
+    eod_widths : 1D array of ints
+        EOD widths in samples.
+    clusters : 1D array of ints
+        Cluster label of each EOD, -1 for EODs that do not belong to a fish.
+    width_factor : int or float
+        Multiplier of the median EOD width for extracting EOD snippets.
+
+    n_pc : int (optional)
+        Number of principal components of the EOD snippets.
+        Defaults to 5.
+    n_exemplars : int (optional)
+        Maximum number of EODs of each fish used as exemplars.
+        Defaults to 200.
+    eps_factor : float (optional)
+        Multiplier for the 95% percentile of the distances of the EODs of a fish
+        to its closest exemplars. EODs of later recordings are assigned to the fish
+        of the closest exemplar only if closer than this.
+        Defaults to 1.5.
+    troughs : 1D array of booleans or None (optional)
+        For each EOD whether its time is taken from its trough instead of
+        its peak, i.e. `x_merge==x_trough` of cluster().
+        If None, EOD times are taken from the peaks.
+        Defaults to None.
+    eod_samples : int (optional)
+        The `eod_samples` the interpolated data were obtained with
+        (see extract_eod_times()).
+        Defaults to 0.
+
+    Returns
+    -------
+    model : dictionary
+        - 'labels': cluster labels of the fish in the model.
+        - 'samplerate': samplerate of the interpolated data.
+        - 'eod_samples': the `eod_samples` the interpolated data were obtained with.
+        - 'troughs': whether the EOD times of each fish are taken from the troughs.
+        - 'snippet_width': half width of the EOD snippets in samples.
+        - 'width_gaussians': weight, mean, and standard deviation of the logarithm
+          of the EOD widths (in seconds) of each fish.
+        - 'hight_gaussians': weight, mean, and standard deviation of the logarithm
+          of the EOD heights of each fish.
+        - 'pca_mean', 'pca_components': mean and principal components of the snippets.
+        - 'exemplars': principal components of the exemplar EODs.
+        - 'exemplar_labels': index of the fish of each exemplar.
+        - 'eps': maximum distance to the exemplars of each fish.
+        - 'rates': rate of the EODs of each fish classified by the model in Hertz.
+        - 'explained': fraction of the candidate EODs classified by the model.
+    """
+    mask = clusters >= 0
+    labels, inverse = np.unique(clusters[mask], return_inverse=True)
+    model = {'labels': labels, 'samplerate': samplerate, 'eod_samples': eod_samples}
+    if len(labels) == 0:
+        return model
+    if troughs is None:
+        troughs = np.zeros(len(clusters), dtype=bool)
+    model['troughs'] = np.array([np.mean(troughs[mask][inverse==k]) > 0.5 for k in range(len(labels))])
+    snippet_width = width_factor*np.median(eod_widths[mask])
+    snippets, _ = normalize_snippets(extract_snippets(data, eod_x[mask], snippet_width), eod_hights[mask])
+    pca = PCA(n_pc, random_state=0).fit(snippets)
+    features = pca.transform(snippets)
+    log_widths = np.log(eod_widths[mask]/samplerate)
+    log_hights = np.log(eod_hights[mask])
+    width_gaussians = np.zeros((len(labels), 3))
+    hight_gaussians = np.zeros((len(labels), 3))
+    exemplars = []
+    eps = np.zeros(len(labels))
+    for k in range(len(labels)):
+        weight = np.sum(inverse==k)/len(inverse)
+        width_gaussians[k] = [weight, np.mean(log_widths[inverse==k]), np.std(log_widths[inverse==k])]
+        hight_gaussians[k] = [weight, np.mean(log_hights[inverse==k]), np.std(log_hights[inverse==k])]
+        k_features = features[inverse==k]
+        exemplars.append(k_features[np.unique(np.linspace(0, len(k_features)-1, n_exemplars).astype(int))])
+        # distances to closest exemplars other than the EOD itself:
+        dists = NearestNeighbors(n_neighbors=min(2, len(exemplars[-1]))).fit(exemplars[-1]).kneighbors(k_features)[0]
+        eps[k] = eps_factor*np.percentile(np.where(dists[:,0]>0, dists[:,0], dists[:,-1]), 95)
+    model.update({'snippet_width': snippet_width,
+                  'width_gaussians': width_gaussians,
+                  'hight_gaussians': hight_gaussians,
+                  'pca_mean': pca.mean_,
+                  'pca_components': pca.components_,
+                  'exemplars': np.vstack(exemplars),
+                  'exemplar_labels': np.concatenate([np.ones(len(e), dtype=int)*k for k, e in enumerate(exemplars)]),
+                  'eps': eps})
+    # reference values for the quality of later classifications:
+    model_labels, candidates = pulse_model_labels(model, data, eod_x, eod_hights, eod_widths)
+    model['rates'] = np.bincount(model_labels[model_labels>=0], minlength=len(labels))/T
+    model['explained'] = np.sum(model_labels>=0)/max(1, np.sum(candidates))
+    return model
+
+
+def pulse_model_labels(model, data, eod_x, eod_hights, eod_widths, max_z=4.0):
+    """ Classify EODs by a pulsefish model.
+
+    An EOD may belong to a fish if the logarithms of its width and height
+    are within `max_z` standard deviations of the ones of the fish.
+    Standard deviations are at least 0.1 for widths and 0.5 for heights, since
+    EOD heights change with the position of the fish.
+    Such an EOD is assigned to the fish of its closest exemplar, if it may belong
+    to that fish and the distance is smaller than the fish's `eps`.
+
+    Parameters
+    ----------
+    model : dictionary
+        Pulsefish model as returned by pulse_model().
+    data : 1D numpy array of floats or InterpolatedData
+        Interpolated recording data with the samplerate of the model.
+    eod_x : 1D array of ints
+        Locations of EOD peaks in indices.
+    eod_hights : 1D array of floats
+        EOD heights.
+    eod_widths : 1D array of ints
+        EOD widths in samples.
+    max_z : float (optional)
+        Maximum deviation of EOD widths and heights from the ones of a fish
+        in units of standard deviations.
+        Defaults to 4.
+
+    Returns
+    -------
+    labels : 1D numpy array of ints
+        Index of the fish in the model for each EOD, -1 for unassigned EODs.
+    candidates : 1D numpy array of booleans
+        True for each EOD with a height that matches at least one fish,
+        regardless of its width and shape.
+    """
+    labels = -np.ones(len(eod_x), dtype=int)
+    if len(model['labels']) == 0 or len(eod_x) == 0:
+        return labels, np.zeros(len(eod_x), dtype=bool)
+    wg = model['width_gaussians']
+    hg = model['hight_gaussians']
+    width_z = np.abs(np.log(np.asarray(eod_widths)/model['samplerate'])[:,np.newaxis] - wg[:,1])/np.maximum(wg[:,2], 0.1)
+    hight_z = np.abs(np.log(eod_hights)[:,np.newaxis] - hg[:,1])/np.maximum(hg[:,2], 0.5)
+    w = model['snippet_width']
+    fish = (width_z <= max_z) & (hight_z <= max_z)
+    inside = (eod_x - w > 0) & (eod_x + w < len(data) - 1)
+    candidates = np.any(hight_z <= max_z, axis=1) & inside
+    selection = np.any(fish, axis=1) & inside
+    if np.sum(selection) == 0:
+        return labels, candidates
+    snippets, _ = normalize_snippets(extract_snippets(data, eod_x[selection], w), eod_hights[selection])
+    features = np.dot(snippets - model['pca_mean'], model['pca_components'].T)
+    dists, inx = NearestNeighbors(n_neighbors=1).fit(model['exemplars']).kneighbors(features)
+    s_labels = model['exemplar_labels'][inx[:,0]]
+    accept = (dists[:,0] <= model['eps'][s_labels]) & fish[selection][np.arange(len(s_labels)), s_labels]
+    labels[np.nonzero(selection)[0][accept]] = s_labels[accept]
+    return labels, candidates
+
+
+def predict_pulsefish(data, samplerate, model, width_factor_shape=3, width_factor_wave=8, width_factor_display=4, dtype=float, verbose=0):
+    """ Extract pulsefish EODs from a recording using a pulsefish model.
+
+    Much faster than extract_pulsefish(), because EODs are only classified
+    and the clustering is not refitted. Candidate EODs are extracted
+    as in extract_pulsefish(), with the interpolation the model was fitted with.
+    EOD times are taken from the peaks or troughs as chosen for each fish
+    of the model by extract_pulsefish(). The fish of the model passed the artefact,
+    wavefish, sidepeak, unreliable and moving fish filters of
+    extract_pulsefish() when the model was fitted. These filters are not
+    applied again. Changes of the recorded fish show up in a low `quality`
+    instead.
+
+    Parameters
+    ----------
+    data: 1-D array of float
+        The data to be analysed.
+    samplerate: float
+        Sampling rate of the data in Hertz.
+    model: dictionary
+        Pulsefish model as returned by pulse_model().
+
+    width_factor_shape : int or float (optional)
+        Width multiplier used for the EOD snippets of extract_pulsefish().
+        Needs to be the one the model was fitted with.
+        Defaults to 3.
+    width_factor_wave : int or float (optional)
+        Width multiplier used for the wavefish filter of extract_pulsefish().
+        Needs to be the one the model was fitted with.
+        Defaults to 8.
+    width_factor_display : int or float (optional)
+        Width multiplier used for EOD mean extraction and display.
+        Defaults to 4.
+    dtype : numpy dtype (optional)
+        Data type used for the interpolated data (see extract_pulsefish()).
+        Defaults to float.
+    verbose : int (optional)
+        Verbosity level.
+        Defaults to 0.
+
+    Returns
+    -------
+    mean_eods: list of 2D arrays (3,eod_length)
+        The average EOD for each detected fish. First column is time in seconds,
+        second column the mean eod, third column the standard error.
+    eod_times: list of 1D arrays
+        For each detected fish the times of EOD peaks or troughs in seconds.
+    eod_peaktimes: list of 1D arrays
+        For each detected fish the times of EOD peaks in seconds.
+    zoom_window: tuple of floats
+        Start and endtime of suggested window for plotting EOD timepoints.
+    quality: float
+        Quality of the model for this recording between 0 and 1.
+        The minimum of the ratios of the EOD rates of each fish and of the fraction
+        of candidate EODs classified by the model relative to the recording the model
+        was fitted on. Zero if the model is empty or the samplerate of the interpolated
+        data differs from the one of the model.
+    """
+    T = len(data)/samplerate
+    # the interpolation factor chosen for the narrowest EODs of the recording
+    # the model was fitted on results in the samplerate of the model,
+    # and peak widths are relative to it:
+    interp_args = {}
+    if model.get('eod_samples', 0) > 0:
+        interp_args['interp_freq'] = model['samplerate']
+    with stage('extract_eod_times'):
+        # same EODs as extracted by extract_pulsefish():
+        x_peak, x_trough, eod_hights, eod_widths, i_samplerate, i_data, interp_f, _ = extract_eod_times(data, samplerate, np.max([width_factor_shape,width_factor_display,width_factor_wave]), verbose=verbose-1, dtype=dtype, **interp_args)
+    if len(model['labels']) == 0 or len(x_peak) == 0 or i_samplerate != model['samplerate']:
+        return [], [], [], [0.0, min(T, 0.25)], 0.0
+    with stage('classify'):
+        labels, candidates = pulse_model_labels(model, i_data, x_peak, eod_hights, eod_widths)
+    rates = np.bincount(labels[labels>=0], minlength=len(model['labels']))/T
+    explained = np.sum(labels>=0)/max(1, np.sum(candidates))
+    ok = model['rates'] > 0
+    quality = min(1.0, np.min(rates[ok]/model['rates'][ok]) if np.any(ok) else 0.0,
+                  explained/model['explained'] if model['explained'] > 0 else 0.0)
+    if verbose > 0:
+        print('Quality of pulsefish model: %.2f' % quality)
+    # peaks or troughs as chosen by cluster():
+    troughs = model.get('troughs', np.zeros(len(model['labels']), dtype=bool))
+    x_merge = np.where((labels>=0) & troughs[np.maximum(labels, 0)], x_trough, x_peak)
+    with stage('extract_means'):
+        mean_eods, eod_times, eod_peaktimes, _, _ = extract_means(i_data, x_merge, x_peak, x_trough, eod_widths, labels, i_samplerate, width_factor_display, verbose=verbose-1)
+    dt = max(0.25, 2000*np.median(eod_widths[labels>=0])/i_samplerate) if np.any(labels>=0) else 0.25
+    return mean_eods, eod_times, eod_peaktimes, [0.0, min(T, dt)], quality
+
+
+def classify_pulsefish(data, samplerate, fname, model=None, min_quality=0.8, **kwargs):
+    """ Extract pulsefish EODs with a pulsefish model and refit the model only if needed.
+
+    Use this for analysing recordings of the same fish one after the other:
+    ```
+    model = None
+    for fname in recordings:
+        data, samplerate, unit = load_data(fname)
+        mean_eods, eod_times, eod_peaktimes, zoom_window, model = classify_pulsefish(data, samplerate, fname, model)
+    ```
+
+    Parameters
+    ----------
+    data: 1-D array of float
+        The data to be analysed.
+    samplerate: float
+        Sampling rate of the data in Hertz.
+    fname: string
+        Path to the analysed recording file.
+    model: dictionary or None (optional)
+        Pulsefish model as returned by pulse_model(), for example from a previous call.
+        If None, EODs are extracted and clustered with extract_pulsefish().
+        Defaults to None.
+    min_quality : float (optional)
+        If the quality of the model for the recording (see predict_pulsefish())
+        is below this value, the EODs are extracted and clustered with
+        extract_pulsefish() and the model is refitted.
+        Defaults to 0.8.
+    kwargs: dict
+        Further arguments passed on to extract_pulsefish().
+
+    Returns
+    -------
+    mean_eods: list of 2D arrays (3,eod_length)
+        The average EOD for each detected fish.
+    eod_times: list of 1D arrays
+        For each detected fish the times of EODs in seconds.
+    eod_peaktimes: list of 1D arrays
+        For each detected fish the times of EOD peaks in seconds.
+    zoom_window: tuple of floats
+        Start and endtime of suggested window for plotting EOD timepoints.
+    model: dictionary
+        The pulsefish model, either the one passed or a refitted one.
+    """
+    if model is not None:
+        mean_eods, eod_times, eod_peaktimes, zoom_window, quality = \
+            predict_pulsefish(data, samplerate, model,
+                              width_factor_shape=kwargs.get('width_factor_shape', 3),
+                              width_factor_wave=kwargs.get('width_factor_wave', 8),
+                              width_factor_display=kwargs.get('width_factor_display', 4),
+                              dtype=kwargs.get('dtype', float),
+                              verbose=kwargs.get('verbose', 0))
+        if quality >= min_quality:
+            return mean_eods, eod_times, eod_peaktimes, zoom_window, model
+    kwargs['return_data'] = list(kwargs.get('return_data', [])) + ['pulse_model']
+    mean_eods, eod_times, eod_peaktimes, zoom_window, log_dict = \
+        extract_pulsefish(data, samplerate, fname, **kwargs)
+    model = log_dict.get('pulse_model', {'labels': np.zeros(0), 'samplerate': 0.0})
+    return mean_eods, eod_times, eod_peaktimes, zoom_window, model
+
+
+def save_pulse_model(file_path, model):
+    """ Save a pulsefish model to a numpy npz file.
+
+    Parameters
+    ----------
+    file_path: string
+        Path of the file. The extension '.npz' is added if missing.
+    model: dictionary
+        Pulsefish model as returned by pulse_model().
+
+    Returns
+    -------
+    file_path: string
+        Path of the written file.
+    """
+    if not file_path.endswith('.npz'):
+        file_path += '.npz'
+    np.savez(file_path, **model)
+    return file_path
+
+
+def load_pulse_model(file_path):
+    """ Load a pulsefish model from a numpy npz file.
+
+    Parameters
+    ----------
+    file_path: string
+        Path of the file written by save_pulse_model().
+
+    Returns
+    -------
+    model: dictionary
+        The pulsefish model.
+    """
+    with np.load(file_path) as f:
+        return {k: f[k][()] if f[k].ndim == 0 else f[k] for k in f.files}
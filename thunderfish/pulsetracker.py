@@ -8,6 +8,7 @@ import copy
 from scipy import stats
 from scipy import signal
 from scipy import optimize
+from scipy.fft import next_fast_len
 import matplotlib
 #from fish import ProgressFish
 import matplotlib.pyplot as plt
@@ -25,6 +26,7 @@ import os
 from shutil import copy2
 
 from collections import OrderedDict
+from functools import lru_cache
 
 def makeeventlist(main_event_positions,side_event_positions,data,event_width=20):
     """
@@ -159,6 +161,29 @@ def crosscorrelation(sig, data):
     'returns crosscorrelation of two arrays, the first array should have a length equal to or smaller than the second array.'
     return signal.fftconvolve(data, sig[::-1],  mode='valid')
 
+def crosscorrelations(sigs, data):
+    """
+    returns the crosscorrelations of each row of sigs with data, computed with a single FFT over all rows.
+    Same as `np.array([crosscorrelation(sig, data) for sig in sigs])`.
+
+    Parameters
+    ----------
+    sigs: twodimensional nparray
+        signals (signal#,signallen), signallen should be equal to or smaller than the length of data.
+    data: array
+
+    Returns
+    -------
+    crosscorrelations: twodimensional nparray
+        (signal#, len(data)-signallen+1)
+
+    """
+    n = sigs.shape[1]
+    # the valid part of the circular convolution is not affected by wrapping if nfft >= len(data):
+    nfft = next_fast_len(len(data))
+    cc = np.fft.irfft(np.fft.rfft(sigs[:,::-1], nfft, axis=1)*np.fft.rfft(data, nfft), nfft, axis=1)
+    return cc[:,n-1:len(data)]
+
 def interpol(data, kind):
     """
     interpolates the given data using scipy interpolation python package
@@ -201,6 +226,36 @@ def interpolated_array(data, kind, int_fact):
     """
     return interpol(data,kind)(np.arange(0, len(data)-1, 1/int_fact))
 
+@lru_cache(maxsize=16)
+def interpolation_matrix(width, kind, int_fact):
+    """
+    returns a matrix that interpolates data arrays of the given width by matrix multiplication.
+    All interpolation methods of interp1d are linear in the data, so
+    `np.dot(data, interpolation_matrix(len(data), kind, int_fact))` equals `interpolated_array(data, kind, int_fact)`.
+    The matrices are cached for each width, kind and int_fact and are read-only.
+
+    Parameters
+    ----------
+    width: int
+        length of the data arrays to be interpolated
+
+    kind: string or int
+        (‘linear’, ‘nearest’, ‘zero’, ‘slinear’, ‘quadratic’, ‘cubic’, ‘previous’, ‘next’), or integer of order of spline interpolation to be used
+
+    int_fact: int
+         factor by which the interpolated array is larger than the original array
+
+    Returns
+    -------
+    interpolation matrix: twodimensional nparray
+        (width, (width-1)*int_fact)
+
+    """
+    x = np.linspace(0, width-1, num = width, endpoint = True)
+    matrix = interp1d(x, np.eye(width), kind, axis=0)(np.arange(0, width-1, 1/int_fact)).T
+    matrix.setflags(write=False)
+    return matrix
+
 def cut_snippets(data,event_locations,cut_width,int_met="linear",int_fact=10,max_offset = 1000000): 
     """
     cuts intervals from a data array, interpolates and aligns them and returns them in a list
@@ -232,51 +287,33 @@ def cut_snippets(data,event_locations,cut_width,int_met="linear",int_fact=10,max
         the processed intervals (interval#,intervallen)
 
     """
-    snippets = []
-    heights = np.zeros(len(event_locations))
     cut_width = [-cut_width, cut_width]
+    width = cut_width[1]-cut_width[0]
     #alignwidth = int(np.ceil((max_offset) * int_fact))
     alignwidth = 50
 
-    for pos in event_locations.astype('int'):
-        snippets.append(data[pos+cut_width[0]:pos+cut_width[1]])
-    ipoled_snips = np.empty((len(snippets), (cut_width[1]-cut_width[0])*int_fact-int_fact))
-    
-    for i, snip in enumerate(snippets):
-        if len(snip) < ((cut_width[1]-cut_width[0])):
-            if i == 0:
-                snip = np.concatenate([np.zeros([((cut_width[1]-cut_width[0]) - len(snip))]),np.array(snip)])
-            if i == len(snippets):
-                snip = np.concatenate([snip, np.zeros([((cut_width[1]-cut_width[0])-len(snip))])])
-            else:
-                snip = np.zeros([(cut_width[1]-cut_width[0])])
-       
-         #f_interpoled = interpol(snip, int_met) #if len(snip) > 0 else np.zeros([(cut_width[1]-cut_width[0]-1)*int_fact ])
-        interpoled_snip = interpolated_array(snip, int_met, 10)#f_interpoled(np.arange(0, len(snip)-1, 1/int_fact))
-        intsnipheight   = np.max(interpoled_snip) - np.min(interpoled_snip)
-        
+    # snippets that do not fit into the data are set to zero:
+    starts = event_locations.astype('int') + cut_width[0]
+    valid = (starts >= 0) & (starts + width <= len(data))
+    snippets = np.zeros((len(starts), width))
+    if np.any(valid):
+        snippets[valid] = data[starts[valid,np.newaxis] + np.arange(width)]
 
-        if intsnipheight == 0:
-            intsnipheight = 1
-
-        interpoled_snip = (interpoled_snip - max(interpoled_snip))* 1/intsnipheight
-        ipoled_snips[i] = interpoled_snip
+    # interpolate all snippets at once:
+    ipoled_snips = np.dot(snippets, interpolation_matrix(width, int_met, int_fact))
+    intsnipheights = np.max(ipoled_snips, axis=1) - np.min(ipoled_snips, axis=1)
+    intsnipheights[intsnipheights == 0] = 1
+    ipoled_snips = (ipoled_snips - np.max(ipoled_snips, axis=1, keepdims=True))/intsnipheights[:,np.newaxis]
 
     mean = np.mean(ipoled_snips, axis = 0)
-    
-    aligned_snips = np.empty((len(snippets), (cut_width[1]-cut_width[0])* int_fact-(2*alignwidth)-int_fact))
-    
-    for i, interpoled_snip in enumerate(ipoled_snips):
-        cc = crosscorrelation(interpoled_snip[alignwidth:-alignwidth], mean)
-        #cc = crosscorrelation(interpoled_snip[15 + 10*-cut_width[0]-10*7:-15+ -10*cut_width[1]+ 31], mean[10*-cut_width[0]-10*7:-10*cut_width[1]+31])
-        offset = -alignwidth + np.argmax(cc)
-        aligned_snip = interpoled_snip[alignwidth-offset:-alignwidth-offset] if offset != -alignwidth else interpoled_snip[2*alignwidth:]
-        if len(aligned_snip[~np.isnan(aligned_snip)])>0:
-            aligned_snips[i] = aligned_snip
-        try:
-            heights[i] = np.max(interpoled_snip[alignwidth-offset:-alignwidth-offset]) - np.min(interpoled_snip[alignwidth-offset:-alignwidth-offset])
-        except:
-            heights[i] = np.max(interpoled_snip[2*alignwidth:]) - np.min(interpoled_snip[2*alignwidth:])
+
+    # align all snippets to the mean at once:
+    cc = crosscorrelations(ipoled_snips[:,alignwidth:-alignwidth], mean)
+    offsets = -alignwidth + np.argmax(cc, axis=1)
+    aligned_len = ipoled_snips.shape[1] - 2*alignwidth
+    idx = (alignwidth - offsets)[:,np.newaxis] + np.arange(aligned_len)
+    aligned_snips = ipoled_snips[np.arange(len(ipoled_snips))[:,np.newaxis], idx]
+    heights = np.max(aligned_snips, axis=1) - np.min(aligned_snips, axis=1)
     return aligned_snips, heights
 
 def pc(dataset):
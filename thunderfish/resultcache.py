@@ -0,0 +1,285 @@
+"""
+On-disk cache of analysis results.
+
+Analysis results are stored as pickle files in a cache directory.
+Each entry is identified by a key that is computed from the recording
+(its size and modification time, or a digest of its content), the
+analyzed channel, the configuration parameters the analysis
+depends on, and the version and code of thunderfish. Whenever the
+total size of the cache exceeds a limit, the least recently used
+entries are removed.
+
+## Classes
+- `ResultCache`: cache of analysis results with size limit and LRU eviction.
+
+## Functions
+- `recording_files()`: all files making up a recording.
+- `recording_stats()`: size and modification time of a recording.
+- `recording_digest()`: digest of the content of a recording.
+- `code_digest()`: digest of the version and the code of thunderfish.
+"""
+
+import os
+import hashlib
+import pickle
+import tempfile
+from .version import __version__
+
+
+def recording_files(filepath):
+    """ All files making up a recording.
+
+    Parameters
+    ----------
+    filepath: string
+        Path of a file or of a directory containing the recording.
+
+    Returns
+    -------
+    files: list of strings
+        The file itself or the sorted files contained in the directory.
+    """
+    if os.path.isdir(filepath):
+        return [os.path.join(filepath, f) for f in sorted(os.listdir(filepath))
+                if os.path.isfile(os.path.join(filepath, f))]
+    return [filepath]
+
+
+def recording_stats(filepath):
+    """ Size and modification time of a recording.
+
+    Parameters
+    ----------
+    filepath: string
+        Path of a file or of a directory containing the recording.
+
+    Returns
+    -------
+    stats: string
+        Absolute path, size and modification time (in ns)
+        of each file of the recording.
+    """
+    stats = []
+    for f in recording_files(filepath):
+        st = os.stat(f)
+        stats.append('%s %d %d' % (os.path.abspath(f), st.st_size, st.st_mtime_ns))
+    return '\n'.join(stats)
+
+
+def recording_digest(filepath, block_size=1 << 20):
+    """ Digest of the content of a recording.
+
+    Parameters
+    ----------
+    filepath: string
+        Path of a file or of a directory containing the recording.
+    block_size: int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    digest: string
+        SHA1 hex digest of the content of all files of the recording.
+    """
+    h = hashlib.sha1()
+    for f in recording_files(filepath):
+        h.update(os.path.basename(f).encode())
+        with open(f, 'rb') as sf:
+            while True:
+                buf = sf.read(block_size)
+                if not buf:
+                    break
+                h.update(buf)
+    return h.hexdigest()
+
+
+_code_digest = None
+
+def code_digest():
+    """ Digest of the version and the code of thunderfish.
+
+    Analysis results depend on the code that computed them.
+    The digest is computed only once.
+
+    Returns
+    -------
+    digest: string
+        SHA1 hex digest of the version and of all python files of the package.
+    """
+    global _code_digest
+    if _code_digest is None:
+        h = hashlib.sha1(__version__.encode())
+        path = os.path.dirname(os.path.abspath(__file__))
+        for f in sorted(os.listdir(path)):
+            if os.path.splitext(f)[1] == os.extsep + 'py':
+                h.update(f.encode())
+                with open(os.path.join(path, f), 'rb') as sf:
+                    h.update(sf.read())
+        _code_digest = h.hexdigest()
+    return _code_digest
+
+
+class ResultCache(object):
+    """ On-disk cache of analysis results.
+
+    Entries are pickled to files in the cache directory, named by
+    their key. Loading an entry updates the modification time of its
+    file, so that the modification times reflect the last usage.
+    Storing an entry removes the least recently used entries
+    until the total size of the cache is below `max_size`.
+
+    Entries are written to temporary files that are then renamed.
+    Several processes can therefore safely share a cache directory.
+
+    Parameters
+    ----------
+    path: string
+        Directory holding the cache. Created if it does not exist.
+    max_size: float
+        Maximum total size of the cache in megabytes.
+    digest: boolean
+        If True, identify recordings by a digest of their content.
+        Otherwise use their size and modification time, which is much faster.
+    version: string or None
+        Version of the analysis code that is part of each key.
+        If None, use `code_digest()`, so that results of previous versions
+        of thunderfish are not returned.
+    """
+
+    ext = os.extsep + 'pkl'
+
+    def __init__(self, path, max_size=1000.0, digest=False, version=None):
+        self.path = path
+        self.max_size = int(max_size*1024*1024)
+        self.digest = digest
+        self.version = code_digest() if version is None else version
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    def key(self, filepath, channel, config):
+        """ Key identifying an analysis of a recording.
+
+        Parameters
+        ----------
+        filepath: string
+            Path of the recording.
+        channel: int
+            Analyzed channel.
+        config: dict
+            The configuration parameter the analysis depends on.
+            Values need to have a reproducible `repr()`.
+
+        Returns
+        -------
+        key: string
+            SHA1 hex digest of the recording, channel, configuration,
+            and code version.
+        """
+        h = hashlib.sha1(self.version.encode())
+        if self.digest:
+            h.update(recording_digest(filepath).encode())
+        else:
+            h.update(recording_stats(filepath).encode())
+        h.update(repr(channel).encode())
+        h.update(repr(sorted(config.items())).encode())
+        return h.hexdigest()
+
+    def entry_file(self, key):
+        """ Path of the file storing the entry of `key`.
+        """
+        return os.path.join(self.path, key + self.ext)
+
+    def load(self, key):
+        """ Load cached results.
+
+        Parameters
+        ----------
+        key: string
+            Key as returned by `key()`.
+
+        Returns
+        -------
+        results: any or None
+            The cached results, or None if there is no valid entry for `key`.
+        """
+        file_path = self.entry_file(key)
+        try:
+            with open(file_path, 'rb') as sf:
+                results = pickle.load(sf)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        return results
+
+    def store(self, key, results):
+        """ Store results in the cache and evict least recently used entries.
+
+        Parameters
+        ----------
+        key: string
+            Key as returned by `key()`.
+        results: any
+            Picklable analysis results.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as sf:
+                pickle.dump(results, sf, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.entry_file(key))
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def size(self):
+        """ Total size of all cache entries in bytes.
+        """
+        return sum(st.st_size for _, st in self.entries())
+
+    def entries(self):
+        """ Files of all cache entries and their stats.
+
+        Returns
+        -------
+        entries: list of tuples
+            File path and `os.stat_result` of each entry,
+            sorted by last usage, least recently used first.
+        """
+        entries = []
+        for f in os.listdir(self.path):
+            if not f.endswith(self.ext):
+                continue
+            file_path = os.path.join(self.path, f)
+            try:
+                entries.append((file_path, os.stat(file_path)))
+            except OSError:
+                pass  # removed by another process
+        entries.sort(key=lambda e: e[1].st_mtime_ns)
+        return entries
+
+    def evict(self):
+        """ Remove least recently used entries until the cache is below its size limit.
+        """
+        entries = self.entries()
+        total = sum(st.st_size for _, st in entries)
+        for file_path, st in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass  # removed by another process
+            total -= st.st_size
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        for file_path, _ in self.entries():
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
@@ -1322,7 +1322,7 @@ class TableData(object):
         else:
             if len(cols) == len(self.header):
                 # delete whole rows:
-                if isinstance(row_indices, (list, tuple, np.ndarray)) and len(row_indices) > 1:
+                if isinstance(row_indices, (list, tuple, np.ndarray)):
                     for r in reversed(sorted(row_indices)):
                         for c in cols:
                             del self.data[c][r]
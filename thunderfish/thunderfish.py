@@ -12,408 +12,32 @@ python3 -m thunderfish.thunderfish audiofile.wav
 
 import sys
 import os
-import glob
+import time
+import signal
+import pickle
 import argparse
 import traceback
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-import matplotlib.ticker as ticker
-import matplotlib.lines as ml
-from matplotlib.transforms import Bbox
-from matplotlib.backends.backend_pdf import PdfPages
 from multiprocessing import Pool, freeze_support, cpu_count
-from audioio import play, fade
 from .version import __version__, __year__
-from .configfile import ConfigFile
 from .dataloader import load_data
-from .bestwindow import add_clip_config, add_best_window_config
-from .bestwindow import clip_args, best_window_args
 from .bestwindow import find_best_window, plot_best_data
-from .checkpulse import check_pulse, add_check_pulse_config, check_pulse_args
-from .pulses import extract_pulsefish
-from .powerspectrum import decibel, plot_decibel_psd, multi_psd
-from .powerspectrum import add_multi_psd_config, multi_psd_args
-from .harmonics import add_psd_peak_detection_config, add_harmonic_groups_config
-from .harmonics import harmonic_groups, harmonic_groups_args, psd_peak_detection_args
+from .powerspectrum import decibel, plot_decibel_psd
 from .harmonics import colors_markers, plot_harmonic_groups
-from .consistentfishes import consistent_fishes
-from .eodanalysis import eod_waveform, analyze_wave, analyze_pulse
-from .eodanalysis import wave_clipped_fraction, pulse_clipped_fraction
 from .eodanalysis import plot_eod_recording, plot_pulse_eods
 from .eodanalysis import plot_eod_waveform, plot_eod_snippets
 from .eodanalysis import plot_pulse_spectrum, plot_wave_spectrum
-from .eodanalysis import add_eod_analysis_config, eod_waveform_args
-from .eodanalysis import analyze_wave_args, analyze_pulse_args
-from .eodanalysis import wave_quality, wave_quality_args, add_eod_quality_config
-from .eodanalysis import pulse_quality, pulse_quality_args
-from .eodanalysis import save_eod_waveform, save_wave_eodfs, save_wave_fish, save_pulse_fish
-from .eodanalysis import save_wave_spectrum, save_pulse_spectrum, save_pulse_peaks
-from .fakefish import normalize_wavefish, export_wavefish
-from .tabledata import TableData, add_write_table_config, write_table_args
-
-import matplotlib
-matplotlib.use('TkAgg')
-
-def configuration(config_file, save_config=False, file_name='', verbose=0):
-    """
-    Assemble, save, and load configuration parameter for thunderfish.
-
-    Parameters
-    ----------
-    config_file: string
-        Name of the configuration file to be loaded.
-    save_config: boolean
-        If True write the configuration file to the current working directory
-        after loading existing configuration files.
-    file_name: string
-        Data file to be analyzed. Config files will be loaded from this path
-        and up to three levels up.
-    verbose: int
-        Print out information about loaded configuration files
-        if greater than zero.
-
-    Returns
-    -------
-    cfg: ConfigFile
-        Configuration parameters.
-    """
-    cfg = ConfigFile()
-    add_multi_psd_config(cfg)
-    cfg.add('frequencyThreshold', 1.0, 'Hz',
-            'The fundamental frequency of each fish needs to be detected in each power spectrum within this threshold.')
-    # TODO: make this threshold dependent on frequency resolution!
-    cfg.add('minPSDAverages', 3, '', 'Minimum number of fft averages for estimating the power spectrum.')  # needed by fishfinder
-    add_psd_peak_detection_config(cfg)
-    add_harmonic_groups_config(cfg)
-    add_clip_config(cfg)
-    cfg.add('unwrapData', False, '', 'Unwrap clipped voltage traces.')
-    add_best_window_config(cfg, win_size=8.0, w_cv_ampl=10.0)
-    add_check_pulse_config(cfg)
-    add_eod_analysis_config(cfg, min_pulse_win=0.004)
-    del cfg['eodSnippetFac']
-    del cfg['eodMinSnippet']
-    del cfg['eodMinSem']
-    add_eod_quality_config(cfg)
-    add_write_table_config(cfg, table_format='csv', unit_style='row',
-                           align_columns=True, shrink_width=False)
-    
-    # load configuration from working directory and data directories:
-    cfg.load_files(config_file, file_name, 3, verbose)
-
-    # save configuration:
-    if save_config:
-        ext = os.path.splitext(config_file)[1]
-        if ext != os.extsep + 'cfg':
-            print('configuration file name must have .cfg as extension!')
-        else:
-            print('write configuration to %s ...' % config_file)
-            del cfg['fileColumnNumbers']
-            del cfg['fileShrinkColumnWidth']
-            del cfg['fileMissing']
-            del cfg['fileLaTeXLabelCommand']
-            del cfg['fileLaTeXMergeStd']
-            cfg.dump(config_file)
-    return cfg
-
-
-def detect_eods(data, samplerate, clipped, min_clip, max_clip, name, verbose, plot_level, cfg):
-    """ Detect EODs of all fish present in the data.
-
-    Parameters
-    ----------
-    data: array of floats
-        The recording in which to detect EODs.
-    samplerate: float
-        Sampling rate of the dataset.
-    clipped: float
-        Fraction of clipped amplitudes.
-    min_clip: float
-        Minimum amplitude that is not clipped.
-    max_clip: float
-        Maximum amplitude that is not clipped.
-    name: string
-        Name of the recording (e.g. its filename).
-    verbose: int
-        Print out information about EOD detection if greater than zero.
-    plot_level : int
-        Similar to verbosity levels, but with plots. 
-    cfg: ConfigFile
-        Configuration parameters.
-
-    Returns
-    -------
-    psd_data: list of 2D arrays
-        List of power spectra (frequencies and power) of the analysed data
-        for different frequency resolutions.
-    wave_eodfs: list of 2D arrays
-        Frequency and power of fundamental frequency/harmonics of all wave fish.
-    wave_indices: array of int
-        Indices of wave fish mapping from wave_eodfs to eod_props.
-        If negative, then that EOD frequency has no waveform described in eod_props.
-    eod_props: list of dict
-        Lists of EOD properties as returned by analyze_pulse() and analyze_wave()
-        for each waveform in mean_eods.
-    mean_eods: list of 2-D arrays with time, mean, sem, and fit.
-        Averaged EOD waveforms of pulse and wave fish.
-    spec_data: list of 2_D arrays
-        For each pulsefish a power spectrum of the single pulse and for
-        each wavefish the relative amplitudes and phases of the harmonics.
-    peak_data: list of 2_D arrays
-        For each pulse fish a list of peak properties
-        (index, time, and amplitude), empty array for wave fish.
-    power_thresh:  2 D array or None
-        Frequency (first column) and power (second column) of threshold
-        derived from single pulse spectra to discard false wave fish.
-        None if no pulse fish was detected.
-    skip_reason: list of string
-        Reasons, why an EOD was discarded.
-    """            
-    # detect wave fish:
-    psd_data = multi_psd(data, samplerate, **multi_psd_args(cfg))
-    h_kwargs = psd_peak_detection_args(cfg)
-    h_kwargs.update(harmonic_groups_args(cfg))
-    wave_eodfs_list = []
-    for i, psd in enumerate(psd_data):
-        wave_eodfs = harmonic_groups(psd[:,0], psd[:,1], verbose-1, **h_kwargs)[0]
-        if verbose > 0 and len(psd_data) > 1:
-            numpsdresolutions = cfg.value('numberPSDResolutions')
-            print('fundamental frequencies detected in power spectrum of window %d at resolution %d:'
-                  % (i//numpsdresolutions, i%numpsdresolutions))
-            if len(wave_eodfs) > 0:
-                print('  ' + ' '.join(['%.1f' % freq[0, 0] for freq in wave_eodfs]))
-            else:
-                print('  none')
-        wave_eodfs_list.append(wave_eodfs)
-    wave_eodfs = consistent_fishes(wave_eodfs_list,
-                                   df_th=cfg.value('frequencyThreshold'))
-    if verbose > 0:
-        if len(wave_eodfs) > 0:
-            print('found %2d EOD frequencies consistent in all power spectra:' % len(wave_eodfs))
-            print('  ' + ' '.join(['%.1f' % freq[0, 0] for freq in wave_eodfs]))
-        else:
-            print('no fundamental frequencies are consistent in all power spectra')
-
-    # detect pulse fish:
-    _, eod_times, eod_peaktimes, zoom_window, _ = extract_pulsefish(data, samplerate, name, verbose=verbose, plot_level=plot_level)
-
-    #eod_times = []
-    #eod_peaktimes = []
-    #zoom_window = []
-    if verbose > 0:
-        if len(eod_times) > 0:
-            print('found %2d pulsefish EODs' % len(eod_times))
-        else:
-            print('no pulsefish EODs found')
-            
-    # analysis results:
-    eod_props = []
-    mean_eods = []
-    spec_data = []
-    peak_data = []
-    power_thresh = None
-    skip_reason = []
-    
-    # analyse eod waveform of pulse-fish:
-    min_freq_res = cfg.value('frequencyResolution')
-    max_pulse_amplitude = 0.0
-    for k, (eod_ts, eod_pts) in enumerate(zip(eod_times, eod_peaktimes)):
-        mean_eod, eod_times0 = \
-            eod_waveform(data, samplerate, eod_ts, win_fac=0.8,
-                         min_win=cfg.value('eodMinPulseSnippet'),
-                         min_sem=False, **eod_waveform_args(cfg))
-        mean_eod, props, peaks, power = analyze_pulse(mean_eod, eod_times0,
-                                                      freq_resolution=min_freq_res,
-                                                      **analyze_pulse_args(cfg))
-        if len(peaks) == 0:
-            print('error: no peaks in pulse EOD detected')
-            continue
-        clipped_frac = pulse_clipped_fraction(data, samplerate, eod_times0, mean_eod,
-                                              min_clip, max_clip)
-        props['peaktimes'] = eod_pts      # XXX that should go into analyze pulse
-        props['index'] = len(eod_props)
-        props['clipped'] = clipped_frac
-
-        # add good waveforms only:
-        skips, msg, skipped_clipped = pulse_quality(props, **pulse_quality_args(cfg))
-
-        if len(skips) == 0:
-            eod_props.append(props)
-            mean_eods.append(mean_eod)
-            spec_data.append(power)
-            peak_data.append(peaks)
-            if verbose > 0:
-                print('take %6.1fHz pulse fish: %s' % (props['EODf'], msg))
-        else:
-            skip_reason += ['%.1fHz pulse fish %s' % (props['EODf'], skips)]
-            if verbose > 0:
-                print('skip %6.1fHz pulse fish: %s (%s)' %
-                      (props['EODf'], skips, msg))
-
-        # threshold for wave fish peaks based on single pulse spectra:
-        if len(skips) == 0 or skipped_clipped:
-            if max_pulse_amplitude < props['p-p-amplitude']:
-                max_pulse_amplitude = props['p-p-amplitude']
-            i0 = np.argmin(np.abs(mean_eod[:,0]))
-            i1 = len(mean_eod) - i0
-            pulse_data = np.zeros(len(data))
-            for t in props['peaktimes']:
-                idx = int(t*samplerate)
-                ii0 = i0 if idx-i0 >= 0 else idx
-                ii1 = i1 if idx+i1 < len(pulse_data) else len(pulse_data)-1-idx
-                pulse_data[idx-ii0:idx+ii1] = mean_eod[i0-ii0:i0+ii1,1]
-            pulse_psd = multi_psd(pulse_data, samplerate, **multi_psd_args(cfg))
-            pulse_power = pulse_psd[0][:,1]
-            pulse_power *= len(data)/samplerate/props['period']/len(props['peaktimes'])
-            pulse_power *= 5.0
-            if power_thresh is None:
-                power_thresh = pulse_psd[0]
-                power_thresh[:,1] = pulse_power
-            else:
-                power_thresh[:,1] += pulse_power
-                
-    # remove wavefish below pulse fish power:
-    if power_thresh is not None:
-        n = len(wave_eodfs)
-        maxh = 3  # XXX make parameter
-        df = power_thresh[1,0] - power_thresh[0,0]
-        for k, fish in enumerate(reversed(wave_eodfs)):
-            idx = np.array(fish[:maxh,0]//df, dtype=int)
-            for offs in range(-2, 3):
-                nbelow = np.sum(fish[:maxh,1] < power_thresh[idx+offs,1])
-                if nbelow > 0:
-                    wave_eodfs.pop(n-1-k)
-                    if verbose > 0:
-                        print('skip %6.1fHz wave  fish: %2d harmonics are below pulsefish threshold' % (fish[0,0], nbelow))
-                    break
-
-    # analyse EOD waveform of all wavefish:
-    powers = np.array([np.sum(fish[:, 1]**2) for fish in wave_eodfs])
-    power_indices = np.argsort(-powers)
-    wave_indices = np.zeros(len(wave_eodfs), dtype=np.int) - 3
-    for k, idx in enumerate(power_indices):
-        fish = wave_eodfs[idx]
-        eod_times = np.arange(0.0, len(data)/samplerate, 1.0/fish[0,0])
-        mean_eod, eod_times = \
-            eod_waveform(data, samplerate, eod_times, win_fac=3.0, min_win=0.0,
-                         min_sem=(k==0), **eod_waveform_args(cfg))
-        mean_eod, props, sdata, error_str = \
-            analyze_wave(mean_eod, fish, **analyze_wave_args(cfg))
-        if error_str:
-            print(name + ': ' + error_str)
-        clipped_frac = wave_clipped_fraction(data, samplerate, eod_times, mean_eod,
-                                             min_clip, max_clip)
-        props['n'] = len(eod_times)
-        props['index'] = len(eod_props)
-        props['clipped'] = clipped_frac
-        # remove wave fish that are smaller than the largest pulse fish:
-        if props['p-p-amplitude'] < 0.01*max_pulse_amplitude:
-            rm_indices = power_indices[k:]
-            if verbose > 0:
-                print('skip %6.1fHz wave  fish: power=%5.1fdB, p-p amplitude=%5.1fdB smaller than pulse fish=%5.1dB - 20dB' %
-                      (props['EODf'], decibel(powers[idx]),
-                       decibel(props['p-p-amplitude']), decibel(max_pulse_amplitude)))
-                for idx in rm_indices[1:]:
-                    print('skip %6.1fHz wave  fish: power=%5.1fdB even smaller' %
-                          (wave_eodfs[idx][0,0], decibel(powers[idx])))
-            wave_eodfs = [eodfs for idx, eodfs in enumerate(wave_eodfs)
-                          if idx not in rm_indices]
-            wave_indices = np.array([idcs for idx, idcs in enumerate(wave_indices)
-                                    if idx not in rm_indices], dtype=np.int)
-            break
-        # add good waveforms only:
-        remove, skips, msg = wave_quality(props, sdata[1:,3], **wave_quality_args(cfg))
-        if len(skips) == 0:
-            wave_indices[idx] = props['index']
-            eod_props.append(props)
-            mean_eods.append(mean_eod)
-            spec_data.append(sdata)
-            peak_data.append([])
-            if verbose > 0:
-                print('take   %6.1fHz wave  fish: %s' % (props['EODf'], msg))
-        else:
-            wave_indices[idx] = -2 if remove else -1
-            skip_reason += ['%.1fHz wave fish %s' % (props['EODf'], skips)]
-            if verbose > 0:
-                print('%-6s %6.1fHz wave  fish: %s (%s)' %
-                      ('remove' if remove else 'skip', props['EODf'], skips, msg))
-    wave_eodfs = [eodfs for idx, eodfs in zip(wave_indices, wave_eodfs) if idx > -2]
-    wave_indices = np.array([idx for idx in wave_indices if idx > -2], dtype=np.int)
-    return (psd_data, wave_eodfs, wave_indices, eod_props, mean_eods,
-            spec_data, peak_data, power_thresh, skip_reason, zoom_window)
-
-
-def remove_eod_files(output_basename, verbose, cfg):
-    """ Remove all files from previous runs of thunderfish
-    """
-    ff = cfg.value('fileFormat')
-    if ff == 'py':
-        fext = 'py'
-    else:
-        fext = TableData.extensions[cfg.value('fileFormat')]
-    # remove all files from previous runs of thunderfish:
-    for fn in glob.glob('%s*.%s' % (output_basename, fext)):
-        os.remove(fn)
-        if verbose > 0:
-            print('removed file %s' % fn)
-
-            
-def save_eods(output_basename, eod_props, mean_eods, spec_data, peak_data,
-              wave_eodfs, wave_indices, unit, verbose, cfg):
-    """ Save analysis results of all EODs to files.
-    """
-    if write_table_args(cfg)['table_format'] == 'py':
-        with open(output_basename+'.py', 'w') as f:
-            name = os.path.basename(output_basename)
-            for k, sdata in enumerate(spec_data):
-                # save wave fish only:
-                if len(sdata)>0 and sdata.shape[1] > 2:
-                    fish = dict(amplitudes=sdata[:,3], phases=sdata[:,5])
-                    fish = normalize_wavefish(fish)
-                    export_wavefish(fish, name+'-%d_harmonics' % k, f)
-    else:
-        # all wave fish in wave_eodfs:
-        if len(wave_eodfs) > 0:
-            fp = save_wave_eodfs(wave_eodfs, wave_indices, output_basename,
-                                 **write_table_args(cfg))
-            if verbose > 0:
-                print('wrote file %s' % fp)
-        # all wave and pulse fish:
-        for i, (mean_eod, sdata, pdata) in enumerate(zip(mean_eods, spec_data, peak_data)):
-            fp = save_eod_waveform(mean_eod, unit, i, output_basename,
-                                   **write_table_args(cfg))
-            if verbose > 0:
-                print('wrote file %s' % fp)
-            # power spectrum:
-            if len(sdata)>0:
-                if sdata.shape[1] == 2:
-                    fp = save_pulse_spectrum(sdata, unit, i, output_basename,
-                                             **write_table_args(cfg))
-                else:
-                    fp = save_wave_spectrum(sdata, unit, i, output_basename,
-                                            **write_table_args(cfg))
-                if verbose > 0:
-                    print('wrote file %s' % fp)
-            # peaks:
-            fp = save_pulse_peaks(pdata, unit, i, output_basename,
-                                  **write_table_args(cfg))
-            if verbose > 0 and fp is not None:
-                print('wrote file %s' % fp)
-        # wave fish properties:
-        fp = save_wave_fish(eod_props, unit, output_basename,
-                            **write_table_args(cfg))
-        if verbose > 0 and fp:
-            print('wrote file %s' % fp)
-        # pulse fish properties:
-        fp = save_pulse_fish(eod_props, unit, output_basename,
-                             **write_table_args(cfg))
-        if verbose > 0 and fp:
-            print('wrote file %s' % fp)
-
+from .tabledata import TableData
+from .resultcache import ResultCache, recording_files
+from .profiling import profiling, stage
+from .eoddetection import configuration, analysis_args
+from .eoddetection import detect_eods, merge_eods, detect_eods_stream
+from .eoddetection import remove_eod_files, save_eods
 
 def plot_style():
     """ Set style of plots.
     """
+    import matplotlib.pyplot as plt
     plt.rcParams['axes.facecolor'] = 'none'
     plt.rcParams['xtick.direction'] = 'out'
     plt.rcParams['ytick.direction'] = 'out'
@@ -513,9 +137,13 @@ def plot_eods(base_name, raw_data, samplerate, idx0, idx1, clipped,
     fig: plt.figure
         Figure with the plots.
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+    import matplotlib.lines as ml
 
     def keypress(event):
         if event.key in 'pP':
+            from audioio import play, fade
             if idx1 > idx0:
                 playdata = 1.0 * raw_data[idx0:idx1]
             else:
@@ -859,6 +487,10 @@ def plot_eod_subplots(base_name, subplots, raw_data, samplerate, idx0, idx1, cli
         are set to `(min_freq, max_freq)` and limits of power axis are computed
         from powers below max_freq if `max_freq` is greater than zero
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    import matplotlib.ticker as ticker
+    from matplotlib.backends.backend_pdf import PdfPages
     plot_style()
     if 'r' in subplots:
         fig, ax = plt.subplots(figsize=(10, 2))
@@ -997,7 +629,7 @@ def thunderfish(filename, cfg, channel=0, log_freq=0.0, save_data=False,
                 all_eods=False, spec_plots='auto', save_plot=False,
                 multi_pdf=None, save_subplots='',
                 output_folder='.', keep_path=False, show_bestwindow=False,
-                verbose=0, plot_level=0):
+                cache=None, profile=False, verbose=0, plot_level=0):
     # check data file:
     if len(filename) == 0:
         return 'you need to specify a file containing some data'
@@ -1010,112 +642,393 @@ def thunderfish(filename, cfg, channel=0, log_freq=0.0, save_data=False,
     if channel < 0:
         return '%s: invalid channel %d' % (filename, channel)
 
-    # load data:
-    try:
-        raw_data, samplerate, unit = load_data(filename, channel,
-                                               verbose=verbose)
-    except IOError as e:
-        return '%s: failed to open file: %s' % (filename, str(e))
-    if len(raw_data) <= 1:
-        return '%s: empty data file' % filename
-
-    # best_window:
-    data, idx0, idx1, clipped, min_clip, max_clip = find_best_window(raw_data, samplerate,
-                                                                     cfg, show_bestwindow)
-    if show_bestwindow:
-        return None
-    found_bestwindow = idx1 > 0
-    if not found_bestwindow:
-        print(filename + ': not enough data for requested best window length. You may want to adjust the bestWindowSize parameter in the configuration file.')
-
-    # detect EODs in the data:
-    psd_data, wave_eodfs, wave_indices, eod_props, \
-    mean_eods, spec_data, peak_data, power_thresh, skip_reason, zoom_window = \
-      detect_eods(data, samplerate, clipped, min_clip, max_clip, filename,
-                  verbose, plot_level, cfg)
-    if not found_bestwindow:
-        wave_eodfs = []
-        wave_indices = []
-        eod_props = []
-        mean_eods = []
-
-    # warning message in case no fish has been found:
-    if found_bestwindow and not eod_props :
-        msg = ', '.join(skip_reason)
-        if msg:
-            print(filename + ': no fish found: %s' % msg)
-        else:
-            print(filename + ': no fish found.')
-
-    # save results to files:
-    output_basename = os.path.join(output_folder, outfilename)
-    if save_data:
-        remove_eod_files(output_basename, verbose, cfg)
-        if found_bestwindow:
-            if keep_path:
-                outpath = os.path.dirname(output_basename)
-                if not os.path.exists(outpath):
-                    if verbose > 0:
-                        print('mkdir %s' % outpath)
-                    os.makedirs(outpath)
-            save_eods(output_basename, eod_props, mean_eods, spec_data, peak_data,
-                      wave_eodfs, wave_indices, unit, verbose, cfg)
-
-    if save_plot or not save_data:
-        min_freq = 0.0
-        max_freq = 3000.0
-        if log_freq > 0.0:
-            min_freq = log_freq
-            max_freq = min_freq*20
-            if max_freq < 2000:
-                max_freq = 2000
-            log_freq = True
+    # profiling is disabled on return, so that it does not slow down
+    # the analysis of the following files:
+    with profiling(profile) as profiler:
+        stream = cfg.value('streamWindowSize') > 0.0
+        plot = save_plot or not save_data
+        results = None
+        if cache is not None and not show_bestwindow:
+            try:
+                cache_key = cache.key(filename, channel, analysis_args(cfg))
+            except OSError as e:
+                return '%s: failed to open file: %s' % (filename, str(e))
+            # the data window of a streamed recording is not cached:
+            if not (stream and plot):
+                with stage('cache'):
+                    results = cache.load(cache_key)
+        if results is not None:
+            if verbose > 0:
+                print('load analysis results from cache')
+            samplerate, unit, toffs, idx0, idx1, clipped, min_clip, max_clip, \
+            found_bestwindow, psd_data, wave_eodfs, wave_indices, eod_props, \
+            mean_eods, spec_data, peak_data, power_thresh, skip_reason, zoom_window = results
+            raw_data = None
+            if plot:
+                try:
+                    with stage('load'):
+                        raw_data, samplerate, unit = load_data(filename, channel,
+                                                               verbose=verbose)
+                except IOError as e:
+                    return '%s: failed to open file: %s' % (filename, str(e))
         else:
-            log_freq = False
-        n_snippets = 10
-        fig = plot_eods(outfilename, raw_data, samplerate, idx0, idx1, clipped,
-                        psd_data[0], wave_eodfs, wave_indices, mean_eods, eod_props,
-                        peak_data, spec_data, None, unit, zoom_window, n_snippets,
-                        power_thresh, True, all_eods, spec_plots, log_freq, min_freq, max_freq,
-                        interactive=not save_data, verbose=verbose)
-        if save_plot:
-            if multi_pdf is not None:
-                multi_pdf.savefig(fig)
+            if stream:
+                # detect EODs in consecutive windows of the recording:
+                try:
+                    with stage('detect_eods_stream'):
+                        raw_data, samplerate, unit, toffs, clipped, min_clip, max_clip, \
+                        psd_data, wave_eodfs, wave_indices, eod_props, \
+                        mean_eods, spec_data, peak_data, power_thresh, skip_reason, zoom_window = \
+                          detect_eods_stream(filename, channel, cfg, verbose)
+                except IOError as e:
+                    return '%s: failed to open file: %s' % (filename, str(e))
+                except ValueError as e:
+                    return '%s: %s' % (filename, str(e))
+                idx0 = 0
+                idx1 = len(raw_data)
+                found_bestwindow = True
+            else:
+                # load data:
+                try:
+                    with stage('load'):
+                        raw_data, samplerate, unit = load_data(filename, channel,
+                                                               verbose=verbose)
+                except IOError as e:
+                    return '%s: failed to open file: %s' % (filename, str(e))
+                if len(raw_data) <= 1:
+                    return '%s: empty data file' % filename
+                toffs = 0.0
+
+                # best_window:
+                with stage('bestwindow'):
+                    data, idx0, idx1, clipped, min_clip, max_clip = \
+                      find_best_window(raw_data, samplerate, cfg, show_bestwindow)
+                if show_bestwindow:
+                    return None
+                found_bestwindow = idx1 > 0
+                if not found_bestwindow:
+                    print(filename + ': not enough data for requested best window length. You may want to adjust the bestWindowSize parameter in the configuration file.')
+
+                # detect EODs in the data:
+                with stage('detect_eods'):
+                    psd_data, wave_eodfs, wave_indices, eod_props, \
+                    mean_eods, spec_data, peak_data, power_thresh, skip_reason, zoom_window = \
+                      detect_eods(data, samplerate, clipped, min_clip, max_clip, filename,
+                                  verbose, plot_level, cfg)
+            if cache is not None:
+                with stage('cache'):
+                    cache.store(cache_key, (samplerate, unit, toffs, idx0, idx1,
+                                            clipped, min_clip, max_clip, found_bestwindow,
+                                            psd_data[:1], wave_eodfs, wave_indices,
+                                            eod_props, mean_eods, spec_data, peak_data,
+                                            power_thresh, skip_reason, zoom_window))
+        if not found_bestwindow:
+            wave_eodfs = []
+            wave_indices = []
+            eod_props = []
+            mean_eods = []
+
+        # warning message in case no fish has been found:
+        if found_bestwindow and not eod_props :
+            msg = ', '.join(skip_reason)
+            if msg:
+                print(filename + ': no fish found: %s' % msg)
+            else:
+                print(filename + ': no fish found.')
+
+        # save results to files:
+        output_basename = os.path.join(output_folder, outfilename)
+        if save_data:
+            remove_eod_files(output_basename, verbose, cfg)
+            if found_bestwindow:
+                if keep_path:
+                    outpath = os.path.dirname(output_basename)
+                    if not os.path.exists(outpath):
+                        if verbose > 0:
+                            print('mkdir %s' % outpath)
+                        os.makedirs(outpath)
+                with stage('save'):
+                    save_eods(output_basename, eod_props, mean_eods, spec_data, peak_data,
+                              wave_eodfs, wave_indices, unit, verbose, cfg)
+
+        if plot:
+            import matplotlib.pyplot as plt
+            min_freq = 0.0
+            max_freq = 3000.0
+            if log_freq > 0.0:
+                min_freq = log_freq
+                max_freq = min_freq*20
+                if max_freq < 2000:
+                    max_freq = 2000
+                log_freq = True
             else:
-                # save figure as pdf:
-                fig.savefig(output_basename + '.pdf')
-                plt.close('all')
-            if len(save_subplots) > 0:
-                plot_eod_subplots(output_basename, save_subplots,
-                                  raw_data, samplerate, idx0, idx1, clipped, psd_data[0],
-                                  wave_eodfs, wave_indices, mean_eods, eod_props,
-                                  peak_data, spec_data, unit, zoom_window, n_snippets,
-                                  power_thresh, True, log_freq, min_freq, max_freq)
-        elif not save_data:
-            fig.canvas.set_window_title('thunderfish')
-            plt.show()
+                log_freq = False
+            if stream:
+                # pulse times relative to the plotted window:
+                for props in eod_props:
+                    if props['type'] == 'pulse':
+                        for key in ['times', 'peaktimes']:
+                            t = props[key] - toffs
+                            props[key] = t[(t >= 0.0) & (t < len(raw_data)/samplerate)]
+            n_snippets = 10
+            with stage('plot'):
+                fig = plot_eods(outfilename, raw_data, samplerate, idx0, idx1, clipped,
+                                psd_data[0], wave_eodfs, wave_indices, mean_eods, eod_props,
+                                peak_data, spec_data, None, unit, zoom_window, n_snippets,
+                                power_thresh, True, all_eods, spec_plots, log_freq, min_freq, max_freq,
+                                interactive=not save_data, verbose=verbose)
+                if save_plot:
+                    if multi_pdf is not None:
+                        multi_pdf.savefig(fig)
+                    else:
+                        # save figure as pdf:
+                        fig.savefig(output_basename + '.pdf')
+                        plt.close('all')
+                    if len(save_subplots) > 0:
+                        plot_eod_subplots(output_basename, save_subplots,
+                                          raw_data, samplerate, idx0, idx1, clipped, psd_data[0],
+                                          wave_eodfs, wave_indices, mean_eods, eod_props,
+                                          peak_data, spec_data, unit, zoom_window, n_snippets,
+                                          power_thresh, True, log_freq, min_freq, max_freq)
+
+        # timing and memory usage of the analysis stages:
+        if profiler is not None:
+            if save_data or save_plot:
+                fp = profiler.save(output_basename, table_format='csv')
+                if verbose > 0:
+                    print('wrote file %s' % fp)
+            else:
+                profiler.table().write()
+
+    if plot and not save_plot and not save_data:
+        fig.canvas.set_window_title('thunderfish')
+        plt.show()
+
+
+class FigurePages(object):
+    """
+    Collect figures as pickled pages.
+
+    Replaces `PdfPages` in worker processes of parallel jobs.
+    Figures are pickled instead of rendered into a shared multi-page pdf
+    file. The pages are sent to the parent process that adds them
+    in the order of the input files to the multi-page pdf file
+    (see `run_pool()`).
+    """
+
+    def __init__(self):
+        self.pages = []
+
+    def savefig(self, fig):
+        """ Pickle and close a figure.
+
+        Parameters
+        ----------
+        fig: matplotlib.figure.Figure
+            The figure to be added as a page.
+        """
+        import matplotlib.pyplot as plt
+        # format_coord functions are local functions that cannot be pickled:
+        for ax in fig.axes:
+            ax.__dict__.pop('format_coord', None)
+        self.pages.append(pickle.dumps(fig))
+        plt.close(fig)
+
+    def pop_pages(self):
+        """ Return and forget all collected pages.
+        """
+        pages = self.pages
+        self.pages = []
+        return pages
 
 
 pool_args = None
+file_timeout = 0.0
+
+
+class AnalysisTimeout(Exception):
+    """ Analysis of a recording took longer than `file_timeout` seconds.
+    """
+    pass
+
+
+def raise_timeout(signum, frame):
+    """ Signal handler raising AnalysisTimeout.
+    """
+    raise AnalysisTimeout()
+
+
+def init_pool(args, timeout=0.0):
+    """
+    Initializer of Pool() workers.
+
+    Sets the arguments passed on to `thunderfish()` once per worker
+    instead of sending them along with each file.
+
+    Parameters
+    ----------
+    args: dict
+        Keyword arguments of `thunderfish()`.
+    timeout: float
+        Maximum time in seconds the analysis of a single file may take.
+        No limit if zero.
+    """
+    global pool_args
+    global file_timeout
+    pool_args = args
+    file_timeout = timeout
+
 
 def run_thunderfish(file):
     """
-    Helper function for mutlithreading Pool().map().
+    Helper function for mutlithreading Pool().imap_unordered().
+
+    Returns
+    -------
+    file: string
+        The analyzed file.
+    success: bool
+        False if the analysis failed or timed out.
+    pages: list of bytes
+        Pickled figures for a multi-page pdf file (see `FigurePages`).
     """
-    verbose = pool_args[-2]+1
+    verbose = pool_args.get('verbose', 0)+1
     if verbose > 0:
         if verbose > 1:
             print('='*70)
         print('analyze recording %s ...' % file)
+    timeout = file_timeout > 0.0 and hasattr(signal, 'SIGALRM')
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, file_timeout)
     try:
-        msg = thunderfish(file, *pool_args)
+        msg = thunderfish(file, **pool_args)
+        # thunderfish() returns an error message if it failed:
+        success = not msg
         if msg:
             print(msg)
+    except AnalysisTimeout:
+        success = False
+        print('%s: analysis timed out after %gs' % (file, file_timeout))
     except (KeyboardInterrupt, SystemExit):
         print('\nthunderfish interrupted by user... exit now.')
         sys.exit(0)
     except:
+        success = False
         print(traceback.format_exc())
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0.0)
+    if not success and 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+    pages = []
+    multi_pdf = pool_args.get('multi_pdf', None)
+    if isinstance(multi_pdf, FigurePages):
+        pages = multi_pdf.pop_pages()
+    return file, success, pages
+
+
+def recording_size(filepath):
+    """
+    Size of a recording in bytes.
+
+    Parameters
+    ----------
+    filepath: string
+        Path of a file or of a directory containing the recording.
+
+    Returns
+    -------
+    size: int
+        Total size of all files making up the recording.
+        Zero if the recording does not exist.
+    """
+    try:
+        return sum(os.path.getsize(f) for f in recording_files(filepath))
+    except OSError:
+        return 0
+
+
+def run_pool(files, cpus, args, timeout=0.0, max_tasks=10, progress=True,
+             multi_pdf=None):
+    """
+    Analyze recordings in parallel on a pool of processes.
+
+    Recordings are analyzed largest first, so that long-running files
+    do not end up at the tail of the run. Each worker receives the
+    arguments of `thunderfish()` only once and is replaced by a
+    fresh process after `max_tasks` recordings.
+
+    Parameters
+    ----------
+    files: list of strings
+        Recordings to be analyzed.
+    cpus: int
+        Number of worker processes.
+    args: dict
+        Keyword arguments of `thunderfish()`.
+    timeout: float
+        Maximum time in seconds the analysis of a single file may take.
+        No limit if zero.
+    max_tasks: int
+        Number of recordings analyzed by a worker before it is replaced.
+        Zero for never replacing workers.
+    progress: bool
+        Print number of analyzed files and throughput to stderr.
+    multi_pdf: PdfPages or None
+        If not None, add the plots of all recordings to this multi-page
+        pdf file in the order of `files`. The 'multi_pdf' item of
+        `args` needs to be a `FigurePages` instance.
+
+    Returns
+    -------
+    failed: list of strings
+        Recordings whose analysis failed or timed out.
+    """
+    # input order for pages of the multi-page pdf:
+    file_indices = {}
+    for k, f in enumerate(files):
+        file_indices.setdefault(f, []).append(k)
+    pages = {}
+    next_page = 0
+    files = sorted(files, key=recording_size, reverse=True)
+    total_size = sum(recording_size(f) for f in files)
+    failed = []
+    done_size = 0
+    # overwrite progress line on terminals:
+    sol, eol = ('\r', '') if sys.stderr.isatty() else ('', '\n')
+    start_time = time.time()
+    p = Pool(cpus, init_pool, (args, timeout), max_tasks if max_tasks > 0 else None)
+    try:
+        for k, (file, success, file_pages) in enumerate(p.imap_unordered(run_thunderfish, files)):
+            if not success:
+                failed.append(file)
+            if multi_pdf is not None:
+                import matplotlib.pyplot as plt
+                pages[file_indices[file].pop(0)] = file_pages
+                while next_page in pages:
+                    for page in pages.pop(next_page):
+                        fig = pickle.loads(page)
+                        multi_pdf.savefig(fig)
+                        plt.close(fig)
+                    next_page += 1
+            done_size += recording_size(file)
+            if progress:
+                elapsed = time.time() - start_time
+                rate = done_size/elapsed/1024/1024 if elapsed > 0.0 else 0.0
+                eta = elapsed*(total_size - done_size)/done_size if done_size > 0 else 0.0
+                sys.stderr.write('%sanalyzed %d of %d files (%d failed), %.1fMB/s, %.0fs elapsed, %.0fs remaining  %s' %
+                                 (sol, k+1, len(files), len(failed), rate, elapsed, eta, eol))
+                sys.stderr.flush()
+        p.close()
+    except KeyboardInterrupt:
+        p.terminate()
+        raise
+    finally:
+        p.join()
+        if progress and sol:
+            sys.stderr.write('\n')
+    return failed
 
 
 def main():
@@ -1143,6 +1056,10 @@ def main():
                         help='plot spectra for all EOD waveforms')
     parser.add_argument('-j', dest='jobs', nargs='?', type=int, default=None, const=0,
                         help='number of jobs run in parallel. Without argument use all CPU cores.')
+    parser.add_argument('--timeout', dest='timeout', default=0.0, type=float, metavar='SECONDS',
+                        help='abort the analysis of a file in parallel jobs after SECONDS (defaults to no limit)')
+    parser.add_argument('--max-tasks', dest='max_tasks', default=10, type=int, metavar='N',
+                        help='replace parallel job processes by new ones after analyzing N files (defaults to 10, 0 keeps processes)')
     parser.add_argument('-s', dest='save_data', action='store_true',
                         help='save analysis results to files')
     parser.add_argument('-f', dest='format', default='auto', type=str,
@@ -1153,7 +1070,7 @@ def main():
     parser.add_argument('-P', dest='save_subplots', default='', type=str, metavar='rtpwse',
                         help='save subplots as separate pdf files: r) recording with best window, t) data trace with detected pulse fish, p) power spectrum with detected wave fish, w/W) mean EOD waveform, s/S) EOD spectrum, e/E) EOD waveform and spectra. Capital letters produce a single multipage pdf containing plots of all detected fish')
     parser.add_argument('-m', dest='multi_pdf', default='', type=str, metavar='PDFFILE',
-                        help='save all plots of all recordings in a multi pages pdf file. Disables parallel jobs.')
+                        help='save all plots of all recordings in a multi pages pdf file')
     parser.add_argument('-l', dest='log_freq', type=float, metavar='MINFREQ',
                         nargs='?', const=100.0, default=0.0,
                         help='logarithmic frequency axis in  power spectrum with optional minimum frequency (defaults to 100 Hz)')
@@ -1163,6 +1080,14 @@ def main():
                         help='keep path of input file when saving analysis files, i.e. append path of input file to OUTPATH')
     parser.add_argument('-b', dest='show_bestwindow', action='store_true',
                         help='show the cost function of the best window algorithm')
+    parser.add_argument('--cache', dest='cache', default='', type=str, metavar='CACHEDIR',
+                        help='cache analysis results in CACHEDIR and reuse them for unchanged recordings and analysis parameters')
+    parser.add_argument('--cache-size', dest='cache_size', default=1000.0, type=float, metavar='MB',
+                        help='maximum size of the cache in megabytes, least recently used results are removed first (defaults to 1000)')
+    parser.add_argument('--cache-digest', dest='cache_digest', action='store_true',
+                        help='identify recordings in the cache by a digest of their content instead of their size and modification time')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='measure wall time, CPU time, and peak memory of each analysis stage and write them to a csv file for each recording')
     parser.add_argument('file', nargs='*', default='', type=str,
                         help='name of a file with time series data of an EOD recording')
     args = parser.parse_args()
@@ -1180,6 +1105,10 @@ def main():
         print('  > thunderfish -j -s -p -o results/ river1/*.wav')
         print('- analyze all wav files in the river1/ directory and write files to "results/river1/":')
         print('  > thunderfish -s -p -o results/ -k river1/*.wav')
+        print('- reanalyze all wav files, reusing results of unchanged files from a previous run:')
+        print('  > thunderfish -s --cache results/cache -o results/ river1/*.wav')
+        print('- analyze a file and write the time spent in each analysis stage to "data-profile.csv":')
+        print('  > thunderfish -s --profile data.wav')
         print('- write configuration file:')
         print('  > thunderfish -c')
         parser.exit()
@@ -1190,9 +1119,6 @@ def main():
     if verbose < plot_level+1:
         verbose = plot_level+1
 
-    # interactive plot:
-    plt.rcParams['keymap.quit'] = 'ctrl+w, alt+q, q'
-
     if args.save_config:
         # save configuration:
         file_name = args.file[0] if len(args.file) else ''
@@ -1211,10 +1137,18 @@ def main():
         spec_plots = True
     if len(args.save_subplots) > 0:
         args.save_plot = True
-    multi_pdf = None
     if len(args.multi_pdf) > 0:
         args.save_plot = True
-        args.jobs = None  # PdfPages does not work yet with mutliprocessing
+    # matplotlib is only imported if plots are requested:
+    if args.save_plot or not args.save_data or args.show_bestwindow or plot_level > 0:
+        import matplotlib
+        matplotlib.use('TkAgg')
+        import matplotlib.pyplot as plt
+        # interactive plot:
+        plt.rcParams['keymap.quit'] = 'ctrl+w, alt+q, q'
+    multi_pdf = None
+    if len(args.multi_pdf) > 0:
+        from matplotlib.backends.backend_pdf import PdfPages
         ext = os.path.splitext(args.multi_pdf)[1]
         if ext != os.extsep + 'pdf':
             args.multi_pdf += os.extsep + 'pdf'
@@ -1225,17 +1159,35 @@ def main():
             if verbose > 1:
                 print('mkdir %s' % args.outpath)
             os.makedirs(args.outpath)
+    # cache for analysis results:
+    cache = None
+    if len(args.cache) > 0:
+        cache = ResultCache(args.cache, args.cache_size, args.cache_digest)
     # run on pool:
     global pool_args
-    pool_args = (cfg, args.channel, args.log_freq, args.save_data,
-                 args.all_eods, spec_plots, args.save_plot, multi_pdf, args.save_subplots,
-                 args.outpath, args.keep_path, args.show_bestwindow, verbose-1, plot_level)
+    pool_args = dict(cfg=cfg, channel=args.channel, log_freq=args.log_freq,
+                     save_data=args.save_data, all_eods=args.all_eods,
+                     spec_plots=spec_plots, save_plot=args.save_plot,
+                     multi_pdf=multi_pdf, save_subplots=args.save_subplots,
+                     output_folder=args.outpath, keep_path=args.keep_path,
+                     show_bestwindow=args.show_bestwindow, cache=cache,
+                     profile=args.profile, verbose=verbose-1,
+                     plot_level=plot_level)
     if args.jobs is not None and (args.save_data or args.save_plot) and len(args.file) > 1:
         cpus = cpu_count() if args.jobs == 0 else args.jobs
         if verbose > 1:
             print('run on %d cpus' % cpus)
-        p = Pool(cpus)
-        p.map(run_thunderfish, args.file)
+        # workers pickle figures that are then added to the multi-page pdf:
+        worker_args = pool_args
+        if multi_pdf is not None:
+            worker_args = dict(pool_args, multi_pdf=FigurePages())
+        failed = run_pool(args.file, cpus, worker_args, args.timeout, args.max_tasks,
+                          progress=verbose > 0 or sys.stderr.isatty(),
+                          multi_pdf=multi_pdf)
+        if len(failed) > 0 and verbose > 0:
+            print('analysis of %d files failed:' % len(failed))
+            for f in failed:
+                print('  %s' % f)
     else:
         list(map(run_thunderfish, args.file))
     if multi_pdf is not None: